@@ -35,6 +35,15 @@ def main():
         return
     command_name = command.__name__
 
+    # Only generate_spls can be limited to some suppliers.
+    options = {}
+    if args.suppliers:
+        if command_name != "generate_spls":
+            print("Error: --supplier can only be used with generate-spls")
+            logging.error("--supplier given for command: " + args.command)
+            return
+        options["suppliers"] = args.suppliers
+
     # Configure logging level and verbosity.
     logging_level = logging.DEBUG if args.debug else logging.INFO
     if args.verbose:
@@ -50,7 +59,7 @@ def main():
     # Execute the command.
     print(f"pxi: {command_name}")
     logging.info(f"Started")
-    command(config)()
+    command(config)(**options)
 
     # Log the command execution time.
     duration = (perf_counter() - start_at)
@@ -71,6 +80,8 @@ def get_args():
         - config: the path to the config file. Defaults to "config.yml".
         - debug: flag to increase logging level to logging.DEBUG.
         - verbose: flag to print logs to stdout instead of writing to file.
+        - suppliers: the supplier codes to generate SPLs for, or None for
+          all suppliers.
         - force-imports: flag to force all files to be imported regardless of 
           when last import was completed.
     """
@@ -86,6 +97,10 @@ def get_args():
     parser.add_argument("--verbose",
                         help="print logs to terminal",
                         dest="verbose", action="store_true")
+    parser.add_argument("--supplier",
+                        help="only generate SPLs for this supplier code "
+                             "(can be repeated)",
+                        dest="suppliers", action="append")
     return parser.parse_args()
 
 
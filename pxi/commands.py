@@ -12,7 +12,8 @@ from time import perf_counter
 
 from pxi.config import Config
 from pxi.database import get_session
-from pxi.dataclasses import BuyPriceChange
+from pxi.dataclasses import BuyPriceChange, ImportFilters
+from pxi.datagrid import configure_datagrids
 from pxi.enum import ItemCondition, ItemType
 from pxi.exporters import (
     export_contract_item_task,
@@ -29,10 +30,13 @@ from pxi.exporters import (
     remove_exported_supplier_pricelists)
 from pxi.image import fetch_images
 from pxi.importers import (
+    configure_importers,
+    get_supplier_item_keys,
     import_data,
     import_supplier_pricelist_items,
     import_web_menu_item_mappings,
     import_missing_images_report)
+from pxi.metrics import write_ingest_metrics
 from pxi.models import (
     ContractItem,
     GTINItem,
@@ -51,6 +55,18 @@ from pxi.spl_update import update_supplier_items
 from pxi.web_update import update_product_menu
 
 
+# Inventory items that aren't sold, and that the commands never select.
+INACTIVE_ITEM_CONDITIONS = {
+    ItemCondition.DISCONTINUED,
+    ItemCondition.INACTIVE,
+}
+UNSTOCKED_ITEM_TYPES = {
+    ItemType.CROSS_REFERENCE,
+    ItemType.LABOUR,
+    ItemType.INDENT_ITEM,
+}
+
+
 class CommandBase:
     """
     Base class for commands. stores config and is callable.
@@ -58,10 +74,20 @@ class CommandBase:
 
     def __init__(self, config: Config):
         self.config = config
-        self.db_session = get_session(":memory:")
+        # Delta imports compare rows against the previous import, so they
+        # need a database that's kept between runs.
+        database = ":memory:"
+        if config.get("importers", {}).get("delta"):
+            database = config["paths"]["database"]
+        self.db_session = get_session(database)
+        configure_datagrids(config.get("datagrid", {}))
+        configure_importers(config.get("importers", {}))
 
     def __call__(self, **options):
         self.execute(options)
+        metrics_file = self.config.get("importers", {}).get("metrics_file")
+        if metrics_file:
+            write_ingest_metrics(metrics_file, type(self).__name__)
 
 
 class Commands:
@@ -92,14 +118,20 @@ class Commands:
 
         def execute(self, options):
 
-            # Import all data related to PriceRegionItems and ContractItems.
+            # Import all data related to PriceRegionItems and ContractItems,
+            # besides inactive items. PriceRegionItems with ignored price
+            # rules are still imported, as reports use the default region's
+            # prices whatever its rule.
+            filters = ImportFilters(
+                ignore_item_conditions=INACTIVE_ITEM_CONDITIONS,
+                ignore_item_types=UNSTOCKED_ITEM_TYPES)
             import_data(self.db_session, self.config["paths"]["imports"], [
                 InventoryItem,
                 WarehouseStockItem,
                 PriceRule,
                 PriceRegionItem,
                 ContractItem,
-            ])
+            ], filters=filters)
 
             # Select all PriceRegionItems that have a PriceRule and belong
             # to an active InventoryItem.
@@ -209,9 +241,13 @@ class Commands:
                 SupplierItem,
             ])
 
-            # Import SupplierPricelistItems.
+            # Import SupplierPricelistItems for known SupplierItems, only
+            # for the given suppliers if any were given.
+            suppliers = options.get("suppliers")
             supp_items = import_supplier_pricelist_items(
-                import_paths["supplier_pricelist"])
+                import_paths["supplier_pricelist"],
+                suppliers=set(suppliers) if suppliers else None,
+                keys=get_supplier_item_keys(self.db_session))
 
             # Update supplier prices and record BuyPriceChanges.
             bp_changes = update_supplier_items(
@@ -254,20 +290,25 @@ class Commands:
 
         def execute(self, options):
 
-            # Import all data related to SupplierItems.
+            # Import all data related to InventoryWebDataItems, besides
+            # inactive items.
             import_paths = self.config["paths"]["imports"]
-            import_data(self.db_session, import_paths, [
+            filters = ImportFilters(
+                ignore_item_conditions=INACTIVE_ITEM_CONDITIONS,
+                ignore_item_types=UNSTOCKED_ITEM_TYPES)
+            context = import_data(self.db_session, import_paths, [
                 InventoryItem,
                 WebMenuItem,
                 PriceRule,
                 PriceRegionItem,
                 InventoryWebDataItem,
-            ])
+            ], filters=filters)
 
             # Import mappings between PriceRules and WebMenuItems.
             wmi_mappings = import_web_menu_item_mappings(
                 import_paths["web_menu_mappings"],
-                self.db_session)
+                self.db_session,
+                context=context)
 
             # Select all InventoryWebDataItems that are related to an active
             # InventoryItem and PriceRule, but not a WebMenuItem.
@@ -315,12 +356,17 @@ class Commands:
 
         def execute(self, options):
 
-            # Import all data related to GTINItems.
+            # Import all data related to GTINItems, besides inactive items
+            # and brands that don't have barcodes.
             import_paths = self.config["paths"]["imports"]
+            filters = ImportFilters(
+                ignore_item_conditions=INACTIVE_ITEM_CONDITIONS,
+                ignore_item_types=UNSTOCKED_ITEM_TYPES,
+                ignore_brands=set(self.config["gtin"]["ignore_brands"]))
             import_data(self.db_session, import_paths, [
                 InventoryItem,
                 GTINItem,
-            ])
+            ], filters=filters)
 
             # Select all active, stocked InventoryItems besides those from
             # brands that don't have barcodes.
@@ -382,14 +428,15 @@ class Commands:
 
             # Import all data related to SupplierItems.
             import_paths = self.config["paths"]["imports"]
-            import_data(self.db_session, import_paths, [
+            context = import_data(self.db_session, import_paths, [
                 InventoryItem,
                 SupplierItem,
             ])
 
             # Get InventoryItems without an image.
             inv_items_no_image = import_missing_images_report(
-                import_paths["missing_images_report"], self.db_session)
+                import_paths["missing_images_report"], self.db_session,
+                context=context)
 
             # Fetch images for InventoryItems.
             export_paths = self.config["paths"]["exports"]
@@ -0,0 +1,74 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+from typing import Callable, Dict
+
+
+# Functions opening compressed files as streams, keyed by file extension.
+COMPRESSED_OPENERS: Dict[str, Callable] = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+
+def get_compression(filepath):
+    """
+    Gets the compression extension of a file, or None if the file isn't
+    compressed.
+    """
+    _, extension = os.path.splitext(os.fspath(filepath).lower())
+    return extension if extension in COMPRESSED_OPENERS else None
+
+
+def strip_compression(filepath):
+    """
+    Removes the compression extension from a path, so that the type of
+    file inside can be told from its name.
+    """
+    path = os.fspath(filepath)
+    if get_compression(path) is None:
+        return path
+    return os.path.splitext(path)[0]
+
+
+def open_file(filepath, mode: str = "rb", **kwargs):
+    """
+    Opens a file, decompressing it as it's read if it has the extension of
+    a compressed file.
+
+    Params:
+        filepath: The path to the file.
+        mode: The mode to open the file in, "rb" or "rt".
+        **kwargs: Passed to open() or the decompressing opener, such as the
+            encoding and newline of text files.
+
+    Returns:
+        The file object.
+    """
+    compression = get_compression(filepath)
+    if compression is None:
+        return open(filepath, mode, **kwargs)
+    return COMPRESSED_OPENERS[compression](filepath, mode, **kwargs)
+
+
+def open_seekable(filepath):
+    """
+    Opens a binary file for random access, decompressing the whole file
+    into memory first if it's compressed.
+
+    Seeking backwards in a compressed stream decompresses it again from the
+    start, so archives such as XLSX workbooks are read from memory instead.
+
+    Params:
+        filepath: The path to the file.
+
+    Returns:
+        The path to the file if it isn't compressed, or else a file object.
+    """
+    if get_compression(filepath) is None:
+        return filepath
+    with open_file(filepath) as file:
+        return io.BytesIO(file.read())
@@ -41,6 +41,7 @@ class RemotePathsConfig(TypedDict):
 
 
 class PathsConfig(TypedDict):
+    database: str
     logging: str
     imports: ImportPathsConfig
     exports: ExportPathsConfig
@@ -65,12 +66,29 @@ class GTINConfig(TypedDict):
     ignore_brands: List[str]
 
 
+class DatagridConfig(TypedDict, total=False):
+    cache: bool
+    reader: str
+    encoding: str
+
+
+class ImportersConfig(TypedDict, total=False):
+    workers: int
+    batch_size: int
+    delta: bool
+    metrics_file: str
+    pipeline: bool
+    queue_size: int
+
+
 class Config(TypedDict):
     paths: PathsConfig
     ssh: SSHConfig
     price_rules: PriceRulesConfig
     bin_locations: BinLocationsConfig
     gtin: GTINConfig
+    datagrid: DatagridConfig
+    importers: ImportersConfig
 
 
 def load_config(filepath: str):
@@ -1,8 +1,9 @@
 
 from dataclasses import dataclass, field
 from decimal import Decimal
-from typing import List
+from typing import List, Set
 
+from pxi.enum import ItemCondition, ItemType
 from pxi.models import InventoryItem, PriceRegionItem, SupplierItem
 
 
@@ -68,3 +69,31 @@ class UOMError:
 class InventoryItemImageFile:
     inventory_item: InventoryItem
     filename: str
+
+
+@dataclass
+class ImportFilters:
+    """
+    Rows to drop while importing data, because the command importing them
+    never selects them. The default filters drop nothing.
+    """
+    ignore_item_conditions: Set[ItemCondition] = field(default_factory=set)
+    ignore_item_types: Set[ItemType] = field(default_factory=set)
+    ignore_brands: Set[str] = field(default_factory=set)
+    # The warehouses to import stock for, or None for all warehouses.
+    warehouses: Set[str] | None = None
+
+    def drops_inventory_item(
+            self,
+            item_type: ItemType,
+            condition: ItemCondition,
+            brand: str | None):
+        return (
+            item_type in self.ignore_item_types
+            or condition in self.ignore_item_conditions
+            or brand in self.ignore_brands)
+
+    def drops_warehouse(self, warehouse_code: str):
+        return (
+            self.warehouses is not None
+            and warehouse_code not in self.warehouses)
@@ -1,61 +1,681 @@
-
+import csv
+from datetime import date, datetime, time, timedelta
+import hashlib
+import json
+import logging
+from operator import itemgetter
+import os
 import re
-from typing import Any, Dict, List
+import shutil
+import struct
+from tempfile import TemporaryFile
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+import zlib
 from openpyxl import Workbook, load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
 
+from pxi.compression import open_file, open_seekable, strip_compression
+from pxi.config import DatagridConfig
+from pxi.metrics import record_parse
+from pxi.schema import Schema, convert_columns, convert_rows, get_converters
+from pxi.xlsx import iter_xlsx_rows
+
 
 DatagridRow = Dict[str, Any]
+DatagridValues = Tuple[Any, ...]
+DatagridColumns = Tuple[List[str], List[List[Any]]]
+
+
+# Options for reading datagrids, set from config by configure_datagrids().
+DATAGRID_OPTIONS: DatagridConfig = {
+    "cache": False,
+    "reader": "openpyxl",
+    "encoding": "utf-8-sig",
+}
+
+# Datagrids with these extensions are read as delimited text.
+TEXT_EXTENSIONS = (".csv", ".tsv", ".txt")
+
+# The delimiters recognised in text datagrids.
+TEXT_DELIMITERS = ",\t;|"
+
+
+# Cached datagrids are saved next to the datagrid with this suffix.
+CACHE_SUFFIX = ".pxicache"
+
+# Identifies the cache file format. Bump the version if the layout changes.
+CACHE_MAGIC = b"PXIDGC02"
 
+# Cached rows are written to the cache in chunks of this many rows.
+CACHE_CHUNK_SIZE = 1000
 
-def load_rows(filepath, worksheet_name: str | None = None):
+# Cached values of these types are saved as a JSON object with one key,
+# since JSON has no type for them.
+CACHE_TYPES = {
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "timedelta": lambda value: timedelta(*value),
+}
+
+
+def configure_datagrids(config: DatagridConfig):
+    """
+    Sets options for reading datagrids.
+
+    Params:
+        config: The datagrid section of the config.
+    """
+    DATAGRID_OPTIONS.update(config)
+
+
+def load_rows(
+        filepath,
+        worksheet_name: str | None = None,
+        columns: Sequence[str] | None = None,
+        schema: Schema | None = None):
     """
     Read data from XLSX datagrid.
     """
-    workbook: Workbook = load_workbook(filename=filepath, read_only=True)
+    return list(iter_rows(filepath, worksheet_name, columns, schema))
+
+
+def iter_rows(
+        filepath,
+        worksheet_name: str | None = None,
+        columns: Sequence[str] | None = None,
+        schema: Schema | None = None):
+    """
+    Read data from XLSX datagrid one row at a time.
+
+    The workbook stays open until the generator is exhausted or closed, so
+    only the current row is held in memory. If columns are given, each row
+    only contains those columns and the reader skips decoding the others
+    where it can. If a schema is given, values are converted by the
+    converter for their column, and the columns default to those in the
+    schema.
+
+    The rows read and the time spent reading them are recorded in the
+    ingest metrics for the file.
+    """
+    if schema is not None and columns is None:
+        columns = list(schema)
+    row_count = 0
+    parse_seconds = 0.0
+    started_at = perf_counter()
+    try:
+        values = iter_values(filepath, worksheet_name, columns, schema)
+        fieldnames = next(values)
+        for row_values in values:
+            row = dict(zip(fieldnames, row_values))
+            row_count += 1
+            parse_seconds += perf_counter() - started_at
+            yield row
+            started_at = perf_counter()
+        parse_seconds += perf_counter() - started_at
+    finally:
+        record_parse(filepath, row_count, parse_seconds)
+
+
+def read_columns(
+        filepath,
+        worksheet_name: str | None = None,
+        schema: Schema | None = None,
+        options: DatagridConfig | None = None) -> DatagridColumns:
+    """
+    Read a datagrid into lists of column values.
+
+    Columns pickle far more compactly than a dict for each row, so this is
+    used to parse datagrids in worker processes.
 
-    # Use the first worksheet by default.
-    if worksheet_name is None:
-        worksheet_name = str(workbook.get_sheet_names()[0])
-    worksheet: Worksheet = workbook.get_sheet_by_name(worksheet_name)
-    rows = read_rows(worksheet)
-    workbook.close()
-    return rows
+    Params:
+        filepath: The path to the datagrid.
+        worksheet_name: The name of the worksheet.
+        schema: The columns to read and their converters.
+        options: Datagrid options to set before reading, since worker
+            processes don't necessarily inherit them.
+
+    Returns:
+        A tuple containing the list of fieldnames and a list of values for
+        each column.
+    """
+    if options is not None:
+        configure_datagrids(options)
+    started_at = perf_counter()
+    columns = list(schema) if schema is not None else None
+    values = iter_values(filepath, worksheet_name, columns, schema)
+    fieldnames = next(values)
+    column_values = [list(column) for column in zip(*values)]
+    if not column_values:
+        column_values = [[] for _ in fieldnames]
+    record_parse(
+        filepath, len(column_values[0]) if column_values else 0,
+        perf_counter() - started_at)
+    return fieldnames, column_values
+
+
+def iter_column_rows(datagrid_columns: DatagridColumns):
+    """
+    Yield a dict for each row of a datagrid read by read_columns().
+    """
+    fieldnames, column_values = datagrid_columns
+    for row_values in zip(*column_values):
+        yield dict(zip(fieldnames, row_values))
+
+
+def iter_values(
+        filepath,
+        worksheet_name: str | None = None,
+        columns: Sequence[str] | None = None,
+        schema: Schema | None = None):
+    """
+    Read fieldnames and then row values from XLSX datagrid.
+
+    The first item yielded is the list of fieldnames, and each following
+    item is a tuple of values for one row. When caching is enabled the rows
+    are read from the cache file if the datagrid hasn't changed, or else
+    every column is read from the workbook and written to the cache as the
+    rows are yielded. The cache file is saved once all rows have been read.
+    The cache holds raw values, and the schema is applied after loading.
+    """
+    if not DATAGRID_OPTIONS["cache"]:
+        values = iter_workbook_values(filepath, worksheet_name, columns)
+        yield from convert_values(values, schema)
+        return
+
+    # Read the rows from the cache file if it matches the datagrid,
+    # converting each column in one pass.
+    cache_filepath = f"{filepath}{CACHE_SUFFIX}"
+    cached = load_cache(cache_filepath, filepath, worksheet_name, columns)
+    if cached is not None:
+        fieldnames, cached_columns = cached
+        if schema is not None:
+            cached_columns = convert_columns(
+                cached_columns, get_converters(fieldnames, schema))
+        yield fieldnames
+        yield from zip(*cached_columns)
+        return
+
+    # Read every column from the workbook so that the cache can be used for
+    # any set of columns, writing the rows to the cache as they're read.
+    values = iter_workbook_values(filepath, worksheet_name)
+    fieldnames = next(values)
+    projected_fieldnames, project = get_projection(fieldnames, columns)
+    converters = None
+    if schema is not None:
+        converters = get_converters(projected_fieldnames, schema)
+    yield projected_fieldnames
+    with CacheWriter(fieldnames) as cache_writer:
+        for row_values in values:
+            cache_writer.write(row_values)
+            row_values = project(row_values)
+            if converters is not None:
+                row_values = tuple([
+                    convert(value)
+                    for convert, value in zip(converters, row_values)])
+            yield row_values
+        cache_writer.save(cache_filepath, filepath, worksheet_name)
+
+
+def convert_values(values: Iterator, schema: Schema | None):
+    """
+    Applies a schema to fieldnames and row values read from a datagrid.
+    """
+    fieldnames = next(values)
+    yield fieldnames
+    if schema is None:
+        yield from values
+    else:
+        yield from convert_rows(values, get_converters(fieldnames, schema))
+
+
+def iter_workbook_values(
+        filepath,
+        worksheet_name: str | None = None,
+        columns: Sequence[str] | None = None):
+    """
+    Read fieldnames and then row values from worksheet in XLSX datagrid,
+    using the reader selected in the datagrid options. Delimited text
+    datagrids are read with the text reader instead. Datagrids compressed
+    with gzip, bzip2 or xz (.gz, .bz2 or .xz) are decompressed as they're
+    read.
+    """
+    reader = DATAGRID_OPTIONS["reader"]
+    if is_text_datagrid(filepath):
+        yield from iter_text_values(filepath, columns)
+    elif reader == "openpyxl":
+        yield from iter_openpyxl_values(filepath, worksheet_name, columns)
+    elif reader == "native":
+        yield from iter_native_values(filepath, worksheet_name, columns)
+    else:
+        raise ValueError(f"Unknown datagrid reader: {reader}")
+
+
+def iter_openpyxl_values(
+        filepath,
+        worksheet_name: str | None = None,
+        columns: Sequence[str] | None = None):
+    """
+    Read fieldnames and then row values from worksheet using openpyxl.
+    """
+    workbook: Workbook = load_workbook(
+        filename=open_seekable(filepath), read_only=True)
+    try:
+        # Use the first worksheet by default.
+        if worksheet_name is None:
+            worksheet_name = str(workbook.get_sheet_names()[0])
+        worksheet: Worksheet = workbook.get_sheet_by_name(worksheet_name)
+        yield from iter_worksheet_values(worksheet, columns)
+    finally:
+        workbook.close()
+
+
+def iter_native_values(
+        filepath,
+        worksheet_name: str | None = None,
+        columns: Sequence[str] | None = None):
+    """
+    Read fieldnames and then row values from worksheet by parsing the
+    worksheet XML directly. Cells outside the selected columns are not
+    decoded.
+    """
+    def select_columns(header: Sequence[Any]):
+        fieldnames = parse_fieldnames(header)
+        indexes = get_column_indexes(fieldnames, columns)
+        if indexes is None:
+            return None
+        # The first column is always read to find the end of the datagrid.
+        return set(indexes) | {0}
+
+    rows = iter_xlsx_rows(
+        open_seekable(filepath), worksheet_name, select_columns)
+    yield from iter_datagrid_values(rows, columns)
+
+
+def is_text_datagrid(filepath):
+    """
+    Checks whether a datagrid is a delimited text file, by its extension.
+    The extension of a compressed file is ignored.
+    """
+    return strip_compression(filepath).lower().endswith(TEXT_EXTENSIONS)
+
+
+def iter_text_values(
+        filepath,
+        columns: Sequence[str] | None = None):
+    """
+    Read fieldnames and then row values from a delimited text datagrid.
+
+    Values are strings, except that empty values are None as they are in
+    XLSX datagrids. Use a schema to convert them to other types.
+    """
+    encoding = DATAGRID_OPTIONS["encoding"]
+    with open_file(
+            filepath, "rt", encoding=encoding, newline="") as file:
+        delimiter = sniff_delimiter(file, filepath)
+        rows = (
+            tuple([value or None for value in values])
+            for values in csv.reader(file, delimiter=delimiter))
+        yield from iter_datagrid_values(rows, columns)
+
+
+def sniff_delimiter(file, filepath):
+    """
+    Detects the delimiter of a text datagrid from its header row, then
+    rewinds the file.
+
+    The header names every column, so the delimiter is the candidate that
+    appears most often in it. Falls back to tabs for .tsv files and commas
+    for other files if the header contains none of them.
+    """
+    header = file.readline()
+    file.seek(0)
+    counts = {
+        delimiter: header.count(delimiter)
+        for delimiter in TEXT_DELIMITERS}
+    delimiter = max(counts, key=counts.__getitem__)
+    if counts[delimiter] > 0:
+        return delimiter
+    if strip_compression(filepath).lower().endswith(".tsv"):
+        return "\t"
+    return ","
 
 
 def read_rows(worksheet: Worksheet):
     """
     Read rows from worksheet.
     """
-    rows: List[DatagridRow] = []
-    fieldnames = get_fieldnames(worksheet)
-    for row in worksheet.iter_rows(min_row=2):
-        if row[0].value is None:
-            return rows
-        values: DatagridRow = {}
-        for i, fieldname in enumerate(fieldnames):
-            values[fieldname] = row[i].value
-        rows.append(values)
-    return rows
+    return list(iter_worksheet_rows(worksheet))
+
+
+def iter_worksheet_rows(worksheet: Worksheet) -> Iterator[DatagridRow]:
+    """
+    Read rows from worksheet one at a time.
+    """
+    values = iter_worksheet_values(worksheet)
+    fieldnames = next(values)
+    for row_values in values:
+        yield dict(zip(fieldnames, row_values))
+
+
+def iter_worksheet_values(
+        worksheet: Worksheet,
+        columns: Sequence[str] | None = None):
+    """
+    Read fieldnames and then row values from worksheet.
+    """
+    rows = worksheet.iter_rows(values_only=True)
+    yield from iter_datagrid_values(rows, columns)
+
+
+def iter_datagrid_values(
+        rows: Iterator[Sequence[Any]],
+        columns: Sequence[str] | None = None):
+    """
+    Read fieldnames from the first row and then the values of each
+    following row.
+
+    Each row is trimmed or padded to the number of fieldnames, then reduced
+    to the selected columns. Reading stops at the first row without a value
+    in the first column.
+    """
+    fieldnames = parse_fieldnames(next(rows, ()))
+    projected_fieldnames, project = get_projection(fieldnames, columns)
+    yield projected_fieldnames
+    width = len(fieldnames)
+    for values in rows:
+        if not values or values[0] is None:
+            return
+        if len(values) < width:
+            values = tuple(values) + (None,) * (width - len(values))
+        yield project(values)
+
+
+def get_column_indexes(
+        fieldnames: List[str],
+        columns: Sequence[str] | None):
+    """
+    Find the indexes of the selected columns that exist in the datagrid.
+
+    Returns:
+        The list of indexes, or None if no columns were selected.
+    """
+    if columns is None:
+        return None
+    positions = {
+        fieldname: index for index, fieldname in enumerate(fieldnames)}
+    return [positions[column] for column in columns if column in positions]
+
+
+def get_projection(
+        fieldnames: List[str],
+        columns: Sequence[str] | None):
+    """
+    Make a function that reduces row values to the selected columns.
+
+    Columns that don't exist in the datagrid are left out, so rows have the
+    same keys they would have without a selection.
+
+    Returns:
+        A tuple containing the selected fieldnames and the function.
+    """
+    indexes = get_column_indexes(fieldnames, columns)
+    if indexes is None:
+        width = len(fieldnames)
+        return fieldnames, lambda values: tuple(values[:width])
+    projected_fieldnames = [fieldnames[index] for index in indexes]
+    if not indexes:
+        return projected_fieldnames, lambda values: ()
+    if len(indexes) == 1:
+        index = indexes[0]
+        return projected_fieldnames, lambda values: (values[index],)
+    return projected_fieldnames, itemgetter(*indexes)
 
 
 def get_fieldnames(worksheet: Worksheet):
     """
     Parse snakecase fieldnames from first row of sheet.
     """
+    header = next(
+        worksheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    return parse_fieldnames(header)
+
+
+def parse_fieldnames(header: Sequence[Any]):
+    """
+    Convert header values to snakecase fieldnames, up to the first empty
+    header.
+    """
     fieldnames: List[str] = []
-    col_index = 0
-    reached_last_column = False
-    while not reached_last_column:
-        value = worksheet.cell(1, col_index + 1).value
+    for value in header:
         if value is None:
-            reached_last_column = True
-        else:
-            fieldnames.append(snakecase(value))
-            col_index += 1
+            break
+        fieldnames.append(snakecase(value))
     return fieldnames
 
 
+def get_fingerprint(filepath, worksheet_name: str | None, content=True):
+    """
+    Identifies the contents of a datagrid file.
+
+    Params:
+        filepath: The path to the datagrid.
+        worksheet_name: The name of the worksheet that was read.
+        content: Whether to include a hash of the file contents.
+
+    Returns:
+        A dict containing the path, size, modification time and (optionally)
+        the SHA1 hash of the file.
+    """
+    stat = os.stat(filepath)
+    fingerprint = {
+        "path": os.path.abspath(filepath),
+        "worksheet_name": worksheet_name,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+    if content:
+        digest = hashlib.sha1()
+        with open(filepath, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        fingerprint["sha1"] = digest.hexdigest()
+    return fingerprint
+
+
+def load_cache(
+        cache_filepath,
+        filepath,
+        worksheet_name: str | None,
+        columns: Sequence[str] | None = None):
+    """
+    Loads cached rows for a datagrid.
+
+    The cache file contains a JSON header followed by one compressed block
+    of JSON per column, so only the blocks for the selected columns are
+    decompressed. The cheap parts of the fingerprint are compared before
+    hashing the datagrid.
+
+    Params:
+        cache_filepath: The path to the cache file.
+        filepath: The path to the datagrid.
+        worksheet_name: The name of the worksheet to read.
+        columns: The columns to load. Defaults to all columns.
+
+    Returns:
+        A tuple containing the fieldnames and the list of columns, or None if
+        there is no usable cache for the datagrid.
+    """
+    try:
+        with open(cache_filepath, "rb") as file:
+            if file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            (header_size,) = struct.unpack("<Q", file.read(8))
+            header = json.loads(file.read(header_size))
+            fingerprint = get_fingerprint(
+                filepath, worksheet_name, content=False)
+            cached_fingerprint = dict(header["fingerprint"])
+            cached_sha1 = cached_fingerprint.pop("sha1")
+            if cached_fingerprint != fingerprint:
+                return None
+            fingerprint = get_fingerprint(filepath, worksheet_name)
+            if fingerprint["sha1"] != cached_sha1:
+                return None
+            fieldnames = header["fieldnames"]
+            indexes = get_column_indexes(fieldnames, columns)
+            if indexes is None:
+                indexes = list(range(len(fieldnames)))
+            offsets = [file.tell()]
+            for size in header["column_sizes"]:
+                offsets.append(offsets[-1] + size)
+            loaded_columns = []
+            for index in indexes:
+                file.seek(offsets[index])
+                block = file.read(header["column_sizes"][index])
+                loaded_columns.append(json.loads(
+                    zlib.decompress(block), object_hook=decode_cache_value))
+    except FileNotFoundError:
+        return None
+    except (OSError, KeyError, TypeError, ValueError, struct.error,
+            zlib.error) as error:
+        logging.debug(f"Ignoring unreadable cache {cache_filepath}: {error}")
+        return None
+    logging.debug(f"Loaded datagrid from cache: {filepath}")
+    return [fieldnames[index] for index in indexes], loaded_columns
+
+
+class CacheWriter:
+    """
+    Writes the rows of a datagrid to a cache file as they're read, so that
+    the rows don't have to be kept in memory until the cache is saved.
+
+    Each column is written as a compressed block of JSON to its own
+    temporary file, in chunks of CACHE_CHUNK_SIZE rows, and the blocks are
+    copied into the cache file by save(). Use as a context manager to
+    remove the temporary files. If a value can't be cached, or a temporary
+    file can't be written, the cache isn't saved.
+
+    Params:
+        fieldnames: The datagrid fieldnames.
+    """
+
+    def __init__(self, fieldnames: List[str]):
+        self.fieldnames = fieldnames
+        self.blocks: List[Any] = []
+        self.compressors = [zlib.compressobj() for _ in fieldnames]
+        self.encoder = json.JSONEncoder(
+            default=encode_cache_value, separators=(",", ":"))
+        self.chunk: List[DatagridValues] = []
+        self.started = False  # Whether any values have been written.
+        self.error: Exception | None = None
+
+    def __enter__(self):
+        try:
+            for compressor in self.compressors:
+                block = TemporaryFile()
+                self.blocks.append(block)
+                block.write(compressor.compress(b"["))
+        except OSError as error:
+            self.error = error
+        return self
+
+    def __exit__(self, *exc_info):
+        for block in self.blocks:
+            block.close()
+
+    def write(self, row_values: DatagridValues):
+        """
+        Adds a row to the cache.
+        """
+        if self.error is not None:
+            return
+        self.chunk.append(row_values)
+        if len(self.chunk) >= CACHE_CHUNK_SIZE:
+            self.write_chunk()
+
+    def write_chunk(self):
+        """
+        Appends the values of the rows in the current chunk to the block of
+        each column, and releases the chunk.
+        """
+        try:
+            for index, (block, compressor) in enumerate(
+                    zip(self.blocks, self.compressors)):
+                data = self.encoder.encode([
+                    values[index] for values in self.chunk])[1:-1].encode()
+                if self.started:
+                    data = b"," + data
+                block.write(compressor.compress(data))
+        except (OSError, TypeError, ValueError) as error:
+            self.error = error
+        self.started = True
+        self.chunk = []
+
+    def save(self, cache_filepath, filepath, worksheet_name: str | None):
+        """
+        Saves the cache file once every row has been written.
+
+        Params:
+            cache_filepath: The path to the cache file.
+            filepath: The path to the datagrid.
+            worksheet_name: The name of the worksheet that was read.
+        """
+        if self.chunk:
+            self.write_chunk()
+        temp_filepath = f"{cache_filepath}.tmp"
+        try:
+            if self.error is not None:
+                raise self.error
+            column_sizes = []
+            for block, compressor in zip(self.blocks, self.compressors):
+                block.write(compressor.compress(b"]"))
+                block.write(compressor.flush())
+                column_sizes.append(block.tell())
+            header = json.dumps({
+                "fingerprint": get_fingerprint(filepath, worksheet_name),
+                "fieldnames": self.fieldnames,
+                "column_sizes": column_sizes,
+            }).encode()
+
+            # Write to a temporary file first so a partial cache is never
+            # read.
+            with open(temp_filepath, "wb") as file:
+                file.write(CACHE_MAGIC)
+                file.write(struct.pack("<Q", len(header)))
+                file.write(header)
+                for block in self.blocks:
+                    block.seek(0)
+                    shutil.copyfileobj(block, file)
+            os.replace(temp_filepath, cache_filepath)
+        except (OSError, TypeError, ValueError) as error:
+            logging.warning(f"Could not save cache {cache_filepath}: {error}")
+
+
+def encode_cache_value(value: Any):
+    """
+    Converts a datagrid value that JSON has no type for to a JSON object.
+    """
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"date": value.isoformat()}
+    if isinstance(value, time):
+        return {"time": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"timedelta": [
+            value.days, value.seconds, value.microseconds]}
+    raise TypeError(f"Can't cache {type(value).__name__} values")
+
+
+def decode_cache_value(value: Dict[str, Any]):
+    """
+    Converts a JSON object saved by encode_cache_value() back to a value.
+    """
+    ((type_name, encoded),) = value.items()
+    return CACHE_TYPES[type_name](encoded)
+
+
 def snakecase(value: str):
     """
     Converts datagrid header to snakecase.
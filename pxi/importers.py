@@ -1,108 +1,803 @@
+from collections import Counter, defaultdict
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, wait)
 import csv
 from datetime import datetime
 from decimal import Decimal
+import hashlib
+import json
 import logging
+import mmap
 import os
+import pickle
+import sqlite3
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from operator import itemgetter
 from os import PathLike
-from typing import Any, Callable, Dict, List, Literal, Tuple, Type
+from queue import Empty
+from time import perf_counter
+from typing import (
+    Any, Callable, Dict, Iterable, List, Literal, Sequence, Set, Tuple,
+    Type)
+from sqlalchemy import (
+    UniqueConstraint, and_, case, delete, event, func, or_, tuple_, update)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm.session import Session
 
-from pxi.config import ImportPathsConfig
-from pxi.dataclasses import SupplierPricelistItem
-from pxi.datagrid import load_rows
+from pxi.compression import get_compression, open_file
+from pxi.config import ImportersConfig, ImportPathsConfig
+from pxi.dataclasses import ImportFilters, SupplierPricelistItem
+from pxi.datagrid import (
+    DATAGRID_OPTIONS,
+    DatagridColumns,
+    DatagridRow,
+    configure_datagrids,
+    get_fingerprint,
+    iter_column_rows,
+    iter_rows,
+    read_columns)
 from pxi.enum import (
     ItemType,
     ItemCondition,
     PriceBasis,
     TaxCode,
     WebStatus)
+from pxi.metrics import (
+    collect_ingest_metrics,
+    measure_import,
+    merge_ingest_metrics,
+    record_parse)
 from pxi.models import (
     Base,
     ContractItem,
+    DecimalString,
     File,
     InventoryItem,
     InventoryWebDataItem,
     GTINItem,
     PriceRegionItem,
     PriceRule,
+    RowHash,
     SupplierItem,
     WarehouseStockItem,
     WebMenuItem)
+from pxi.schema import (
+    DateConverter,
+    DecimalConverter,
+    EnumConverter,
+    IntConverter,
+    Schema,
+    StrConverter)
 from pxi.spl_update import SPL_FIELDNAMES
 
 
-def get_inventory_items(db_session: Session):
+# Options for importing data, set from config by configure_importers().
+# Zero workers means one worker process for each CPU.
+IMPORT_OPTIONS: ImportersConfig = {
+    "workers": 0,
+    "batch_size": 5000,
+    "delta": False,
+    "pipeline": False,
+    "queue_size": 10000,
+}
+
+# SQLite's default limit on the number of parameters in a query.
+QUERY_MAX_PARAMETERS = 999
+
+# Pipelined imports pass rows between processes in chunks of this many rows.
+PIPELINE_CHUNK_SIZE = 500
+
+# Pipelined imports check that the worker process is still running this
+# often while waiting for rows.
+PIPELINE_POLL_SECONDS = 1.0
+
+# Datagrids at least this large are streamed by each importer reading them
+# rather than parsed into memory, so that memory use doesn't grow with them.
+STREAM_MIN_BYTES = 32 * 1024 * 1024
+
+# The columns identifying each imported model's records, matching the
+# model's unique constraint.
+KEY_COLUMNS: Dict[Type[Base], Sequence[str]] = {
+    ContractItem: ["code", "inventory_item_id"],
+    GTINItem: ["code", "inventory_item_id"],
+    InventoryItem: ["code"],
+    InventoryWebDataItem: ["inventory_item_id"],
+    PriceRegionItem: ["code", "inventory_item_id"],
+    PriceRule: ["code"],
+    SupplierItem: ["code", "inventory_item_id"],
+    WarehouseStockItem: ["code", "inventory_item_id"],
+    WebMenuItem: ["parent_name", "child_name"],
+}
+
+
+def query_by_keys(
+        db_session: Session,
+        model: Type[Base],
+        key_columns: Sequence[str],
+        keys: Iterable[Tuple]):
     """
-    Builds a hashmap of all InventoryItems in the database, keyed by code.
+    Queries the records matching any of the given keys, in chunks small
+    enough to stay under SQLite's limit on query parameters.
+
+    Params:
+        db_session: The database session.
+        model: The SQLAlchemy model.
+        key_columns: The names of the columns making up each key.
+        keys: Tuples of key column values.
+
+    Returns:
+        A generator yielding the matching records.
     """
-    return {inv_item.code: inv_item
-            for inv_item in db_session.query(InventoryItem).all()}
+    columns = [getattr(model, name) for name in key_columns]
+    chunk_size = QUERY_MAX_PARAMETERS // len(columns)
+    keys = list(keys)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        if len(columns) == 1:
+            condition = columns[0].in_([key[0] for key in chunk])
+        else:
+            condition = tuple_(*columns).in_(chunk)
+        yield from db_session.query(model).filter(condition)
 
 
-def get_upserter(db_session: Session, model: Type[Base], records: Dict[str, Base]):
+def get_unique_keys(model: Type[Base]):
+    """
+    Lists the sets of columns with a unique constraint on a model's table.
     """
-    Creates an upsert function for a given model and records.
+    table = model.__table__
+    unique_keys = [
+        frozenset(column.name for column in constraint.columns)
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)]
+    unique_keys.extend(
+        frozenset([column.name]) for column in table.columns
+        if column.unique)
+    return unique_keys
+
+
+# The columns that other records look up each model by, such as the item
+# codes in datagrid rows. Keys of several columns are joined with "/".
+LOOKUP_COLUMNS: Dict[Type[Base], Sequence[str]] = {
+    InventoryItem: ["code"],
+    PriceRule: ["code"],
+    WebMenuItem: ["parent_name", "child_name"],
+}
+
+
+class ImportContext:
+    """
+    Lookups of records shared by the importers run together, so that each
+    lookup is queried once rather than by every importer.
+
+    Each lookup is loaded the first time it is needed, and is then kept up
+    to date by the upserters as they insert or remove records. The context
+    also holds the filters the importers drop rows with.
+
+    Filters are ignored in delta mode, since every command imports into the
+    same database, and a row dropped by one command's filters would remove
+    the record another command imported.
 
     Params:
-        db_session: The SQLAlchemy database session.
-        model: The SQLAlchemy model.
-        records: A dict containing all records.
+        db_session: The database session.
+        filters: The rows to drop. Defaults to dropping nothing.
+    """
 
-    Returns:
-        The upsert function.
+    def __init__(
+            self,
+            db_session: Session,
+            filters: ImportFilters | None = None):
+        self.db_session = db_session
+        if filters is None or IMPORT_OPTIONS["delta"]:
+            filters = ImportFilters()
+        self.filters = filters
+        self.ids: Dict[Type[Base], Dict[Any, int]] = {}
+        self.records: Dict[Type[Base], Dict[Any, Base]] = {}
+
+    def get_ids(self, model: Type[Base]):
+        """
+        Gets a hashmap of the ids of a model's records, keyed by the
+        model's LOOKUP_COLUMNS.
+        """
+        if model not in self.ids:
+            self.ids[model] = {}
+            self.load(model)
+        return self.ids[model]
+
+    def get_records(self, model: Type[Base]):
+        """
+        Gets a hashmap of a model's records, keyed by the model's
+        LOOKUP_COLUMNS.
+        """
+        if model not in self.records:
+            self.records[model] = {}
+            self.load(model)
+        return self.records[model]
+
+    def load(self, model: Type[Base], min_id: int = 0):
+        """
+        Adds the records with ids above min_id to the lookups already
+        loaded for a model.
+        """
+        columns = [getattr(model, name) for name in LOOKUP_COLUMNS[model]]
+        ids = self.ids.get(model)
+        records = self.records.get(model)
+        if records is not None:
+            query = self.db_session.query(model)
+        elif ids is not None:
+            query = self.db_session.query(model.id, *columns)
+        else:
+            return
+        for result in query.filter(model.id > min_id):
+            values = [getattr(result, column.key) for column in columns]
+            key = values[0] if len(values) == 1 else "/".join(values)
+            if ids is not None:
+                ids[key] = result.id
+            if records is not None:
+                records[key] = result
+
+    def resolve(self, model: Type[Base], keys: Iterable[Any]):
+        """
+        Looks up records by the model's LOOKUP_COLUMNS, from the loaded
+        records if there are any, or else in chunked queries.
+
+        Params:
+            model: The SQLAlchemy model.
+            keys: The keys to look up. Keys of several columns are joined
+                with "/".
+
+        Returns:
+            A dict of the records found, keyed by lookup key.
+        """
+        keys = set(keys)
+        records = self.records.get(model)
+        if records is not None:
+            return {key: records[key] for key in keys if key in records}
+        key_columns = LOOKUP_COLUMNS[model]
+        key_tuples = []
+        for key in keys:
+            values = tuple(key.split("/")) if len(key_columns) > 1 else (key,)
+            if len(values) == len(key_columns):
+                key_tuples.append(values)
+        resolved = {}
+        for record in query_by_keys(
+                self.db_session, model, key_columns, key_tuples):
+            values = [getattr(record, name) for name in key_columns]
+            key = "/".join(values) if len(values) > 1 else values[0]
+            resolved[key] = record
+        return resolved
+
+    def add_inserted(self, model: Type[Base], last_id: int):
+        """
+        Adds the records inserted after the record with last_id to the
+        lookups for a model.
+        """
+        if model in LOOKUP_COLUMNS:
+            self.load(model, last_id)
+
+    def forget(self, model: Type[Base]):
+        """
+        Drops the lookups for a model, so they are loaded again when next
+        needed.
+        """
+        self.ids.pop(model, None)
+        self.records.pop(model, None)
+
+
+# The most unknown keys listed in the log by log_unknown_keys().
+UNKNOWN_KEYS_LOGGED = 10
+
+
+def log_unknown_keys(name: str, keys: Iterable[Any]):
+    """
+    Logs a summary of the keys in an import file that matched no record.
     """
-    def upsert(key: str, attributes: Dict[str, Any]):
+    keys = sorted(str(key) for key in keys if key is not None)
+    if not keys:
+        return
+    listed = ", ".join(keys[:UNKNOWN_KEYS_LOGGED])
+    if len(keys) > UNKNOWN_KEYS_LOGGED:
+        listed += f" and {len(keys) - UNKNOWN_KEYS_LOGGED} more"
+    logging.warning(f"Import {name}: {len(keys)} unknown keys: {listed}.")
+
+
+def encode_key(key: Tuple):
+    """
+    Encodes a record key as text, for storing with the record's row hash.
+    """
+    return json.dumps(key)
+
+
+def hash_row(attributes: Dict[str, Any]):
+    """
+    Hashes the attributes imported from a datagrid row.
+    """
+    return hashlib.sha1(repr(tuple(attributes.items())).encode()).hexdigest()
+
+
+class Upserter:
+    """
+    Updates or inserts records in batches, so that only one batch of rows
+    and records is held in memory at a time.
+
+    Records are identified by the values of their key columns, which should
+    match a unique constraint on the model. Once a batch is full, the whole
+    batch is written with one executemany of SQLite's INSERT ... ON
+    CONFLICT DO UPDATE, and the batch is released. Records already loaded
+    in the session aren't refreshed until the session is committed.
+    Models without a unique constraint on the key columns are written
+    through the session instead, one record at a time.
+
+    Tables that are empty when the upserter is made are cold loaded: each
+    batch is written with one executemany on the raw sqlite3 connection,
+    skipping SQLAlchemy's work for every row, and the session only sees the
+    records once they are queried. Cold loads don't apply in delta mode.
+
+    In delta mode the hash of each row is stored with its key, and rows
+    with the same hash as the previous import are skipped. Records whose
+    rows are missing from the import are removed by finish().
+
+    Params:
+        db_session: The database session.
+        model: The SQLAlchemy model.
+        key_columns: The names of the columns identifying a record.
+            Defaults to the model's KEY_COLUMNS.
+        batch_size: The number of records in each batch. Defaults to the
+            batch_size import option.
+        delta: Whether to import only the rows changed since the previous
+            import. Defaults to the delta import option.
+        context: The import context to add inserted records to.
+    """
+
+    def __init__(
+            self,
+            db_session: Session,
+            model: Type[Base],
+            key_columns: Sequence[str] | None = None,
+            batch_size: int | None = None,
+            delta: bool | None = None,
+            context: ImportContext | None = None):
+        self.db_session = db_session
+        self.context = context
+        self.model = model
+        self.key_columns = key_columns or KEY_COLUMNS[model]
+        self.batch_size = batch_size or IMPORT_OPTIONS["batch_size"]
+        self.delta = IMPORT_OPTIONS["delta"] if delta is None else delta
+        self.bulk = frozenset(self.key_columns) in get_unique_keys(model)
+        self.cold = (
+            not self.delta
+            and db_session.get_bind().dialect.name == "sqlite"
+            and db_session.query(model.id).first() is None)
+        self.loaded_keys: Set[Tuple] = set()
+        self.batch: Dict[Tuple, Dict[str, Any]] = {}
+        self.inserted_count = 0   # The number of new records inserted.
+        self.updated_count = 0    # The number of existing records changed.
+        self.unchanged_count = 0  # The number of unchanged rows skipped.
+        self.removed_count = 0    # The number of records removed.
+
+        # Each delta import is numbered, and the row hashes seen during
+        # the import are marked with its number.
+        if self.delta:
+            last_run = db_session.query(func.max(RowHash.run)).filter(
+                RowHash.model == model.__name__).scalar()
+            self.run = (last_run or 0) + 1
+
+    def upsert(self, key: Tuple, attributes: Dict[str, Any]):
         """
         Updates or inserts a record depending on whether or not it exists.
 
         Params:
-            key: The key identifying the record.
-            attributes: The record attributes required to update or add 
+            key: The values of the key columns, in order.
+            attributes: The record attributes required to update or add
                 the record.
-        Returns:
-            A boolean flag indicating whether the record was updated.
         """
-        if key in records:
-            record = records[key]
-            for key, value in attributes.items():
-                setattr(record, key, value)
-            return True
-        record = model(**attributes)
-        db_session.add(record)
-        records[key] = record
-        return False
+        # A later row with the same key updates the record from an earlier
+        # row, unless the rows are the same.
+        pending = self.batch.get(key)
+        if pending == attributes:
+            self.unchanged_count += 1
+        elif pending is not None:
+            self.updated_count += 1
+        self.batch[key] = attributes
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the current batch to the database and releases it.
+        """
+        if not self.batch:
+            return
+        self.db_session.info["importing"] = True
+        try:
+            if self.delta:
+                self.skip_unchanged()
+            # New records get ids above the current highest id, so they can
+            # be found without looking up every key.
+            last_id = self.db_session.query(
+                func.max(self.model.id)).scalar() or 0
+            if self.cold:
+                self.write_cold(last_id)
+            elif self.bulk:
+                self.write_bulk(last_id)
+            else:
+                self.write_records()
+            self.db_session.flush()
+            if self.context is not None:
+                self.context.add_inserted(self.model, last_id)
+        finally:
+            self.db_session.info["importing"] = False
+        self.batch.clear()
+
+    def write_bulk(self, last_id: int):
+        """
+        Inserts the batch, or updates the existing records, in one
+        executemany.
+
+        Params:
+            last_id: The highest record id before the batch is written.
+        """
+        if not self.batch:
+            return
+        rows = list(self.batch.values())
+        statement = self.get_bulk_statement(list(rows[0]))
+        result = self.db_session.execute(statement, rows)
+
+        # The row count includes the inserted and the changed records.
+        inserted_count = self.db_session.query(
+            func.count(self.model.id)).filter(
+                self.model.id > last_id).scalar()
+        self.inserted_count += inserted_count
+        self.updated_count += result.rowcount - inserted_count
+        self.unchanged_count += len(rows) - result.rowcount
+
+    def get_bulk_statement(self, names: Sequence[str]):
+        """
+        Makes the INSERT ... ON CONFLICT DO UPDATE statement that writes rows
+        with the given attributes. Existing records are only updated if one
+        of the attributes has changed, and only the changed columns are set.
+
+        Decimals are compared by value, as write_records() compares them, so
+        "1.0" and "1.00" are the same and the stored text is kept.
+        """
+        statement = insert(self.model.__table__)
+        update_columns = [
+            name for name in names if name not in self.key_columns]
+        if update_columns:
+            columns = self.model.__table__.columns
+            changes = {}
+            for name in update_columns:
+                column = columns[name]
+                excluded = statement.excluded[name]
+                changes[name] = column.is_distinct_from(excluded)
+                # Only call back into Python for decimals whose text differs.
+                if isinstance(column.type, DecimalString):
+                    changes[name] = and_(
+                        changes[name],
+                        func.decimals_differ(column, excluded))
+            return statement.on_conflict_do_update(
+                index_elements=self.key_columns,
+                set_={
+                    name: case(
+                        (changed, statement.excluded[name]),
+                        else_=columns[name])
+                    for name, changed in changes.items()},
+                where=or_(*changes.values()))
+        return statement.on_conflict_do_nothing(
+            index_elements=self.key_columns)
+
+    def write_cold(self, last_id: int):
+        """
+        Writes the batch to a cold loaded table in one executemany on the
+        raw sqlite3 connection.
+
+        Values are converted by the bind processors of the column types, as
+        they would be by SQLAlchemy. Models without a unique constraint on
+        the key columns are inserted without checking for existing records,
+        besides rows whose keys were loaded by an earlier batch, which are
+        written through the session.
+
+        Params:
+            last_id: The highest record id before the batch is written.
+        """
+        if not self.bulk:
+            reloaded = {
+                key: self.batch.pop(key)
+                for key in list(self.batch) if key in self.loaded_keys}
+            self.loaded_keys.update(self.batch)
+        rows = list(self.batch.values())
+        if rows:
+            names = list(rows[0])
+            statement = insert(self.model.__table__)
+            if self.bulk:
+                statement = self.get_bulk_statement(names)
+            dialect = self.db_session.get_bind().dialect
+            compiled = statement.compile(dialect=dialect, column_keys=names)
+            columns = self.model.__table__.columns
+            processors = [
+                columns[name].type.dialect_impl(dialect).bind_processor(
+                    dialect)
+                for name in compiled.positiontup]
+            # Convert the values one column at a time, which is faster than
+            # converting each row.
+            column_values = []
+            for name, process in zip(compiled.positiontup, processors):
+                values = [row[name] for row in rows]
+                if process is not None:
+                    values = list(map(process, values))
+                column_values.append(values)
+            parameters = list(zip(*column_values))
+            connection = self.db_session.connection().connection
+            cursor = connection.driver_connection.executemany(
+                compiled.string, parameters)
+            new_last_id = self.db_session.query(
+                func.max(self.model.id)).scalar() or 0
+            inserted_count = new_last_id - last_id
+            self.inserted_count += inserted_count
+            self.updated_count += cursor.rowcount - inserted_count
+            self.unchanged_count += len(rows) - cursor.rowcount
+        if not self.bulk and reloaded:
+            self.batch = reloaded
+            self.write_records()
+
+    def write_records(self):
+        """
+        Updates the existing records for the batch, or adds new ones, through
+        the session. Existing records are only updated if one of their
+        attributes has changed.
+        """
+        records = {
+            tuple(getattr(record, name) for name in self.key_columns):
+                record
+            for record in query_by_keys(
+                self.db_session, self.model, self.key_columns, self.batch)}
+        for key, attributes in self.batch.items():
+            record = records.get(key)
+            if record is None:
+                self.db_session.add(self.model(**attributes))
+                self.inserted_count += 1
+            else:
+                # Only set changed attributes, so that unchanged records
+                # aren't marked as dirty and written again.
+                changed = False
+                for name, value in attributes.items():
+                    if getattr(record, name) != value:
+                        setattr(record, name, value)
+                        changed = True
+                if changed:
+                    self.updated_count += 1
+                else:
+                    self.unchanged_count += 1
+
+    def skip_unchanged(self):
+        """
+        Removes rows with the same hash as the previous import from the
+        batch, and stores the hashes of the remaining rows.
+        """
+        model_name = self.model.__name__
+        encoded_keys = {encode_key(key): key for key in self.batch}
+        row_hashes = {
+            row_hash.key: row_hash
+            for row_hash in query_by_keys(
+                self.db_session, RowHash, ["key"],
+                [(encoded_key,) for encoded_key in encoded_keys])
+            if row_hash.model == model_name}
+        for encoded_key, key in encoded_keys.items():
+            digest = hash_row(self.batch[key])
+            row_hash = row_hashes.get(encoded_key)
+            if row_hash is None:
+                self.db_session.add(RowHash(
+                    model=model_name,
+                    key=encoded_key,
+                    hash=digest,
+                    run=self.run))
+                continue
+            if row_hash.hash == digest:
+                del self.batch[key]
+                self.unchanged_count += 1
+            row_hash.hash = digest
+            row_hash.run = self.run
+
+    def finish(self):
+        """
+        Writes the last batch to the database. In delta mode, also removes
+        the records whose rows weren't imported in this run.
+        """
+        self.flush()
+        if not self.delta:
+            return
+        self.db_session.info["importing"] = True
+        try:
+            self.remove_unseen()
+        finally:
+            self.db_session.info["importing"] = False
+
+    def remove_unseen(self):
+        """
+        Deletes the records, and their row hashes, whose rows were imported
+        in an earlier run but not in this one.
+        """
+        unseen = self.db_session.query(RowHash.id, RowHash.key).filter(
+            RowHash.model == self.model.__name__,
+            RowHash.run < self.run).all()
+        keys = [tuple(json.loads(key)) for _, key in unseen]
+        record_ids = [
+            record.id for record in query_by_keys(
+                self.db_session, self.model, self.key_columns, keys)]
+        self.remove_records(self.model, record_ids)
+        hash_ids = [hash_id for hash_id, _ in unseen]
+        for start in range(0, len(hash_ids), QUERY_MAX_PARAMETERS):
+            chunk = hash_ids[start:start + QUERY_MAX_PARAMETERS]
+            self.db_session.query(RowHash).filter(
+                RowHash.id.in_(chunk)).delete()
+        self.removed_count += len(record_ids)
+        if record_ids and self.context is not None:
+            self.context.forget(self.model)
+
+    def remove_records(self, model: Type[Base], record_ids: List[int]):
+        """
+        Deletes records by id, along with the records referring to them,
+        since SQLite doesn't enforce foreign keys.
 
-    return upsert
+        Records that must refer to a deleted record are deleted in turn, and
+        their row hashes with them. Optional references are cleared, and the
+        row hashes of the records holding them are cleared, so the next
+        delta import writes those records again.
+        """
+        if not record_ids:
+            return
+        for mapper in model.registry.mappers:
+            dependent = mapper.class_
+            for column in dependent.__table__.columns:
+                if not any(
+                        foreign_key.references(model.__table__)
+                        for foreign_key in column.foreign_keys):
+                    continue
+                key_columns = KEY_COLUMNS.get(dependent, [])
+                dependents = []
+                for start in range(0, len(record_ids), QUERY_MAX_PARAMETERS):
+                    chunk = record_ids[start:start + QUERY_MAX_PARAMETERS]
+                    dependents += self.db_session.query(
+                        dependent.id,
+                        *[getattr(dependent, name) for name in key_columns],
+                    ).filter(column.in_(chunk)).all()
+                if not dependents:
+                    continue
+                dependent_ids = [row[0] for row in dependents]
+                encoded_keys = [
+                    encode_key(tuple(row[1:])) for row in dependents]
+                if column.nullable:
+                    for start in range(
+                            0, len(dependent_ids), QUERY_MAX_PARAMETERS):
+                        chunk = dependent_ids[
+                            start:start + QUERY_MAX_PARAMETERS]
+                        self.db_session.query(dependent).filter(
+                            dependent.id.in_(chunk)).update(
+                                {column.key: None})
+                    row_hashes = update(RowHash).values(hash=None)
+                else:
+                    self.remove_records(dependent, dependent_ids)
+                    row_hashes = delete(RowHash)
+                for start in range(
+                        0, len(encoded_keys), QUERY_MAX_PARAMETERS - 1):
+                    chunk = encoded_keys[
+                        start:start + QUERY_MAX_PARAMETERS - 1]
+                    self.db_session.execute(row_hashes.where(
+                        RowHash.model == dependent.__name__,
+                        RowHash.key.in_(chunk)))
+                if self.context is not None:
+                    self.context.forget(dependent)
+        for start in range(0, len(record_ids), QUERY_MAX_PARAMETERS):
+            chunk = record_ids[start:start + QUERY_MAX_PARAMETERS]
+            self.db_session.query(model).filter(
+                model.id.in_(chunk)).delete()
+
+
+def invalidate_row_hashes(db_session: Session, flush_context, instances):
+    """
+    Clears the row hashes of records changed outside of an import, so the
+    next delta import writes their rows again even if they haven't changed.
+    Listens for the before_flush event of every session.
+    """
+    if not IMPORT_OPTIONS["delta"] or db_session.info.get("importing"):
+        return
+    changed = [
+        record for record in db_session.dirty
+        if db_session.is_modified(record)]
+    encoded_keys = defaultdict(list)
+    for record in [*changed, *db_session.deleted]:
+        key_columns = KEY_COLUMNS.get(type(record))
+        if key_columns:
+            key = tuple(getattr(record, name) for name in key_columns)
+            encoded_keys[type(record).__name__].append(encode_key(key))
+    connection = db_session.connection()
+    for model_name, keys in encoded_keys.items():
+        for start in range(0, len(keys), QUERY_MAX_PARAMETERS - 1):
+            chunk = keys[start:start + QUERY_MAX_PARAMETERS - 1]
+            connection.execute(
+                update(RowHash)
+                .where(RowHash.model == model_name, RowHash.key.in_(chunk))
+                .values(hash=None))
+
+
+event.listen(Session, "before_flush", invalidate_row_hashes)
+
+
+def decimals_differ(value: str | None, other: str | None) -> bool:
+    """
+    Compares two decimals stored as strings by value, like IS DISTINCT FROM.
+    """
+    if value is None or other is None:
+        return value is not other
+    return Decimal(value) != Decimal(other)
+
+
+def register_functions(dbapi_connection, connection_record):
+    """
+    Adds the SQL functions used by upserts to new SQLite connections.
+    Listens for the connect event of every engine.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "decimals_differ", 2, decimals_differ, deterministic=True)
 
 
-def import_contract_items(filepath: PathLike, db_session: Session):
+event.listen(Engine, "connect", register_functions)
+
+
+# The columns read from the contract items datagrid, and their types.
+CONTRACT_ITEM_SCHEMA: Schema = {
+    "item_code": StrConverter(),
+    "contract_no": StrConverter(),
+    "price_1": DecimalConverter(),
+    "price_2": DecimalConverter(),
+    "price_3": DecimalConverter(),
+    "price_4": DecimalConverter(),
+    "price_5": DecimalConverter(),
+    "price_6": DecimalConverter(),
+}
+
+
+@measure_import
+def import_contract_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports ContractItems from a datagrid into the database.
 
     Params:
         filepath: The path to the contract items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            CONTRACT_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
+
     skipped_count = 0   # The number of rows skipped.
 
-    # Get a hashmap of InventoryItems keyed by code.
-    inv_items = get_inventory_items(db_session)
+    # Get a hashmap of InventoryItem ids keyed by code.
+    inv_item_ids = context.get_ids(InventoryItem)
 
     # Create an upserter for ContractItem.
-    upsert = get_upserter(db_session, ContractItem, {
-        f"{con_item.code}--{con_item.inventory_item.code}": con_item
-        for con_item in db_session.query(ContractItem).all()})
+    upserter = Upserter(db_session, ContractItem, context=context)
 
     # Update/insert rows as ContractItems where InventoryItem exists.
-    for row in load_rows(filepath):
+    if rows is None:
+        rows = iter_rows(filepath, schema=CONTRACT_ITEM_SCHEMA)
+    for row in rows:
         inv_item_code = row["item_code"]
-        if inv_item_code in inv_items:
+        if inv_item_code in inv_item_ids:
             con_code = row["contract_no"]
-            con_item_key = f"{con_code}--{inv_item_code}"
-            updated = upsert(con_item_key, {
-                "inventory_item": inv_items[inv_item_code],
+            inv_item_id = inv_item_ids[inv_item_code]
+            upserter.upsert((con_code, inv_item_id), {
+                "inventory_item_id": inv_item_ids[inv_item_code],
                 "code": con_code,
                 "price_1": row["price_1"],
                 "price_2": row["price_2"],
@@ -111,41 +806,74 @@ def import_contract_items(filepath: PathLike, db_session: Session):
                 "price_5": row["price_5"],
                 "price_6": row["price_6"],
             })
-            if updated:
-                updated_count += 1
-            else:
-                inserted_count += 1
         else:
             skipped_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import ContractItems: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated, "
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed, "
         f"{skipped_count} skipped.")
 
 
-def import_inventory_items(filepath: PathLike, db_session: Session):
+# The columns read from the inventory items datagrid, and their types.
+INVENTORY_ITEM_SCHEMA: Schema = {
+    "item_code": StrConverter(),
+    "item_description": StrConverter(),
+    "description_2": StrConverter(),
+    "description_3": StrConverter(),
+    "unit": StrConverter(),
+    "brand_manuf": StrConverter(),
+    "manuf_apn_no": StrConverter(),
+    "group": StrConverter(),
+    "creation_date": DateConverter(),
+    "status": EnumConverter(ItemType),
+    "condition": EnumConverter(ItemCondition),
+    "replacement_cost": DecimalConverter(),
+}
+
+
+@measure_import
+def import_inventory_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports InventoryItems from a datagrid into the database.
 
     Params:
         filepath: The path to the inventory items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            INVENTORY_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
+    filters = context.filters
 
-    # Create an upserter for InventoryItem.
-    upsert = get_upserter(db_session, InventoryItem,
-                          get_inventory_items(db_session))
+    skipped_count = 0   # The number of rows skipped.
 
-    # Update/insert rows as InventoryItems.
-    for row in load_rows(filepath):
+    # Create an upserter for InventoryItem.
+    upserter = Upserter(db_session, InventoryItem, context=context)
+
+    # Update/insert rows as InventoryItems, unless they are filtered out.
+    if rows is None:
+        rows = iter_rows(filepath, schema=INVENTORY_ITEM_SCHEMA)
+    for row in rows:
+        if filters.drops_inventory_item(
+                row["status"], row["condition"], row["brand_manuf"]):
+            skipped_count += 1
+            continue
         inv_item_code = row["item_code"]
-        updated = upsert(inv_item_code, {
+        upserter.upsert((inv_item_code,), {
             "code": inv_item_code,
             "description_line_1": row["item_description"],
             "description_line_2": row["description_2"],
@@ -155,120 +883,164 @@ def import_inventory_items(filepath: PathLike, db_session: Session):
             "apn": row["manuf_apn_no"],
             "group": row["group"],
             "created": row["creation_date"],
-            "item_type": ItemType(row["status"]),
-            "condition": ItemCondition(row["condition"]),
+            "item_type": row["status"],
+            "condition": row["condition"],
             "replacement_cost": row["replacement_cost"],
         })
-        if updated:
-            updated_count += 1
-        else:
-            inserted_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import InventoryItems: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated.")
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed, "
+        f"{skipped_count} skipped.")
+
 
+# The columns read from the inventory web data items datagrid, and their types.
+INVENTORY_WEB_DATA_ITEM_SCHEMA: Schema = {
+    "stock_code": StrConverter(),
+    "menu_name": StrConverter(),
+    "description": StrConverter(),
+}
 
-def import_inventory_web_data_items(filepath: PathLike, db_session: Session):
+
+@measure_import
+def import_inventory_web_data_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports InventoryWebDataItems from a datagrid into the database.
 
     Params:
         filepath: The path to the inventory web data items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            INVENTORY_WEB_DATA_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
+
     skipped_count = 0   # The number of rows skipped.
 
-    # Get a hashmap of InventoryItems keyed by code.
-    inv_items = get_inventory_items(db_session)
+    # Get a hashmap of InventoryItem ids keyed by code.
+    inv_item_ids = context.get_ids(InventoryItem)
 
-    # Get a hashmap of WebMenuItems keyed by name.
-    web_menu_items = {
-        web_menu_item.name: web_menu_item
-        for web_menu_item in db_session.query(WebMenuItem).all()}
+    # Get a hashmap of WebMenuItem ids keyed by name.
+    web_menu_item_ids = context.get_ids(WebMenuItem)
 
     # Create an upserter for InventoryWebDataItems.
-    upsert = get_upserter(db_session, InventoryWebDataItem, {
-        iwd_item.inventory_item.code: iwd_item
-        for iwd_item in db_session.query(InventoryWebDataItem).all()})
+    upserter = Upserter(db_session, InventoryWebDataItem, context=context)
 
     # Update/insert rows as InventoryWebDataItems where InventoryItem exists.
-    for row in load_rows(filepath):
+    if rows is None:
+        rows = iter_rows(filepath, schema=INVENTORY_WEB_DATA_ITEM_SCHEMA)
+    for row in rows:
         inv_item_code = row["stock_code"]
         web_menu_item_name = row["menu_name"]
         has_valid_web_menu_item = (
             web_menu_item_name is None
-            or web_menu_item_name in web_menu_items)
-        if inv_item_code in inv_items and has_valid_web_menu_item:
-            web_menu_item = None
+            or web_menu_item_name in web_menu_item_ids)
+        if inv_item_code in inv_item_ids and has_valid_web_menu_item:
+            web_menu_item_id = None
             if web_menu_item_name is not None:
-                web_menu_item = web_menu_items[web_menu_item_name]
-            updated = upsert(inv_item_code, {
-                "inventory_item": inv_items[inv_item_code],
-                "web_menu_item": web_menu_item,
+                web_menu_item_id = web_menu_item_ids[web_menu_item_name]
+            inv_item_id = inv_item_ids[inv_item_code]
+            upserter.upsert((inv_item_id,), {
+                "inventory_item_id": inv_item_id,
+                "web_menu_item_id": web_menu_item_id,
                 "description": row["description"],
             })
-            if updated:
-                updated_count += 1
-            else:
-                inserted_count += 1
         else:
             skipped_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import InventoryWebDataItems: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated, "
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed, "
         f"{skipped_count} skipped.")
 
 
-def import_price_region_items(filepath: PathLike, db_session: Session):
+# The columns read from the price region items datagrid, and their types.
+PRICE_REGION_ITEM_SCHEMA: Schema = {
+    "item_code": StrConverter(),
+    "region": StrConverter(),
+    "rule": StrConverter(),
+    "tax_rate": StrConverter(),
+    "pr_1_corpa_qty": DecimalConverter(),
+    "pr_2_corp_b_qty": DecimalConverter(),
+    "pr_3_corp_c_qty": DecimalConverter(),
+    "pr_4_bulk_qty": DecimalConverter(),
+    "w_sale_price": DecimalConverter(),
+    "pr_1_corpa": DecimalConverter(),
+    "pr_2_corp_b": DecimalConverter(),
+    "pr_3_corp_c": DecimalConverter(),
+    "pr_4_bulk": DecimalConverter(),
+    "retail_price": DecimalConverter(),
+    "rrp_inc_tax": DecimalConverter(),
+}
+
+
+@measure_import
+def import_price_region_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports PriceRegionItems from a datagrid into the database.
 
     Params:
         filepath: The path to the price region items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            PRICE_REGION_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
+
     skipped_count = 0   # The number of rows skipped.
 
-    # Get a hashmap of InventoryItems keyed by code.
-    inv_items = get_inventory_items(db_session)
+    # Get a hashmap of InventoryItem ids keyed by code.
+    inv_item_ids = context.get_ids(InventoryItem)
 
-    # Build a hashmap of PriceRules keyed by code.
-    price_rules = {
-        price_rule.code: price_rule
-        for price_rule in db_session.query(PriceRule).all()}
+    # Build a hashmap of PriceRule ids keyed by code.
+    price_rule_ids = context.get_ids(PriceRule)
 
     # Create an upserter for PriceRegionItem.
-    upsert = get_upserter(db_session, PriceRegionItem, {
-        f"{pr_item.code}--{pr_item.inventory_item.code}": pr_item
-        for pr_item in db_session.query(PriceRegionItem).all()})
+    upserter = Upserter(db_session, PriceRegionItem, context=context)
 
     # Update/insert rows as PriceRegionItems where InventoryItem exists.
-    for row in load_rows(filepath):
+    if rows is None:
+        rows = iter_rows(filepath, schema=PRICE_REGION_ITEM_SCHEMA)
+    for row in rows:
         inv_item_code = row["item_code"]
         price_rule_code = row["rule"]
         has_valid_price_rule = price_rule_code is None \
-            or price_rule_code in price_rules
-        if inv_item_code in inv_items and has_valid_price_rule:
+            or price_rule_code in price_rule_ids
+        if inv_item_code in inv_item_ids and has_valid_price_rule:
             price_region_code = row["region"] if row["region"] else ""
-            price_rule = None
+            price_rule_id = None
             if price_rule_code:
-                price_rule = price_rules[price_rule_code]
-            pr_item_key = f"{price_region_code}--{inv_item_code}"
-            updated = upsert(pr_item_key, {
-                "inventory_item": inv_items[inv_item_code],
-                "price_rule": price_rule,
+                price_rule_id = price_rule_ids[price_rule_code]
+            inv_item_id = inv_item_ids[inv_item_code]
+            upserter.upsert((price_region_code, inv_item_id), {
+                "inventory_item_id": inv_item_id,
+                "price_rule_id": price_rule_id,
                 "code": price_region_code,
                 "tax_code": TaxCode.TAXABLE
                 if row["tax_rate"] else TaxCode.EXEMPT,
@@ -284,50 +1056,80 @@ def import_price_region_items(filepath: PathLike, db_session: Session):
                 "rrp_excl_tax": row["retail_price"],
                 "rrp_incl_tax": row["rrp_inc_tax"]
             })
-            if updated:
-                updated_count += 1
-            else:
-                inserted_count += 1
         else:
             skipped_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import PriceRegionItems: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated, "
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed, "
         f"{skipped_count} skipped.")
 
 
-def import_price_rules(filepath: PathLike, db_session: Session):
+# The columns read from the price rules datagrid, and their types.
+PRICE_RULE_SCHEMA: Schema = {
+    "rule": StrConverter(),
+    "comments": StrConverter(),
+    "price0_based_on": EnumConverter(PriceBasis),
+    "price1_based_on": EnumConverter(PriceBasis),
+    "price2_based_on": EnumConverter(PriceBasis),
+    "price3_based_on": EnumConverter(PriceBasis),
+    "price4_based_on": EnumConverter(PriceBasis),
+    "rec_retail_based_on": EnumConverter(PriceBasis),
+    "rrp_inc_tax_based_on": EnumConverter(PriceBasis),
+    "price0_factor": DecimalConverter(),
+    "price1_factor": DecimalConverter(),
+    "price2_factor": DecimalConverter(),
+    "price3_factor": DecimalConverter(),
+    "price4_factor": DecimalConverter(),
+    "rec_retail_factor": DecimalConverter(),
+    "rrp_inc_tax_factor": DecimalConverter(),
+}
+
+
+@measure_import
+def import_price_rules(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports PriceRules from a datagrid into the database.
 
     Params:
         filepath: The path to the price rules datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            PRICE_RULE_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
 
-    upsert = get_upserter(db_session, PriceRule, {
-        price_rule.code: price_rule
-        for price_rule in db_session.query(PriceRule).all()})
+    # Create an upserter for PriceRule.
+    upserter = Upserter(db_session, PriceRule, context=context)
 
     # Update/insert rows as PriceRules.
-    for row in load_rows(filepath):
+    if rows is None:
+        rows = iter_rows(filepath, schema=PRICE_RULE_SCHEMA)
+    for row in rows:
         price_rule_code = row["rule"]
-        updated = upsert(price_rule_code, {
+        upserter.upsert((price_rule_code,), {
             "code": price_rule_code,
             "description": row["comments"],
-            "price_0_basis": PriceBasis(row["price0_based_on"]),
-            "price_1_basis": PriceBasis(row["price1_based_on"]),
-            "price_2_basis": PriceBasis(row["price2_based_on"]),
-            "price_3_basis": PriceBasis(row["price3_based_on"]),
-            "price_4_basis": PriceBasis(row["price4_based_on"]),
-            "rrp_excl_basis": PriceBasis(row["rec_retail_based_on"]),
-            "rrp_incl_basis": PriceBasis(row["rrp_inc_tax_based_on"]),
+            "price_0_basis": row["price0_based_on"],
+            "price_1_basis": row["price1_based_on"],
+            "price_2_basis": row["price2_based_on"],
+            "price_3_basis": row["price3_based_on"],
+            "price_4_basis": row["price4_based_on"],
+            "rrp_excl_basis": row["rec_retail_based_on"],
+            "rrp_incl_basis": row["rrp_inc_tax_based_on"],
             "price_0_factor": row["price0_factor"],
             "price_1_factor": row["price1_factor"],
             "price_2_factor": row["price2_factor"],
@@ -336,47 +1138,71 @@ def import_price_rules(filepath: PathLike, db_session: Session):
             "rrp_excl_factor": row["rec_retail_factor"],
             "rrp_incl_factor": row["rrp_inc_tax_factor"]
         })
-        if updated:
-            updated_count += 1
-        else:
-            inserted_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import PriceRules: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated.")
-
-
-def import_warehouse_stock_items(filepath: PathLike, db_session: Session):
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed.")
+
+
+# The columns read from the warehouse stock items datagrid, and their types.
+WAREHOUSE_STOCK_ITEM_SCHEMA: Schema = {
+    "item_code": StrConverter(),
+    "whse": StrConverter(),
+    "minimum_stock": IntConverter(),
+    "maximum_stock": IntConverter(),
+    "on_hand": IntConverter(),
+    "bin_loc": StrConverter(),
+    "bulk_loc": StrConverter(),
+}
+
+
+@measure_import
+def import_warehouse_stock_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports WarehouseStockItems from a datagrid into the database.
 
     Params:
         filepath: The path to the inventory items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            WAREHOUSE_STOCK_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
+    filters = context.filters
+
     skipped_count = 0   # The number of rows skipped.
 
-    # Get a hashmap of InventoryItems keyed by code.
-    inv_items = get_inventory_items(db_session)
+    # Get a hashmap of InventoryItem ids keyed by code.
+    inv_item_ids = context.get_ids(InventoryItem)
 
     # Create upserter for WarehouseStockItem.
-    upsert = get_upserter(db_session, WarehouseStockItem, {
-        f"{ws_item.code}--{ws_item.inventory_item.code}": ws_item
-        for ws_item in db_session.query(WarehouseStockItem).all()})
+    upserter = Upserter(db_session, WarehouseStockItem, context=context)
 
     # Update/insert rows as WarehouseStockItems where InventoryItem exists.
-    for row in load_rows(filepath):
+    if rows is None:
+        rows = iter_rows(filepath, schema=WAREHOUSE_STOCK_ITEM_SCHEMA)
+    for row in rows:
         inv_item_code = row["item_code"]
         whse_code = row["whse"]
-        if inv_item_code in inv_items:
-            ws_item_key = f"{whse_code}--{inv_item_code}"
-            updated = upsert(ws_item_key, {
-                "inventory_item": inv_items[inv_item_code],
+        if filters.drops_warehouse(whse_code):
+            skipped_count += 1
+        elif inv_item_code in inv_item_ids:
+            inv_item_id = inv_item_ids[inv_item_code]
+            upserter.upsert((whse_code, inv_item_id), {
+                "inventory_item_id": inv_item_id,
                 "code": row["whse"],
                 "minimum": row["minimum_stock"],
                 "maximum": row["maximum_stock"],
@@ -384,50 +1210,73 @@ def import_warehouse_stock_items(filepath: PathLike, db_session: Session):
                 "bin_location": row["bin_loc"],
                 "bulk_location": row["bulk_loc"],
             })
-            if updated:
-                updated_count += 1
-            else:
-                inserted_count += 1
         else:
             skipped_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import WarehouseStockItems: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated, "
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed, "
         f"{skipped_count} skipped.")
 
 
-def import_supplier_items(filepath: PathLike, db_session: Session):
+# The columns read from the supplier items datagrid, and their types.
+SUPPLIER_ITEM_SCHEMA: Schema = {
+    "item_code": StrConverter(),
+    "supplier": StrConverter(),
+    "supplier_item": StrConverter(),
+    "priority": IntConverter(),
+    "unit": StrConverter(),
+    "conv_factor": DecimalConverter(),
+    "pack_qty": IntConverter(),
+    "eoq": IntConverter(),
+    "current_buy_price": DecimalConverter(),
+}
+
+
+@measure_import
+def import_supplier_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports SupplierItems from a datagrid into the database.
 
     Params:
         filepath: The path to the supplier items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            SUPPLIER_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
+
     skipped_count = 0   # The number of rows skipped.
 
-    # Get a hashmap of InventoryItems keyed by code.
-    inv_items = get_inventory_items(db_session)
+    # Get a hashmap of InventoryItem ids keyed by code.
+    inv_item_ids = context.get_ids(InventoryItem)
 
     # Create upserter for SupplierItem.
-    upsert = get_upserter(db_session, SupplierItem, {
-        f"{supp_item.code}--{supp_item.inventory_item.code}": supp_item
-        for supp_item in db_session.query(SupplierItem).all()})
+    upserter = Upserter(db_session, SupplierItem, context=context)
 
     # Update/insert rows as SupplierItems where InventoryItem exists.
-    for row in load_rows(filepath):
+    if rows is None:
+        rows = iter_rows(filepath, schema=SUPPLIER_ITEM_SCHEMA)
+    for row in rows:
         inv_item_code = row["item_code"]
         supplier_code = row["supplier"]
-        if inv_item_code in inv_items and supplier_code:
-            key = f"{supplier_code}--{inv_item_code}"
-            updated = upsert(key, {
-                "inventory_item": inv_items[inv_item_code],
+        if inv_item_code in inv_item_ids and supplier_code:
+            inv_item_id = inv_item_ids[inv_item_code]
+            upserter.upsert((supplier_code, inv_item_id), {
+                "inventory_item_id": inv_item_id,
                 "code": supplier_code,
                 "item_code": row["supplier_item"],
                 "priority": row["priority"],
@@ -437,176 +1286,590 @@ def import_supplier_items(filepath: PathLike, db_session: Session):
                 "moq": row["eoq"],
                 "buy_price": row["current_buy_price"],
             })
-            if updated:
-                updated_count += 1
-            else:
-                inserted_count += 1
         else:
             skipped_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import SupplierItems: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated, "
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed, "
         f"{skipped_count} skipped.")
 
 
-def import_gtin_items(filepath: PathLike, db_session: Session):
+# The columns read from the GTIN items datagrid, and their types.
+GTIN_ITEM_SCHEMA: Schema = {
+    "item_code": StrConverter(),
+    "gtin": StrConverter(),
+    "uom": StrConverter(),
+    "conversion": DecimalConverter(),
+}
+
+
+@measure_import
+def import_gtin_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Imports GTINItems from a datagrid into the database.
 
     Params:
         filepath: The path to the gtin items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            GTIN_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
+
     skipped_count = 0   # The number of rows skipped.
 
-    # Get a hashmap of InventoryItems keyed by code.
-    inv_items = get_inventory_items(db_session)
+    # Get a hashmap of InventoryItem ids keyed by code.
+    inv_item_ids = context.get_ids(InventoryItem)
 
     # Create an upserter for GTINItem.
-    upsert = get_upserter(db_session, GTINItem, {
-        f"{gtin_item.code}--{gtin_item.inventory_item.code}": gtin_item
-        for gtin_item in db_session.query(GTINItem).all()})
+    upserter = Upserter(db_session, GTINItem, context=context)
 
     # Update/insert rows as GTINItems where InventoryItem exists, and skip
     # duplicate rows.
-    seen_keys = []  # List of keys already seen in datagrid.
-    for row in load_rows(filepath):
+    seen_keys = set()  # Set of keys already seen in datagrid.
+    if rows is None:
+        rows = iter_rows(filepath, schema=GTIN_ITEM_SCHEMA)
+    for row in rows:
         inv_item_code = row["item_code"]
         gtin_code = row["gtin"]
-        if inv_item_code in inv_items and gtin_code:
-            key = f"{gtin_code}--{inv_item_code}"
+        if inv_item_code in inv_item_ids and gtin_code:
+            key = (gtin_code, inv_item_ids[inv_item_code])
             # Ignore duplicate rows.
             if key not in seen_keys:
-                seen_keys.append(key)
-                updated = upsert(key, {
-                    "inventory_item": inv_items[inv_item_code],
+                seen_keys.add(key)
+                upserter.upsert(key, {
+                    "inventory_item_id": key[1],
                     "code": row["gtin"],
                     "uom": row["uom"],
                     "conv_factor": row["conversion"]
                 })
-                if updated:
-                    updated_count += 1
-                else:
-                    inserted_count += 1
             else:
                 skipped_count += 1
         else:
             skipped_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import GTINItems: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated, "
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed, "
         f"{skipped_count} skipped.")
 
 
-def import_web_menu_items(filepath: PathLike, db_session: Session):
+# The columns read from the web menu items datagrid, and their types.
+WEB_MENU_ITEM_SCHEMA: Schema = {
+    "parent_name": StrConverter(),
+    "child_name": StrConverter(),
+}
+
+
+@measure_import
+def import_web_menu_items(
+        filepath: PathLike,
+        db_session: Session,
+        rows: Iterable[DatagridRow] | None = None,
+        context: ImportContext | None = None):
     """
     Import WebMenuItems from datagrid.
 
     Params:
         filepath: The path to the gtin items datagrid.
         db_session: The database session.
+        rows: Rows already read from the datagrid, converted with
+            WEB_MENU_ITEM_SCHEMA. Read from the file if not given.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
     """
-    inserted_count = 0  # The number of new records inserted.
-    updated_count = 0   # The number of existing records updated.
+    if context is None:
+        context = ImportContext(db_session)
 
     # Create an upserter for WebMenuItem.
-    upsert = get_upserter(db_session, WebMenuItem, {
-        wm_items.name: wm_items
-        for wm_items in db_session.query(WebMenuItem).all()})
+    upserter = Upserter(db_session, WebMenuItem, context=context)
 
     # Update/insert rows as WebMenuItems.
-    for row in load_rows(filepath):
-        key = f"{row['parent_name']}/{row['child_name']}"
-        updated = upsert(key, {
+    if rows is None:
+        rows = iter_rows(filepath, schema=WEB_MENU_ITEM_SCHEMA)
+    for row in rows:
+        key = (row["parent_name"], row["child_name"])
+        upserter.upsert(key, {
             "parent_name": row["parent_name"],
             "child_name": row["child_name"],
         })
-        if updated:
-            updated_count += 1
-        else:
-            inserted_count += 1
 
     # Commit the database queries and log the results.
+    upserter.finish()
     db_session.commit()
     logging.info(
         f"Import WebMenuItem: "
-        f"{inserted_count} inserted, "
-        f"{updated_count} updated,")
+        f"{upserter.inserted_count} inserted, "
+        f"{upserter.updated_count} updated, "
+        f"{upserter.unchanged_count} unchanged, "
+        f"{upserter.removed_count} removed.")
+
+
+# The supplier pricelist fields read by iter_spl_rows(), in the order of
+# the values in each row.
+SPL_COLUMNS = [
+    "supplier_code",
+    "supp_item_code",
+    "item_code",
+    "supp_uom",
+    "supp_sell_uom",
+    "supp_eoq",
+    "supp_conv_factor",
+    "supp_price_1",
+]
 
 
-def load_spl_rows(filepath: PathLike):
+def iter_spl_lines(
+        filepath: PathLike,
+        ranges: Sequence[Tuple[int, int]] | None = None):
     """
-    Loads the rows from a supplier pricelist file.
+    Reads the raw lines of a supplier pricelist file, in the given byte
+    ranges or else the whole file. Each range starts at the line at its
+    start offset and stops at the first line at or after its end offset.
+
+    Plain files are memory-mapped once, however many ranges are read.
+    Compressed files are decompressed as they're read, and the offsets are
+    offsets into the decompressed data.
+    """
+    if get_compression(filepath) is not None:
+        with open_file(filepath) as file:
+            for start, end in ranges or [(0, None)]:
+                file.seek(start)
+                position = start
+                for line in file:
+                    if end is not None and position >= end:
+                        break
+                    position += len(line)
+                    yield line
+        return
+
+    with open(filepath, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, end in ranges or [(0, size)]:
+                data.seek(start)
+                position = start
+                while position < min(end, size):
+                    line = data.readline()
+                    position += len(line)
+                    yield line
+
+
+def iter_spl_rows(
+        filepath: PathLike,
+        ranges: Sequence[Tuple[int, int]] | None = None,
+        keys: Set[Tuple[str, str]] | None = None):
+    """
+    Reads the rows from a supplier pricelist file one row at a time.
+
+    The file is scanned as bytes, and only the fields in SPL_COLUMNS are
+    decoded, so memory use doesn't grow with the size of the file. If keys
+    are given, only the supplier code and item code of rows whose supplier
+    code and supplier item code aren't among them are decoded, and their
+    other values are None, or empty strings for empty fields, so that
+    collect_spl_items() can tell which later rows they hide. Blank lines
+    are skipped, and rows missing fields are padded with empty strings.
+    Each row must fit on one line. Files compressed with gzip, bzip2 or xz
+    are decompressed as they're read. The rows read and the time spent
+    reading them are recorded in the ingest metrics for the file.
 
     Params:
         filepath: The path to the supplier pricelist file.
+        ranges: The (start, end) byte ranges to read, as read by
+            iter_spl_lines(), or None to read the whole file.
+        keys: The (supplier code, supplier item code) pairs of the rows to
+            read, or None to read every row.
 
     Returns:
-        The list of rows in the supplier pricelist file.
+        A generator yielding a tuple of the SPL_COLUMNS values in each row.
     """
-    with open(filepath, "r", encoding="iso8859-14") as file:
-        return list(csv.DictReader(file, SPL_FIELDNAMES))
+    indexes = [SPL_FIELDNAMES.index(column) for column in SPL_COLUMNS]
+    get_values = itemgetter(*indexes)
+    supp_code_index = SPL_FIELDNAMES.index("supplier_code")
+    supp_item_code_index = SPL_FIELDNAMES.index("supp_item_code")
+    item_code_index = SPL_FIELDNAMES.index("item_code")
+    supp_uom_index = SPL_FIELDNAMES.index("supp_uom")
+    supp_conv_factor_index = SPL_FIELDNAMES.index("supp_conv_factor")
+    row_length = max(indexes) + 1
+    padding = [b""] * row_length
+    raw_keys = None
+    if keys is not None:
+        raw_keys = {
+            (supp_code.encode("iso8859-14"),
+             supp_item_code.encode("iso8859-14"))
+            for supp_code, supp_item_code in keys}
+    row_count = 0
+    bytes_read = 0
+    parse_seconds = 0.0
+    started_at = perf_counter()
+    try:
+        for line in iter_spl_lines(filepath, ranges):
+            bytes_read += len(line)
+            if not line.rstrip(b"\r\n"):
+                continue  # Skip blank lines.
+            row_count += 1
+            # Lines without quotes are split on commas as bytes. Lines with
+            # quoted fields are parsed by csv.
+            is_quoted = b'"' in line
+            if is_quoted:
+                fields = [
+                    field.encode("iso8859-14")
+                    for field in next(csv.reader([
+                        line.decode("iso8859-14")]), [])]
+            else:
+                fields = line.rstrip(b"\r\n").split(b",")
+            if len(fields) < row_length:
+                fields += padding[len(fields):]
+            if raw_keys is not None and (
+                    fields[supp_code_index],
+                    fields[supp_item_code_index]) not in raw_keys:
+                values = (
+                    fields[supp_code_index].decode("iso8859-14"),
+                    None,
+                    fields[item_code_index].decode("iso8859-14"),
+                    "" if not fields[supp_uom_index] else None,
+                    None,
+                    None,
+                    "" if not fields[supp_conv_factor_index] else None,
+                    None)
+            # Decode the kept fields of unquoted lines at once.
+            elif is_quoted:
+                values = tuple([
+                    field.decode("iso8859-14")
+                    for field in get_values(fields)])
+            else:
+                values = tuple(b",".join(get_values(fields)).decode(
+                    "iso8859-14").split(","))
+            parse_seconds += perf_counter() - started_at
+            yield values
+            started_at = perf_counter()
+        parse_seconds += perf_counter() - started_at
+    finally:
+        # The whole file counts as read unless only some ranges were read.
+        if ranges is None:
+            bytes_read = None
+        record_parse(filepath, row_count, parse_seconds, bytes_read)
+
 
+# Supplier pricelists are only split into shards to be parsed in parallel
+# if each shard would be at least this many bytes.
+SPL_SHARD_MIN_BYTES = 16 * 1024 * 1024
 
-def import_supplier_pricelist_items(filepath: PathLike):
+
+def find_spl_shards(filepath: PathLike, count: int):
     """
-    Imports SupplierPricelistItems from file.
+    Splits a supplier pricelist file into byte ranges of about the same
+    size, which start and end on line boundaries.
 
     Params:
         filepath: The path to the supplier pricelist file.
+        count: The number of ranges to split the file into. Fewer ranges
+            are returned if the file has too few lines.
 
     Returns:
-        The list of SupplierPricelistItems.
+        A list of (start, end) tuples of byte offsets covering the file.
+    """
+    size = os.path.getsize(filepath)
+    offsets = [0]
+    with open(filepath, "rb") as file:
+        for index in range(1, count):
+            # Start each range at the line after the one cut by the split.
+            file.seek(max(size * index // count, offsets[-1]))
+            file.readline()
+            offset = file.tell()
+            if offset >= size:
+                break
+            offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def collect_spl_items(rows: Iterable[Tuple[str, ...]]):
+    """
+    Collects SupplierPricelistItems from supplier pricelist rows.
+
+    If an item has the same item code and supplier code as a previous item
+    then only the first item is kept, and the later item is counted as a
+    skipped record. Rows dropped by the keys given to iter_spl_rows() make
+    no item, but still hide the later rows for the same item, so the keys
+    don't change which row each item is read from.
+
+    Params:
+        rows: Tuples of the SPL_COLUMNS values in each row.
+
+    Returns:
+        A tuple containing a dict of SupplierPricelistItems keyed by
+        supplier code and item code, the number of invalid rows, the number
+        of skipped rows and the set of keys of items whose first row was
+        dropped.
     """
     skipped_count = 0  # The number of records skipped.
     invalid_count = 0  # The number of invalid records.
     spl_items = {}     # Hashmap of SPL items keyed by supp code and item code.
-
-    def is_invalid_row(row):
-        if row["supp_uom"] == "":
-            return True
-        if row["supp_conv_factor"] == "":
-            return True
-        if row["supplier_code"] == "":
-            return True
-        return False
-
-    # Collect supplier pricelist items. If an item has the same item code
-    # and supplier code as a previous item then the new item will take its
-    # place. The previous item is counted as an overridden record.
-    for row in load_spl_rows(filepath):
-        is_header_row = row["supplier_code"] == "Supplier Code"
-        if is_header_row:
-            pass
-        elif is_invalid_row(row):
+    dropped_keys = set()  # Keys of items whose first row was dropped.
+    for row in rows:
+        (supp_code, supp_item_code, item_code, supp_uom, supp_sell_uom,
+         supp_eoq, supp_conv_factor, supp_price) = row
+        if supp_code == "Supplier Code":
+            pass  # Skip the header row.
+        elif supp_uom == "" or supp_conv_factor == "" or supp_code == "":
             invalid_count += 1
         else:
-            spl_item = SupplierPricelistItem(
-                item_code=row["item_code"],
-                supp_code=row["supplier_code"],
-                supp_item_code=row["supp_item_code"],
-                supp_uom=row["supp_uom"],
-                supp_conv_factor=Decimal(row["supp_conv_factor"]),
-                supp_eoq=row["supp_eoq"],
-                supp_sell_uom=row["supp_sell_uom"],
-                supp_price=Decimal(row["supp_price_1"]).quantize(
-                    Decimal("0.01")),
-            )
-            key = f"{spl_item.supp_code}--{spl_item.item_code}"
-            if key not in spl_items:
-                spl_items[key] = spl_item
-            else:
+            key = f"{supp_code}--{item_code}"
+            if key in spl_items or key in dropped_keys:
                 skipped_count += 1
+            elif supp_item_code is None:
+                dropped_keys.add(key)
+            else:
+                spl_items[key] = SupplierPricelistItem(
+                    item_code=item_code,
+                    supp_code=supp_code,
+                    supp_item_code=supp_item_code,
+                    supp_uom=supp_uom,
+                    supp_conv_factor=Decimal(supp_conv_factor),
+                    supp_eoq=supp_eoq,
+                    supp_sell_uom=supp_sell_uom,
+                    supp_price=Decimal(supp_price).quantize(
+                        Decimal("0.01")),
+                )
+    return spl_items, invalid_count, skipped_count, dropped_keys
+
+
+def parse_spl_shard(
+        filepath: PathLike,
+        start: int,
+        end: int,
+        keys: Set[Tuple[str, str]] | None = None):
+    """
+    Collects the SupplierPricelistItems in a byte range of a supplier
+    pricelist file, in a worker process.
+
+    Returns:
+        The tuple returned by collect_spl_items(), followed by the ingest
+        metrics recorded while reading the range.
+    """
+    collect_ingest_metrics(filepath)
+    collected = collect_spl_items(
+        iter_spl_rows(filepath, [(start, end)], keys))
+    return (*collected, collect_ingest_metrics(filepath))
+
+
+def get_supplier_item_keys(db_session: Session):
+    """
+    Gets the (supplier code, supplier item code) pairs of every
+    SupplierItem, to import only the supplier pricelist rows that update a
+    SupplierItem.
+    """
+    supp_items = db_session.query(SupplierItem.code, SupplierItem.item_code)
+    return {
+        (supp_code, supp_item_code)
+        for supp_code, supp_item_code in supp_items
+        if supp_item_code is not None}
+
+
+# Supplier pricelist indexes are saved next to the pricelist with this
+# suffix.
+SPL_INDEX_SUFFIX = ".pxiindex"
+
+
+def build_spl_index(filepath: PathLike):
+    """
+    Scans a supplier pricelist file for the byte ranges holding each
+    supplier's rows.
+
+    Params:
+        filepath: The path to the supplier pricelist file.
+
+    Returns:
+        A dict of lists of [start, end] byte ranges keyed by supplier code.
+        Consecutive rows of the same supplier share one range.
+    """
+    index: Dict[str, List[List[int]]] = {}
+    block: List[int] = []
+    block_supp_code = None
+    position = 0
+    for line in iter_spl_lines(filepath):
+        if line.startswith(b'"'):
+            row = next(csv.reader([line.decode("iso8859-14")]), [""])
+            supp_code = row[0] if row else ""
+        else:
+            supp_code = line.split(b",", 1)[0].rstrip(b"\r\n").decode(
+                "iso8859-14")
+        if supp_code == block_supp_code:
+            block[1] += len(line)
+        else:
+            block = [position, position + len(line)]
+            block_supp_code = supp_code
+            index.setdefault(supp_code, []).append(block)
+        position += len(line)
+    return index
+
+
+def load_spl_index(filepath: PathLike):
+    """
+    Loads the supplier index of a supplier pricelist file, building the
+    index and saving it next to the file if there is no index yet or the
+    file has changed since it was built.
+
+    The file is taken to be unchanged if its size and modification time
+    are the same, so that loading the index doesn't read the whole file.
+
+    Params:
+        filepath: The path to the supplier pricelist file.
+
+    Returns:
+        The dict returned by build_spl_index().
+    """
+    index_filepath = f"{filepath}{SPL_INDEX_SUFFIX}"
+    fingerprint = get_fingerprint(filepath, None, content=False)
+    try:
+        with open(index_filepath) as file:
+            saved_index = json.load(file)
+        if saved_index["fingerprint"] == fingerprint:
+            return saved_index["suppliers"]
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        logging.debug(f"Ignoring unreadable index {index_filepath}: {error}")
+
+    index = build_spl_index(filepath)
+
+    # Write to a temporary file first so a partial index is never read.
+    temp_filepath = f"{index_filepath}.tmp"
+    try:
+        with open(temp_filepath, "w") as file:
+            json.dump({"fingerprint": fingerprint, "suppliers": index}, file)
+        os.replace(temp_filepath, index_filepath)
+    except OSError as error:
+        logging.warning(f"Could not save index {index_filepath}: {error}")
+    return index
+
+
+def iter_supplier_spl_rows(
+        filepath: PathLike,
+        suppliers: Set[str],
+        keys: Set[Tuple[str, str]] | None = None):
+    """
+    Reads the rows of the given suppliers from a supplier pricelist file.
+
+    Plain files are only read at the byte ranges listed for the suppliers
+    in the file's index, in one pass over the file. Compressed files can't
+    be read from an offset without decompressing everything before it, so
+    they are read in full.
+
+    Params:
+        filepath: The path to the supplier pricelist file.
+        suppliers: The codes of the suppliers to read rows for.
+        keys: The (supplier code, supplier item code) pairs of the rows to
+            read, or None to read every row of the suppliers.
+
+    Returns:
+        A generator yielding the rows as iter_spl_rows() does.
+    """
+    if get_compression(filepath) is None:
+        index = load_spl_index(filepath)
+        blocks = sorted(
+            (start, end)
+            for supp_code in suppliers
+            for start, end in index.get(supp_code, []))
+        rows = iter_spl_rows(filepath, blocks, keys)
+    else:
+        rows = iter_spl_rows(filepath, keys=keys)
+    supp_code_index = SPL_COLUMNS.index("supplier_code")
+    for row in rows:
+        if row[supp_code_index] in suppliers:
+            yield row
+
+
+@measure_import
+def import_supplier_pricelist_items(
+        filepath: PathLike,
+        suppliers: Set[str] | None = None,
+        keys: Set[Tuple[str, str]] | None = None):
+    """
+    Imports SupplierPricelistItems from file.
+
+    Large files are split into shards parsed in parallel by worker
+    processes, and the shards are merged in file order so that the first
+    of any duplicate items is kept, as when the file is parsed in one go.
+    If suppliers are given, only their rows are read, using the supplier
+    index of the file. If keys are given, rows for other supplier items are
+    dropped before they're decoded, since they would only be thrown away by
+    update_supplier_items().
+
+    Params:
+        filepath: The path to the supplier pricelist file.
+        suppliers: The codes of the suppliers to import items for, or None
+            to import items for every supplier.
+        keys: The (supplier code, supplier item code) pairs to import
+            items for, such as those from get_supplier_item_keys(), or None
+            to import every item.
+
+    Returns:
+        The list of SupplierPricelistItems.
+    """
+    # Compressed files can't be split without decompressing each shard
+    # from the start of the file, so they're always parsed in one go.
+    shard_count = 0
+    if suppliers is None and get_compression(filepath) is None:
+        shard_count = os.path.getsize(filepath) // SPL_SHARD_MIN_BYTES
+    workers = get_worker_count(shard_count)
+    if suppliers is not None:
+        spl_items, invalid_count, skipped_count, _ = collect_spl_items(
+            iter_supplier_spl_rows(filepath, suppliers, keys))
+    elif workers > 1:
+        spl_items = {}
+        invalid_count = 0
+        skipped_count = 0
+        dropped_keys = set()
+        shards = find_spl_shards(filepath, workers)
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(
+                parse_spl_shard,
+                *zip(*[
+                    (filepath, start, end, keys) for start, end in shards]))
+            for shard_items, invalid, skipped, dropped, metrics in results:
+                merge_ingest_metrics(metrics)
+                invalid_count += invalid
+                skipped_count += skipped
+                # The items and dropped keys of a shard are the first rows
+                # for their items in the shard, so either is hidden by an
+                # earlier shard's row for the same item.
+                for key, spl_item in shard_items.items():
+                    if key in spl_items or key in dropped_keys:
+                        skipped_count += 1
+                    else:
+                        spl_items[key] = spl_item
+                for key in dropped:
+                    if key in spl_items or key in dropped_keys:
+                        skipped_count += 1
+                    else:
+                        dropped_keys.add(key)
+    else:
+        spl_items, invalid_count, skipped_count, _ = collect_spl_items(
+            iter_spl_rows(filepath, keys=keys))
 
     # Log the results and return the collected SPL items as a list.
     logging.info(
@@ -617,39 +1880,98 @@ def import_supplier_pricelist_items(filepath: PathLike):
     return spl_items.values()
 
 
-def import_web_menu_item_mappings(filepath: PathLike, db_session: Session):
+# The columns read from the web menu item mappings datagrid, and their types.
+WEB_MENU_ITEM_MAPPING_SCHEMA: Schema = {
+    "rule_code": StrConverter(),
+    "menu_name": StrConverter(),
+}
+
+
+@measure_import
+def import_web_menu_item_mappings(
+        filepath: PathLike,
+        db_session: Session,
+        context: ImportContext | None = None):
+    """
+    Imports the WebMenuItem each PriceRule is mapped to.
+
+    Params:
+        filepath: The path to the web menu item mappings spreadsheet.
+        db_session: The database session.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
+
+    Returns:
+        A dict of WebMenuItems keyed by price rule code. Rules mapped to
+        no menu, or to "man", map to the menu name instead, and rules mapped
+        to an unknown menu map to None.
+    """
+    if context is None:
+        context = ImportContext(db_session)
+    rows = list(iter_rows(filepath, schema=WEB_MENU_ITEM_MAPPING_SCHEMA))
+
+    # Look up the WebMenuItems for all rows at once.
+    menu_names = [
+        row["menu_name"] for row in rows
+        if row["menu_name"] and row["menu_name"] != "man"]
+    web_menu_items = context.resolve(WebMenuItem, menu_names)
+
     web_menu_item_mappings = {}
-    for row in load_rows(filepath):
+    for row in rows:
         rule_code = row["rule_code"]
         menu_name = row["menu_name"]
         if menu_name and menu_name != "man":
-            parent_name, child_name = menu_name.split("/")
-            web_menu_item = db_session.query(WebMenuItem).filter(
-                WebMenuItem.parent_name == parent_name,
-                WebMenuItem.child_name == child_name,
-            ).scalar()
-            web_menu_item_mappings[rule_code] = web_menu_item
+            web_menu_item_mappings[rule_code] = web_menu_items.get(menu_name)
         else:
             web_menu_item_mappings[rule_code] = menu_name
 
     # Log the results and return the list of mappings.
+    log_unknown_keys(
+        "WebMenuItem mappings", set(menu_names) - set(web_menu_items))
     logging.info(
         f"Import WebMenuItem mappings: "
         f"{len(web_menu_item_mappings)} inserted.")
     return web_menu_item_mappings
 
 
-def import_missing_images_report(filepath: PathLike, db_session: Session):
-    inv_items_no_image = []
-    for row in load_rows(filepath):
-        item_code = str(row["item_code"])
-        inventory_item = db_session.query(InventoryItem).filter(
-            InventoryItem.code == item_code
-        ).scalar()
-        if inventory_item:
-            inv_items_no_image.append(inventory_item)
+# The columns read from the missing images report datagrid, and their types.
+MISSING_IMAGES_REPORT_SCHEMA: Schema = {
+    "item_code": StrConverter(),
+}
+
+
+@measure_import
+def import_missing_images_report(
+        filepath: PathLike,
+        db_session: Session,
+        context: ImportContext | None = None):
+    """
+    Imports the InventoryItems listed in the missing images report.
+
+    Params:
+        filepath: The path to the missing images report.
+        db_session: The database session.
+        context: The lookups shared with other importers. A new context
+            is made if not given.
+
+    Returns:
+        The list of InventoryItems without an image, in report order.
+    """
+    if context is None:
+        context = ImportContext(db_session)
+    item_codes = [
+        row["item_code"]
+        for row in iter_rows(filepath, schema=MISSING_IMAGES_REPORT_SCHEMA)]
+
+    # Look up the InventoryItems for all rows at once.
+    inventory_items = context.resolve(InventoryItem, item_codes)
+    inv_items_no_image = [
+        inventory_items[item_code] for item_code in item_codes
+        if item_code in inventory_items]
 
     # Log the results and return the list of inventory items.
+    log_unknown_keys(
+        "missing images list", set(item_codes) - set(inventory_items))
     logging.info(
         f"Import missing images list: "
         f"{len(inv_items_no_image)} loaded.")
@@ -669,7 +1991,7 @@ ImportPath = Literal[
     "web_menu_mappings",
     "missing_images_report",
 ]
-ModelImport = Tuple[Type[Base], Callable, ImportPath]
+ModelImport = Tuple[Type[Base], Callable, ImportPath, Schema]
 
 
 # import functions and files for each model.
@@ -677,60 +1999,486 @@ ModelImport = Tuple[Type[Base], Callable, ImportPath]
 # - The model class.
 # - The import function.
 # - The name of the import file in the config.
+# - The schema the import function reads the file with.
+# Imports are run in this order, except where MODEL_DEPENDENCIES requires
+# otherwise or a later datagrid is parsed first.
 MODEL_IMPORTS: List[ModelImport] = [
     (
         InventoryItem,
         import_inventory_items,
-        "inventory_items_datagrid"
+        "inventory_items_datagrid",
+        INVENTORY_ITEM_SCHEMA
     ),
     (
         WarehouseStockItem,
         import_warehouse_stock_items,
-        "inventory_items_datagrid"
+        "inventory_items_datagrid",
+        WAREHOUSE_STOCK_ITEM_SCHEMA
     ),
     (
         PriceRule,
         import_price_rules,
-        "price_rules_datagrid"
+        "price_rules_datagrid",
+        PRICE_RULE_SCHEMA
     ),
     (
         PriceRegionItem,
         import_price_region_items,
-        "pricelist_datagrid"
+        "pricelist_datagrid",
+        PRICE_REGION_ITEM_SCHEMA
     ),
     (
         ContractItem,
         import_contract_items,
-        "contract_items_datagrid"
+        "contract_items_datagrid",
+        CONTRACT_ITEM_SCHEMA
     ),
     (
         SupplierItem,
         import_supplier_items,
-        "supplier_items_datagrid"
+        "supplier_items_datagrid",
+        SUPPLIER_ITEM_SCHEMA
     ),
     (
         InventoryWebDataItem,
         import_inventory_web_data_items,
-        "inventory_web_data_items_datagrid"
+        "inventory_web_data_items_datagrid",
+        INVENTORY_WEB_DATA_ITEM_SCHEMA
     ),
     (
         WebMenuItem,
         import_web_menu_items,
-        "web_menu"
+        "web_menu",
+        WEB_MENU_ITEM_SCHEMA
     ),
 ]
 
 
+# The models each model's import refers to, which must be imported first
+# when they are imported together.
+MODEL_DEPENDENCIES: Dict[Type[Base], List[Type[Base]]] = {
+    ContractItem: [InventoryItem],
+    GTINItem: [InventoryItem],
+    InventoryWebDataItem: [InventoryItem, WebMenuItem],
+    PriceRegionItem: [InventoryItem, PriceRule],
+    SupplierItem: [InventoryItem],
+    WarehouseStockItem: [InventoryItem],
+}
+
+
+def configure_importers(config: ImportersConfig):
+    """
+    Sets options for importing data.
+
+    Params:
+        config: The importers section of the config.
+    """
+    IMPORT_OPTIONS.update(config)
+
+
+def get_worker_count(datagrid_count: int):
+    """
+    Gets the number of worker processes to parse datagrids with, which is
+    never more than the number of datagrids.
+    """
+    workers = IMPORT_OPTIONS.get("workers") or os.cpu_count() or 1
+    return min(workers, datagrid_count)
+
+
+def merge_schemas(datagrids: List[Tuple[str, Schema]]):
+    """
+    Merges the schemas of datagrids read from the same file, so that each
+    file can be parsed once for every importer that reads it.
+
+    Importers reading the same file are expected to agree on the type of
+    each column they share. The first converter given for a column is used.
+
+    Returns:
+        A dict of merged schemas keyed by path, in the order first given.
+    """
+    schemas: Dict[str, Schema] = {}
+    for path, schema in datagrids:
+        merged_schema = schemas.setdefault(path, {})
+        for column, converter in schema.items():
+            merged_schema.setdefault(column, converter)
+    return schemas
+
+
+def parse_datagrid(path: str, schema: Schema, options):
+    """
+    Parses a datagrid in a worker process.
+
+    Returns:
+        A tuple containing the columns read by read_columns() and the
+        ingest metrics recorded while reading them.
+    """
+    collect_ingest_metrics(path)
+    datagrid_columns = read_columns(path, None, schema, options)
+    return datagrid_columns, collect_ingest_metrics(path)
+
+
+def receive_datagrid(future):
+    """
+    Gets the columns parsed by parse_datagrid() in a worker process, and
+    adds the metrics recorded by the worker to this process's metrics.
+    """
+    datagrid_columns, metrics = future.result()
+    merge_ingest_metrics(metrics)
+    return datagrid_columns
+
+
+def pipe_rows(path: str, schema: Schema, options, queue: Queue):
+    """
+    Reads the rows of a datagrid into a queue in chunks, in a worker
+    process.
+
+    The queue receives the fieldnames, then a list of value tuples for each
+    chunk of rows, and finally the ingest metrics for the file. If reading
+    fails, the error is put in the queue instead, as a RuntimeError if the
+    error can't be pickled.
+    """
+    try:
+        collect_ingest_metrics(path)
+        configure_datagrids(options)
+        fieldnames = list(schema)
+        queue.put(fieldnames)
+        chunk = []
+        for row in iter_rows(path, schema=schema):
+            chunk.append(tuple([row.get(name) for name in fieldnames]))
+            if len(chunk) >= PIPELINE_CHUNK_SIZE:
+                queue.put(chunk)
+                chunk = []
+        if chunk:
+            queue.put(chunk)
+        queue.put(collect_ingest_metrics(path))
+    except Exception as error:
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError(f"{type(error).__name__}: {error}")
+        queue.put(error)
+
+
+def receive_piped(queue: Queue, process: BaseProcess):
+    """
+    Gets the next item put in the queue by pipe_rows(), checking every
+    PIPELINE_POLL_SECONDS that the worker process is still running.
+
+    Raises:
+        RuntimeError: The worker process exited without putting an item.
+    """
+    while True:
+        try:
+            return queue.get(timeout=PIPELINE_POLL_SECONDS)
+        except Empty:
+            if process.is_alive():
+                continue
+        # Items put just before the process exited may still be arriving.
+        try:
+            return queue.get(timeout=PIPELINE_POLL_SECONDS)
+        except Empty:
+            raise RuntimeError(
+                f"Pipelined reader exited with code {process.exitcode} "
+                f"before finishing")
+
+
+def iter_pipelined_rows(path: str, schema: Schema, queue_size: int):
+    """
+    Reads the rows of a datagrid in a worker process, so that the next rows
+    are parsed while the rows before them are written to the database.
+
+    Params:
+        path: The path to the datagrid.
+        schema: The columns to read and their converters.
+        queue_size: The most rows read ahead of the rows being written.
+
+    Returns:
+        A generator yielding the rows. Errors reading the rows are raised
+        here, and a RuntimeError is raised if the worker process dies.
+    """
+    context = get_context()
+    queue = context.Queue(max(1, queue_size // PIPELINE_CHUNK_SIZE))
+    process = context.Process(
+        target=pipe_rows,
+        args=(path, schema, dict(DATAGRID_OPTIONS), queue),
+        daemon=True)
+    process.start()
+    try:
+        fieldnames = receive_piped(queue, process)
+        if isinstance(fieldnames, Exception):
+            raise fieldnames
+        while True:
+            chunk = receive_piped(queue, process)
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not isinstance(chunk, list):
+                merge_ingest_metrics(chunk)
+                break
+            for values in chunk:
+                yield dict(zip(fieldnames, values))
+        process.join()
+    finally:
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+
+def is_streamed_datagrid(path: str):
+    """
+    Checks whether a datagrid is large enough that importers should stream
+    its rows rather than have it parsed into memory.
+    """
+    try:
+        return os.path.getsize(path) >= STREAM_MIN_BYTES
+    except OSError:
+        return False
+
+
+class DatagridParser:
+    """
+    Parses datagrids at the same time in a pool of worker processes,
+    parsing each file once however many importers read it.
+
+    If there are too few files or workers to parse in parallel, files read
+    by a single importer aren't parsed, so that they are read by the import
+    function instead. Files of at least STREAM_MIN_BYTES are never parsed,
+    and are read by each import function that needs them. In pipeline
+    mode, files read by a single importer are left for the import to
+    pipeline. Use as a context manager to start and stop the pool.
+
+    Params:
+        datagrids: The path and schema of each datagrid read by an importer.
+        pipeline: Whether files read by a single importer are pipelined.
+    """
+
+    def __init__(
+            self,
+            datagrids: List[Tuple[str, Schema]],
+            pipeline: bool = False):
+        schemas = merge_schemas(datagrids)
+        self.remaining_reads = Counter(path for path, _ in datagrids)
+        self.shared_paths = {
+            path for path, count in self.remaining_reads.items()
+            if count > 1}
+        self.streamed_paths = {
+            path for path in schemas
+            if (pipeline and path not in self.shared_paths)
+            or is_streamed_datagrid(path)}
+        self.schemas = {
+            path: schema for path, schema in schemas.items()
+            if path not in self.streamed_paths}
+        self.parsed: Dict[str, DatagridColumns] = {}
+        self.parsed_at: Dict[str, float] = {}
+        self.futures: Dict[str, Future] | None = None
+        self.executor: ProcessPoolExecutor | None = None
+
+    def __enter__(self):
+        workers = get_worker_count(len(self.schemas))
+        if workers > 1:
+            # Pass the datagrid options to the workers, since they aren't
+            # inherited by processes which are spawned rather than forked.
+            options = dict(DATAGRID_OPTIONS)
+            self.executor = ProcessPoolExecutor(workers)
+            self.futures = {}
+            for path, schema in self.schemas.items():
+                future = self.executor.submit(
+                    parse_datagrid, path, schema, options)
+                future.add_done_callback(
+                    lambda _, path=path: self.set_parsed_at(path))
+                self.futures[path] = future
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def set_parsed_at(self, path: str):
+        """
+        Records the time a datagrid finished parsing.
+        """
+        self.parsed_at[path] = perf_counter()
+
+    def is_parsed(self, path: str):
+        """
+        Checks whether a datagrid can be taken without waiting for a worker.
+        """
+        if (self.futures is None or path in self.parsed
+                or path in self.streamed_paths):
+            return True
+        return self.futures[path].done()
+
+    def wait(self, paths: Iterable[str]):
+        """
+        Waits until at least one of the datagrids has been parsed.
+        """
+        futures = [
+            self.futures[path] for path in paths
+            if self.futures is not None and path in self.futures]
+        if futures:
+            wait(futures, return_when=FIRST_COMPLETED)
+
+    def take(self, path: str):
+        """
+        Gets the parsed columns for a path, releasing them after the last
+        importer reading the path has taken them.
+
+        Returns:
+            The columns of the datagrid, or None if the import function
+            should read the file itself.
+        """
+        if path in self.streamed_paths:
+            return None
+        if path not in self.parsed:
+            if self.futures is not None:
+                self.parsed[path] = receive_datagrid(self.futures.pop(path))
+            elif path in self.shared_paths:
+                self.parsed[path] = read_columns(
+                    path, schema=self.schemas[path])
+                self.set_parsed_at(path)
+            else:
+                return None
+        self.remaining_reads[path] -= 1
+        if self.remaining_reads[path] == 0:
+            return self.parsed.pop(path)
+        return self.parsed[path]
+
+
+def iter_scheduled_imports(
+        model_imports: List[ModelImport],
+        paths: ImportPathsConfig,
+        parser: DatagridParser):
+    """
+    Orders imports by MODEL_DEPENDENCIES, running each import as soon as
+    the models it depends on have been imported and its datagrid has been
+    parsed, so imports don't wait on datagrids they don't need.
+
+    The generator must be resumed once the yielded import has finished.
+
+    Raises:
+        ValueError: The dependencies of the imports are circular.
+
+    Returns:
+        A generator yielding each model import.
+    """
+    remaining = list(model_imports)
+    importing = {model for model, _, _, _ in model_imports}
+    imported = set()
+    while remaining:
+        ready = [
+            model_import for model_import in remaining
+            if all(
+                dependency in imported or dependency not in importing
+                for dependency in MODEL_DEPENDENCIES.get(model_import[0], []))]
+        if not ready:
+            models = ", ".join(model.__name__ for model, *_ in remaining)
+            raise ValueError(f"Circular import dependencies: {models}")
+        parsed = [
+            model_import for model_import in ready
+            if parser.is_parsed(paths[model_import[2]])]
+        if not parsed:
+            parser.wait(paths[model_import[2]] for model_import in ready)
+            continue
+        model_import = parsed[0]
+        remaining.remove(model_import)
+        yield model_import
+        imported.add(model_import[0])
+
+
+# The times of an import, for logging the critical path: the model's name,
+# the time its datagrid was parsed if it was parsed before the import, and
+# the times the import started and finished.
+ImportTiming = Tuple[str, float | None, float, float]
+
+
+def log_critical_path(timings: List[ImportTiming], began_at: float):
+    """
+    Logs the chain of imports that determined how long the imports took.
+
+    Imports write to the database one at a time, so each import waited for
+    either the import before it or the parsing of its datagrid, whichever
+    finished last. The chain is followed back from the last import until an
+    import that waited for its datagrid.
+
+    Params:
+        timings: The times of each import, in the order they ran.
+        began_at: The time the imports began.
+    """
+    if not timings:
+        return
+    steps = []
+    index = len(timings) - 1
+    while index >= 0:
+        name, parsed_at, started_at, finished_at = timings[index]
+        steps.append(f"{name} {finished_at - started_at:.2f}s")
+        previous_finished_at = timings[index - 1][3] if index else began_at
+        if parsed_at is not None and parsed_at >= previous_finished_at:
+            steps.append(f"parse {parsed_at - began_at:.2f}s")
+            break
+        index -= 1
+    logging.info(
+        f"Import critical path: "
+        f"{' <- '.join(steps)}, "
+        f"{timings[-1][3] - began_at:.2f}s total.")
+
+
 def import_data(
         db_session: Session,
         paths: ImportPathsConfig,
-        models=None):
+        models=None,
+        context: ImportContext | None = None,
+        filters: ImportFilters | None = None):
     """
     Imports data for given models, or all models if none given.
-    """
-    import_all_models = models is None
 
-    for model, function, path_key in MODEL_IMPORTS:
-        path = paths[path_key]
-        if import_all_models or model in models:
-            function(path, db_session)
+    Rows the filters drop are skipped before any record is made for them.
+    The filters are ignored if a context is given, which has its own.
+
+    The datagrids are parsed in parallel in worker processes, and the
+    records are written on this process in an order scheduled by
+    iter_scheduled_imports(). Datagrids read by several importers are parsed
+    once, and all importers share the same import context. In pipeline mode,
+    datagrids read by one importer are parsed in a worker process while
+    their rows are written.
+
+    Returns:
+        The import context, for looking up the imported records.
+    """
+    if context is None:
+        context = ImportContext(db_session, filters)
+    model_imports = [
+        model_import for model_import in MODEL_IMPORTS
+        if models is None or model_import[0] in models]
+    timings: List[ImportTiming] = []
+    began_at = perf_counter()
+
+    # Pipelining only helps if parsing and writing can use separate CPUs.
+    pipeline = IMPORT_OPTIONS["pipeline"] and (os.cpu_count() or 1) > 1
+
+    with DatagridParser(
+            [
+                (paths[path_key], schema)
+                for _, _, path_key, schema in model_imports],
+            pipeline) as parser:
+        for model, function, path_key, schema in iter_scheduled_imports(
+                model_imports, paths, parser):
+            path = paths[path_key]
+            datagrid_columns = parser.take(path)
+            started_at = perf_counter()
+            if datagrid_columns is None and pipeline:
+                rows = iter_pipelined_rows(
+                    path, schema, IMPORT_OPTIONS["queue_size"])
+                function(path, db_session, rows, context=context)
+            elif datagrid_columns is None:
+                function(path, db_session, context=context)
+            else:
+                function(
+                    path, db_session, iter_column_rows(datagrid_columns),
+                    context=context)
+            timings.append((
+                model.__name__,
+                parser.parsed_at.get(path),
+                started_at,
+                perf_counter()))
+
+    log_critical_path(timings, began_at)
+    return context
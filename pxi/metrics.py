@@ -0,0 +1,148 @@
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from functools import wraps
+import json
+import logging
+import os
+from time import perf_counter
+from typing import Callable, Dict
+
+
+@dataclass
+class IngestMetrics:
+    """
+    Throughput of reading a file and importing its rows.
+    """
+    path: str
+    bytes_read: int = 0
+    rows: int = 0
+    parse_seconds: float = 0.0
+    apply_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        seconds = self.parse_seconds + self.apply_seconds
+        return self.rows / seconds if seconds else 0.0
+
+
+# Metrics for each file read by this process, keyed by path.
+INGEST_METRICS: Dict[str, IngestMetrics] = {}
+
+
+def get_ingest_metrics(filepath):
+    """
+    Gets the metrics for a file, starting them at zero if the file hasn't
+    been read yet.
+    """
+    path = os.fspath(filepath)
+    metrics = INGEST_METRICS.get(path)
+    if metrics is None:
+        metrics = INGEST_METRICS[path] = IngestMetrics(path)
+    return metrics
+
+
+def record_parse(
+        filepath,
+        rows: int,
+        seconds: float,
+        bytes_read: int | None = None):
+    """
+    Records that a file has been read and parsed.
+
+    Params:
+        filepath: The path to the file.
+        rows: The number of rows parsed.
+        seconds: The time spent reading and parsing the rows.
+        bytes_read: The number of bytes read, if only part of the file was
+            read. Defaults to the size of the file.
+    """
+    metrics = get_ingest_metrics(filepath)
+    if bytes_read is not None:
+        metrics.bytes_read += bytes_read
+    else:
+        try:
+            metrics.bytes_read += os.path.getsize(filepath)
+        except OSError:
+            pass
+    metrics.rows += rows
+    metrics.parse_seconds += seconds
+
+
+def collect_ingest_metrics(filepath):
+    """
+    Removes and returns the metrics for a file, so that a worker process can
+    send them back to the process importing the file.
+    """
+    return INGEST_METRICS.pop(os.fspath(filepath), None)
+
+
+def merge_ingest_metrics(metrics: IngestMetrics | None):
+    """
+    Adds metrics collected by a worker process to this process's metrics.
+    """
+    if metrics is None:
+        return
+    merged = get_ingest_metrics(metrics.path)
+    merged.bytes_read += metrics.bytes_read
+    merged.rows += metrics.rows
+    merged.parse_seconds += metrics.parse_seconds
+    merged.apply_seconds += metrics.apply_seconds
+
+
+def measure_import(function: Callable):
+    """
+    Decorates an import function to record the time spent writing its rows
+    to the database, apart from the time spent parsing them, and to log the
+    metrics for the file once the import is done.
+
+    The decorated function takes the path to the imported file as its first
+    argument.
+    """
+    @wraps(function)
+    def measured_import(filepath, *args, **kwargs):
+        metrics = get_ingest_metrics(filepath)
+        parse_seconds = metrics.parse_seconds
+        started_at = perf_counter()
+        result = function(filepath, *args, **kwargs)
+        seconds = perf_counter() - started_at
+        metrics.apply_seconds += max(
+            0.0, seconds - (metrics.parse_seconds - parse_seconds))
+        log_ingest_metrics(function.__name__, metrics)
+        return result
+    return measured_import
+
+
+def log_ingest_metrics(name: str, metrics: IngestMetrics):
+    """
+    Logs the metrics for a file.
+    """
+    logging.info(
+        f"Ingest {name}: "
+        f"{metrics.path}, "
+        f"{metrics.bytes_read} bytes, "
+        f"{metrics.rows} rows, "
+        f"{metrics.parse_seconds:.3f}s parse, "
+        f"{metrics.apply_seconds:.3f}s apply, "
+        f"{metrics.rows_per_second:.0f} rows/s.")
+
+
+def write_ingest_metrics(filepath, command_name: str):
+    """
+    Appends the metrics for every file read by a command to a JSON Lines
+    file, as one JSON object per line.
+
+    Params:
+        filepath: The path to the metrics file.
+        command_name: The name of the command that read the files.
+    """
+    if not INGEST_METRICS:
+        return
+    record = {
+        "command": command_name,
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "files": [
+            {**asdict(metrics), "rows_per_second": metrics.rows_per_second}
+            for metrics in INGEST_METRICS.values()],
+    }
+    with open(filepath, "a") as file:
+        file.write(json.dumps(record) + "\n")
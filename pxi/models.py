@@ -5,6 +5,7 @@ from sqlalchemy import (
     Date, DateTime, Enum, ForeignKey, Integer, String)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 
 from pxi.enum import ItemType, ItemCondition, PriceBasis, TaxCode
 
@@ -12,6 +13,25 @@ from pxi.enum import ItemType, ItemCondition, PriceBasis, TaxCode
 Base = declarative_base()
 
 
+class DecimalString(TypeDecorator):
+    """
+    Stores Decimals as strings, keeping their exact digits, and loads them
+    back as Decimals.
+    """
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return str(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Decimal(value)
+
+
 class InventoryItem(Base):
     __tablename__ = "inventory_items"
 
@@ -27,7 +47,7 @@ class InventoryItem(Base):
     item_type = Column(Enum(ItemType), nullable=False)
     condition = Column(Enum(ItemCondition))
     created = Column(DateTime)
-    replacement_cost = Column(String(16), nullable=False)
+    replacement_cost = Column(DecimalString(16), nullable=False)
 
     contract_items = relationship("ContractItem",
                                   back_populates="inventory_item")
@@ -81,13 +101,13 @@ class PriceRule(Base):
     price_4_basis = Column(Enum(PriceBasis), nullable=False)
     rrp_excl_basis = Column(Enum(PriceBasis), nullable=False)
     rrp_incl_basis = Column(Enum(PriceBasis), nullable=False)
-    price_0_factor = Column(String(16), nullable=False)
-    price_1_factor = Column(String(16), nullable=False)
-    price_2_factor = Column(String(16), nullable=False)
-    price_3_factor = Column(String(16), nullable=False)
-    price_4_factor = Column(String(16), nullable=False)
-    rrp_excl_factor = Column(String(16), nullable=False)
-    rrp_incl_factor = Column(String(16), nullable=False)
+    price_0_factor = Column(DecimalString(16), nullable=False)
+    price_1_factor = Column(DecimalString(16), nullable=False)
+    price_2_factor = Column(DecimalString(16), nullable=False)
+    price_3_factor = Column(DecimalString(16), nullable=False)
+    price_4_factor = Column(DecimalString(16), nullable=False)
+    rrp_excl_factor = Column(DecimalString(16), nullable=False)
+    rrp_incl_factor = Column(DecimalString(16), nullable=False)
 
     price_region_items = relationship("PriceRegionItem",
                                       back_populates="price_rule")
@@ -113,17 +133,17 @@ class PriceRegionItem(Base):
                                ForeignKey("inventory_items.id"), nullable=False)
     price_rule_id = Column(Integer, ForeignKey("price_rules.id"))
     tax_code = Column(Enum(TaxCode))
-    quantity_1 = Column(String(14), nullable=False)
-    quantity_2 = Column(String(14), nullable=False)
-    quantity_3 = Column(String(14), nullable=False)
-    quantity_4 = Column(String(14), nullable=False)
-    price_0 = Column(String(16), nullable=False)
-    price_1 = Column(String(16), nullable=False)
-    price_2 = Column(String(16), nullable=False)
-    price_3 = Column(String(16), nullable=False)
-    price_4 = Column(String(16), nullable=False)
-    rrp_excl_tax = Column(String(16), nullable=False)
-    rrp_incl_tax = Column(String(15), nullable=False)
+    quantity_1 = Column(DecimalString(14), nullable=False)
+    quantity_2 = Column(DecimalString(14), nullable=False)
+    quantity_3 = Column(DecimalString(14), nullable=False)
+    quantity_4 = Column(DecimalString(14), nullable=False)
+    price_0 = Column(DecimalString(16), nullable=False)
+    price_1 = Column(DecimalString(16), nullable=False)
+    price_2 = Column(DecimalString(16), nullable=False)
+    price_3 = Column(DecimalString(16), nullable=False)
+    price_4 = Column(DecimalString(16), nullable=False)
+    rrp_excl_tax = Column(DecimalString(16), nullable=False)
+    rrp_incl_tax = Column(DecimalString(15), nullable=False)
 
     __table_args__ = (
         UniqueConstraint("code", "inventory_item_id"),
@@ -146,7 +166,7 @@ class PriceRegionItem(Base):
         return Decimal(getattr(self, f"price_{level}"))
 
     def set_price(self, level: int, value: Decimal):
-        setattr(self, f"price_{level}", str(value))
+        setattr(self, f"price_{level}", value)
 
     def __repr__(self):
         return (f"<PriceRegionItem(code='{self.code}',"
@@ -161,12 +181,12 @@ class ContractItem(Base):
     code = Column(String(16), nullable=False)
     inventory_item_id = Column(Integer,
                                ForeignKey("inventory_items.id"), nullable=False)
-    price_1 = Column(String(11), nullable=False)
-    price_2 = Column(String(11), nullable=False)
-    price_3 = Column(String(11), nullable=False)
-    price_4 = Column(String(11), nullable=False)
-    price_5 = Column(String(11), nullable=False)
-    price_6 = Column(String(11), nullable=False)
+    price_1 = Column(DecimalString(11), nullable=False)
+    price_2 = Column(DecimalString(11), nullable=False)
+    price_3 = Column(DecimalString(11), nullable=False)
+    price_4 = Column(DecimalString(11), nullable=False)
+    price_5 = Column(DecimalString(11), nullable=False)
+    price_6 = Column(DecimalString(11), nullable=False)
 
     __table_args__ = (
         UniqueConstraint("code", "inventory_item_id"),
@@ -179,7 +199,7 @@ class ContractItem(Base):
         return Decimal(getattr(self, f"price_{level}"))
 
     def set_price(self, level: int, value: Decimal):
-        setattr(self, f"price_{level}", str(value))
+        setattr(self, f"price_{level}", value)
 
     def __repr__(self):
         return f"<ContractItem(code='{self.code}')>"
@@ -219,10 +239,10 @@ class SupplierItem(Base):
     item_code = Column(String(20))
     priority = Column(Integer, nullable=False)
     uom = Column(String(4), nullable=False)
-    conv_factor = Column(String(14), nullable=False)
+    conv_factor = Column(DecimalString(14), nullable=False)
     pack_quantity = Column(Integer, nullable=False)
     moq = Column(Integer, nullable=False)
-    buy_price = Column(String(11), nullable=False)
+    buy_price = Column(DecimalString(11), nullable=False)
 
     __table_args__ = (
         UniqueConstraint("code", "inventory_item_id"),
@@ -245,7 +265,7 @@ class GTINItem(Base):
     inventory_item_id = Column(Integer,
                                ForeignKey("inventory_items.id"), nullable=False)
     uom = Column(String(4), nullable=False)
-    conv_factor = Column(String(14), nullable=False)
+    conv_factor = Column(DecimalString(14), nullable=False)
 
     __table_args__ = (
         UniqueConstraint("code", "inventory_item_id", "uom"),
@@ -327,3 +347,21 @@ class File(Base):
     id = Column(Integer, primary_key=True)
     path = Column(String(255))
     modified = Column(DateTime)
+
+
+class RowHash(Base):
+    __tablename__ = "row_hashes"
+
+    id = Column(Integer, primary_key=True)
+    model = Column(String(50), nullable=False)
+    key = Column(String(255), nullable=False)
+    hash = Column(String(40))
+    run = Column(Integer, nullable=False)
+
+    # Key first, so row hashes can be looked up by key alone.
+    __table_args__ = (
+        UniqueConstraint("key", "model"),
+    )
+
+    def __repr__(self):
+        return f"<RowHash(model='{self.model}', key='{self.key}')>"
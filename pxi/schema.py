@@ -0,0 +1,219 @@
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+import sys
+from typing import Any, Callable, Dict, Sequence, Type
+
+
+# Converts a raw datagrid cell value to a typed value.
+Converter = Callable[[Any], Any]
+
+# Maps datagrid columns to the converters applied to their values.
+Schema = Dict[str, Converter]
+
+# Strings up to this length are interned, since short strings such as codes
+# and units of measure repeat across many rows.
+INTERN_MAX_LENGTH = 20
+
+# Formats tried in turn for dates written as text, if they aren't in
+# ISO 8601 format.
+DATE_FORMATS = (
+    "%d/%m/%Y",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%d-%b-%Y",
+)
+
+# Converter caches are cleared once they hold this many values, so a column
+# of mostly unique values can't grow a cache without bound.
+CACHE_MAX_SIZE = 65536
+
+
+def keep_value(value: Any):
+    """
+    Returns a value unchanged, for columns without a converter.
+    """
+    return value
+
+
+class StrConverter:
+    """
+    Converts cell values to strings.
+
+    Numbers are converted to their string form, so numeric codes compare
+    equal to codes stored in the database. Short strings are interned.
+    """
+
+    def __init__(self):
+        self.cache: Dict[str, str] = {}
+
+    def __call__(self, value: Any):
+        if value is None:
+            return None
+        if value.__class__ is not str:
+            value = str(value)
+        if len(value) > INTERN_MAX_LENGTH:
+            return value
+        cached = self.cache.get(value)
+        if cached is None:
+            if len(self.cache) >= CACHE_MAX_SIZE:
+                self.cache.clear()
+            cached = self.cache[value] = sys.intern(value)
+        return cached
+
+
+class IntConverter:
+    """
+    Converts cell values to integers.
+    """
+
+    def __call__(self, value: Any):
+        if value is None or value == "":
+            return None
+        if value.__class__ is int:
+            return value
+        if value.__class__ is str:
+            return int(Decimal(value))
+        return int(value)
+
+
+class DecimalConverter:
+    """
+    Converts cell values to Decimals.
+
+    Floats are converted through their shortest string form, so 1.1 becomes
+    Decimal("1.1") rather than its binary approximation. Results are cached
+    separately for each type of raw value, so 1 and 1.0 keep their own
+    exponents.
+    """
+
+    def __init__(self):
+        self.caches: Dict[type, Dict[Any, Decimal]] = {
+            str: {},
+            int: {},
+            float: {},
+        }
+
+    def __call__(self, value: Any):
+        if value is None or value == "":
+            return None
+        cache = self.caches.get(value.__class__)
+        if cache is None:
+            return Decimal(value)
+        result = cache.get(value)
+        if result is None:
+            if len(cache) >= CACHE_MAX_SIZE:
+                cache.clear()
+            if value.__class__ is float:
+                result = Decimal(repr(value))
+            else:
+                result = Decimal(value)
+            cache[value] = result
+        return result
+
+
+class DateConverter:
+    """
+    Converts cell values to datetimes.
+
+    Dates are converted to midnight on that day. Strings are parsed in
+    ISO 8601 format or one of DATE_FORMATS.
+    """
+
+    def __init__(self):
+        self.cache: Dict[str, datetime] = {}
+
+    def __call__(self, value: Any):
+        if value is None or value == "":
+            return None
+        if isinstance(value, datetime):
+            return value
+        if isinstance(value, date):
+            return datetime(value.year, value.month, value.day)
+        if isinstance(value, str):
+            result = self.cache.get(value)
+            if result is None:
+                if len(self.cache) >= CACHE_MAX_SIZE:
+                    self.cache.clear()
+                result = self.cache[value] = parse_date(value)
+            return result
+        raise ValueError(f"Cannot convert {value!r} to a date.")
+
+
+def parse_date(value: str):
+    """
+    Parses a date written as text.
+
+    Raises:
+        ValueError: The text isn't in a known date format.
+    """
+    value = value.strip()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"Cannot convert {value!r} to a date.")
+
+
+class EnumConverter:
+    """
+    Converts cell values to members of an Enum.
+
+    Params:
+        enum: The Enum class, looked up by member value.
+    """
+
+    def __init__(self, enum: Type[Enum]):
+        self.enum = enum
+        self.cache: Dict[Any, Enum] = {}
+
+    def __call__(self, value: Any):
+        try:
+            return self.cache[value]
+        except KeyError:
+            member = self.cache[value] = self.enum(value)
+            return member
+
+
+def get_converters(fieldnames: Sequence[str], schema: Schema):
+    """
+    Lists the converter for each column, in the order of the fieldnames.
+    """
+    return [schema.get(fieldname, keep_value) for fieldname in fieldnames]
+
+
+def convert_rows(rows, converters: Sequence[Converter]):
+    """
+    Converts each row of values with the converters for its columns.
+
+    Params:
+        rows: An iterable of value tuples.
+        converters: The converter for each column.
+
+    Returns:
+        A generator yielding a tuple of converted values for each row.
+    """
+    for values in rows:
+        yield tuple([
+            convert(value) for convert, value in zip(converters, values)])
+
+
+def convert_columns(columns, converters: Sequence[Converter]):
+    """
+    Converts whole columns of values with the converter for each column.
+
+    Params:
+        columns: A list of value lists, one for each column.
+        converters: The converter for each column.
+
+    Returns:
+        A list of converted value lists.
+    """
+    return [
+        column if convert is keep_value else list(map(convert, column))
+        for convert, column in zip(converters, columns)]
@@ -88,7 +88,7 @@ def update_supplier_items(
                 key = f"{supp_item.code}--{supp_item.item_code}"
                 if key not in updated_supp_item_keys:
                     updated_supp_item_keys.add(key)
-                    supp_item.buy_price = str(spl_item.supp_price)
+                    supp_item.buy_price = spl_item.supp_price
                     db_session.commit()
                     price_changes.append(price_change)
 
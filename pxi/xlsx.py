@@ -0,0 +1,341 @@
+import posixpath
+from typing import (
+    Any, Callable, Dict, IO, Iterable, Iterator, List, Set, Tuple)
+from xml.etree.ElementTree import iterparse, parse
+from zipfile import ZipFile
+from openpyxl.styles.numbers import (
+    builtin_format_code,
+    is_date_format,
+    is_timedelta_format)
+from openpyxl.utils.datetime import (
+    CALENDAR_MAC_1904,
+    WINDOWS_EPOCH,
+    from_excel,
+    from_ISO8601)
+
+
+# XML namespaces used in XLSX packages.
+SHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+DOC_REL_NS = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships")
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+CELL_TAG = f"{{{SHEET_NS}}}c"
+FORMULA_TAG = f"{{{SHEET_NS}}}f"
+INLINE_STRING_TAG = f"{{{SHEET_NS}}}is"
+PHONETIC_TAG = f"{{{SHEET_NS}}}rPh"
+ROW_TAG = f"{{{SHEET_NS}}}row"
+SHARED_STRING_TAG = f"{{{SHEET_NS}}}si"
+TEXT_TAG = f"{{{SHEET_NS}}}t"
+VALUE_TAG = f"{{{SHEET_NS}}}v"
+RELATIONSHIP_TAG = f"{{{PKG_REL_NS}}}Relationship"
+
+XlsxRow = Tuple[Any, ...]
+ColumnSelector = Callable[[XlsxRow], Iterable[int] | None]
+
+
+def iter_xlsx_rows(
+        filepath,
+        worksheet_name: str | None = None,
+        select_columns: ColumnSelector | None = None) -> Iterator[XlsxRow]:
+    """
+    Reads cell values from a worksheet without building a cell object for
+    each cell.
+
+    Values are converted the same way openpyxl converts them in read-only
+    mode. Rows missing from the worksheet are yielded as empty tuples.
+
+    Params:
+        filepath: The path to the XLSX file.
+        worksheet_name: The name of the worksheet. Defaults to the first
+            worksheet.
+        select_columns: Called with the values of the first row, and returns
+            the indexes of the columns to decode in the following rows, or
+            None to decode every column. Cells in other columns are None.
+
+    Returns:
+        A generator yielding a tuple of values for each row, starting with
+        the first row.
+    """
+    with ZipFile(filepath) as archive:
+        workbook_path = get_workbook_path(archive)
+        parts = get_relationships(archive, workbook_path)
+        worksheet_path, epoch = get_worksheet_path(
+            archive, workbook_path, parts, worksheet_name)
+
+        shared_strings: List[str] = []
+        if "sharedStrings" in parts:
+            with archive.open(parts["sharedStrings"]) as source:
+                shared_strings = read_shared_strings(source)
+
+        date_styles: Set[int] = set()
+        timedelta_styles: Set[int] = set()
+        if "styles" in parts:
+            with archive.open(parts["styles"]) as source:
+                date_styles, timedelta_styles = read_date_styles(source)
+
+        with archive.open(worksheet_path) as source:
+            yield from iter_worksheet_xml_rows(
+                source,
+                shared_strings,
+                date_styles,
+                timedelta_styles,
+                epoch,
+                select_columns)
+
+
+def iter_worksheet_xml_rows(
+        source: IO[bytes],
+        shared_strings: List[str],
+        date_styles: Set[int],
+        timedelta_styles: Set[int],
+        epoch=WINDOWS_EPOCH,
+        select_columns: ColumnSelector | None = None):
+    """
+    Parses rows of cell values from worksheet XML.
+
+    Params:
+        source: The worksheet XML file.
+        shared_strings: The shared strings table.
+        date_styles: Indexes of cell styles with a date format.
+        timedelta_styles: Indexes of cell styles with a duration format.
+        epoch: The date of serial number 0.
+        select_columns: Selects the columns to decode after the first row.
+
+    Returns:
+        A generator yielding a tuple of values for each row.
+    """
+    column_indexes: Dict[str, int] = {}
+    selected: Set[int] | None = None
+    last_selected = -1
+    row_number = 0
+    for _, element in iterparse(source):
+        if element.tag != ROW_TAG:
+            continue
+
+        # Yield empty rows for any rows missing from the XML.
+        number = element.get("r")
+        number = int(number) if number else row_number + 1
+        for _ in range(row_number + 1, number):
+            yield ()
+        row_number = number
+
+        values: List[Any] = []
+        for cell in element.iter(CELL_TAG):
+            # Place the value in the column given by the cell reference.
+            index = len(values)
+            reference = cell.get("r")
+            if reference:
+                letters = reference.rstrip("0123456789")
+                index = column_indexes.get(letters)
+                if index is None:
+                    index = column_index(letters)
+                    column_indexes[letters] = index
+                if index > len(values):
+                    values.extend([None] * (index - len(values)))
+
+            # Skip cells outside the selected columns.
+            if selected is not None and index not in selected:
+                if index > last_selected:
+                    break
+                values.append(None)
+                continue
+
+            values.append(parse_cell(
+                cell,
+                shared_strings,
+                date_styles,
+                timedelta_styles,
+                epoch))
+        element.clear()
+        row_values = tuple(values)
+
+        # Select the columns to decode once the first row has been read.
+        if row_number == 1 and select_columns is not None:
+            indexes = select_columns(row_values)
+            if indexes is not None:
+                selected = set(indexes)
+                last_selected = max(selected, default=-1)
+        yield row_values
+
+
+def parse_cell(
+        cell,
+        shared_strings: List[str],
+        date_styles: Set[int],
+        timedelta_styles: Set[int],
+        epoch):
+    """
+    Converts a cell element to a Python value.
+    """
+    # Find the value and formula in a single pass over the cell's children.
+    value = None
+    for child in cell:
+        tag = child.tag
+        if tag == VALUE_TAG:
+            value = child.text or None
+        elif tag == FORMULA_TAG:
+            return "=" + (child.text or "")
+        elif tag == INLINE_STRING_TAG:
+            return text_content(child)
+    if value is None:
+        return None
+
+    data_type = cell.get("t", "n")
+    if data_type == "n":
+        number = cast_number(value)
+        style = int(cell.get("s", 0))
+        if style in date_styles:
+            try:
+                return from_excel(
+                    number, epoch, timedelta=style in timedelta_styles)
+            except (OverflowError, ValueError):
+                return "#VALUE!"
+        return number
+    if data_type == "s":
+        return shared_strings[int(value)]
+    if data_type == "b":
+        return bool(int(value))
+    if data_type == "d":
+        return from_ISO8601(value)
+    return value
+
+
+def cast_number(value: str):
+    """
+    Converts a numeric string to an int or float.
+    """
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def column_index(letters: str):
+    """
+    Converts column letters to a zero-based column index.
+    """
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def text_content(element):
+    """
+    Joins the text of a string item, ignoring phonetic runs.
+    """
+    snippets: List[str] = []
+    for child in element:
+        if child.tag == TEXT_TAG:
+            snippets.append(child.text or "")
+        elif child.tag != PHONETIC_TAG:
+            for text in child.iter(TEXT_TAG):
+                snippets.append(text.text or "")
+    return "".join(snippets)
+
+
+def read_shared_strings(source: IO[bytes]):
+    """
+    Reads the shared strings table.
+    """
+    strings: List[str] = []
+    for _, element in iterparse(source):
+        if element.tag == SHARED_STRING_TAG:
+            strings.append(text_content(element).replace("x005F_", ""))
+            element.clear()
+    return strings
+
+
+def read_date_styles(source: IO[bytes]):
+    """
+    Finds the cell styles with a date or duration number format.
+
+    Returns:
+        A tuple containing the set of date style indexes and the set of
+        duration style indexes.
+    """
+    root = parse(source).getroot()
+    custom_formats = {
+        int(num_fmt.get("numFmtId")): num_fmt.get("formatCode")
+        for num_fmt in root.iter(f"{{{SHEET_NS}}}numFmt")}
+    date_styles: Set[int] = set()
+    timedelta_styles: Set[int] = set()
+    cell_xfs = root.find(f"{{{SHEET_NS}}}cellXfs")
+    if cell_xfs is None:
+        return date_styles, timedelta_styles
+    for index, xf in enumerate(cell_xfs.iter(f"{{{SHEET_NS}}}xf")):
+        num_fmt_id = int(xf.get("numFmtId", 0))
+        format_code = custom_formats.get(num_fmt_id)
+        if format_code is None:
+            format_code = builtin_format_code(num_fmt_id)
+        if format_code and is_date_format(format_code):
+            date_styles.add(index)
+        if format_code and is_timedelta_format(format_code):
+            timedelta_styles.add(index)
+    return date_styles, timedelta_styles
+
+
+def get_workbook_path(archive: ZipFile):
+    """
+    Finds the workbook part in the package.
+    """
+    with archive.open("_rels/.rels") as source:
+        root = parse(source).getroot()
+    for relationship in root.iter(RELATIONSHIP_TAG):
+        if relationship.get("Type").endswith("/officeDocument"):
+            return resolve_target("", relationship.get("Target"))
+    return "xl/workbook.xml"
+
+
+def get_relationships(archive: ZipFile, part_path: str):
+    """
+    Maps relationship types to part paths for a part in the package.
+
+    Worksheet relationships are keyed by relationship id instead.
+    """
+    part_dir, part_name = posixpath.split(part_path)
+    rels_path = posixpath.join(part_dir, "_rels", f"{part_name}.rels")
+    with archive.open(rels_path) as source:
+        root = parse(source).getroot()
+    parts: Dict[str, str] = {}
+    for relationship in root.iter(RELATIONSHIP_TAG):
+        rel_type = relationship.get("Type").rsplit("/", 1)[-1]
+        target = resolve_target(part_dir, relationship.get("Target"))
+        if rel_type == "worksheet":
+            parts[relationship.get("Id")] = target
+        else:
+            parts[rel_type] = target
+    return parts
+
+
+def get_worksheet_path(
+        archive: ZipFile,
+        workbook_path: str,
+        parts: Dict[str, str],
+        worksheet_name: str | None):
+    """
+    Finds the part for a worksheet and the date epoch used by the workbook.
+
+    Raises:
+        KeyError: The workbook has no worksheet with the given name.
+    """
+    with archive.open(workbook_path) as source:
+        root = parse(source).getroot()
+    epoch = WINDOWS_EPOCH
+    workbook_pr = root.find(f"{{{SHEET_NS}}}workbookPr")
+    if workbook_pr is not None:
+        if workbook_pr.get("date1904") in ("1", "true"):
+            epoch = CALENDAR_MAC_1904
+    for sheet in root.iter(f"{{{SHEET_NS}}}sheet"):
+        if worksheet_name is None or sheet.get("name") == worksheet_name:
+            return parts[sheet.get(f"{{{DOC_REL_NS}}}id")], epoch
+    raise KeyError(f"Worksheet {worksheet_name} does not exist.")
+
+
+def resolve_target(base_dir: str, target: str):
+    """
+    Resolves a relationship target to a path in the package.
+    """
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base_dir, target))
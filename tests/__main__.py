@@ -3,12 +3,14 @@ import unittest
 
 from tests.analysis import AnalysisTests
 from tests.commands import CommandTests
+from tests.compression import CompressionTests
 from tests.config import ConfigTests
 from tests.dataclasses import BuyPriceChangeTests, SellPriceChangeTests
 from tests.datagrid import DatagridTests
 from tests.exporters import ExporterTests
 from tests.image import ImageFetchingTests, ImageFormattingTests
 from tests.importers import ImporterTests
+from tests.metrics import MetricsTests
 from tests.price_calc import PriceCalcTests
 from tests.remote import RemoteTests
 from tests.report import (
@@ -16,8 +18,10 @@ from tests.report import (
     NumberFieldTests,
     StringFieldTests,
     ReportWriterTests)
+from tests.schema import SchemaTests
 from tests.spl_update import SPLUpdateTests
 from tests.web_update import WebUpdateTests
+from tests.xlsx import XlsxReaderTests
 
 testloader = unittest.TestLoader()
 
@@ -25,21 +29,25 @@ testcases = [
     AnalysisTests,
     BuyPriceChangeTests,
     CommandTests,
+    CompressionTests,
     ConfigTests,
     DatagridTests,
     ExporterTests,
     ImageFetchingTests,
     ImageFormattingTests,
     ImporterTests,
+    MetricsTests,
     NumberFieldTests,
     PriceCalcTests,
     ReportFieldTests,
     RemoteTests,
     ReportWriterTests,
+    SchemaTests,
     SellPriceChangeTests,
     SPLUpdateTests,
     StringFieldTests,
     WebUpdateTests,
+    XlsxReaderTests,
 ]
 
 testsuites = [
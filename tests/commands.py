@@ -1,10 +1,23 @@
 
+from decimal import Decimal
 import io
 from unittest.mock import call, MagicMock, mock_open, patch
 
 from pxi.config import Config
-from pxi.commands import Commands, commands, get_command
+from pxi.commands import (
+    INACTIVE_ITEM_CONDITIONS,
+    UNSTOCKED_ITEM_TYPES,
+    Commands,
+    commands,
+    get_command)
+from pxi.dataclasses import ImportFilters
 from pxi.enum import ItemCondition, ItemType
+from pxi.importers import (
+    ImportContext,
+    import_contract_items,
+    import_inventory_items,
+    import_price_region_items,
+    import_price_rules)
 from pxi.models import (
     ContractItem,
     GTINItem,
@@ -30,11 +43,17 @@ from tests.fakes import (
     fake_warehouse_stock_item,
     fake_web_menu_item,
     random_string)
+from tests.importers import (
+    fake_contract_items_datagrid_row,
+    fake_inventory_items_datagrid_row,
+    fake_price_region_items_datagrid_row,
+    fake_price_rules_datagrid_row)
 
 
 def get_mock_config() -> Config:
     return {
         "paths": {
+            "database": "path/database",
             "logging": "path/logging",
             "imports": {
                 "contract_items_datagrid": "path/import/contract_items_datagrid",
@@ -348,7 +367,9 @@ class CommandTests(DatabaseTestCase):
             PriceRule,
             PriceRegionItem,
             ContractItem,
-        ])
+        ], filters=ImportFilters(
+            ignore_item_conditions=INACTIVE_ITEM_CONDITIONS,
+            ignore_item_types=UNSTOCKED_ITEM_TYPES))
         mock_recalculate_sell_prices.assert_called_with(
             [pr_item], command.db_session)
         mock_recalculate_contract_prices.assert_called_with(
@@ -369,6 +390,88 @@ class CommandTests(DatabaseTestCase):
             export_paths["tickets_list"],
             [ws_item])
 
+    @patch("pxi.exporters.ReportWriter")
+    @patch("pxi.commands.export_tickets_list")
+    @patch("pxi.commands.export_contract_item_task")
+    @patch("pxi.commands.export_product_price_task")
+    @patch("pxi.commands.export_pricelist")
+    @patch("pxi.commands.import_data")
+    def test_command_price_calc_ignored_default_price_rule(
+            self,
+            mock_import_data,
+            mock_export_pricelist,
+            mock_export_product_price_task,
+            mock_export_contract_item_task,
+            mock_export_tickets_list,
+            mock_rprtwrtr_class):
+        """
+        price_calc command imports PriceRegionItems in the default price
+        region that have an ignored PriceRule, as the reports use them.
+        """
+        mock_config = get_mock_config()
+        inv_item_row = fake_inventory_items_datagrid_row({
+            "replacement_cost": Decimal("10.00"),
+        })
+        item_code = inv_item_row["item_code"]
+        price_rule_rows = [
+            fake_price_rules_datagrid_row({"rule": "NA"}),
+            fake_price_rules_datagrid_row({
+                "rule": "R1",
+                "price0_factor": Decimal("2.0000"),
+            }),
+        ]
+        prices = {
+            "w_sale_price": Decimal("0.00"),
+            "pr_1_corpa": Decimal("0.00"),
+            "pr_2_corp_b": Decimal("0.00"),
+            "pr_3_corp_c": Decimal("0.00"),
+            "pr_4_bulk": Decimal("0.00"),
+        }
+        price_region_item_rows = [
+            fake_price_region_items_datagrid_row({
+                "item_code": item_code,
+                "region": "",
+                "rule": "NA",
+                **prices,
+            }),
+            fake_price_region_items_datagrid_row({
+                "item_code": item_code,
+                "region": "01",
+                "rule": "R1",
+                **prices,
+            }),
+        ]
+        contract_item_row = fake_contract_items_datagrid_row({
+            "item_code": item_code,
+        })
+
+        def import_rows(db_session, paths, models, filters):
+            context = ImportContext(db_session, filters)
+            import_inventory_items(
+                "", db_session, [inv_item_row], context=context)
+            import_price_rules(
+                "", db_session, price_rule_rows, context=context)
+            import_price_region_items(
+                "", db_session, price_region_item_rows, context=context)
+            import_contract_items(
+                "", db_session, [contract_item_row], context=context)
+
+        mock_import_data.side_effect = import_rows
+
+        command = Commands.price_calc(mock_config)
+        command.db_session = self.db_session
+        with self.assertLogs(level="INFO"):
+            command()
+
+        # pylint:disable=no-member
+        inv_item = self.db_session.query(InventoryItem).one()
+        self.assertEqual(
+            inv_item.default_price_region_item.price_rule.code, "NA")
+        write_sheet = mock_rprtwrtr_class.return_value.write_sheet
+        self.assertEqual(write_sheet.call_args_list[1][0][0],
+                         "Contract Changes")
+        self.assertEqual(len(write_sheet.call_args_list[1][0][2]), 1)
+
     @patch("pxi.commands.export_supplier_pricelist")
     @patch("pxi.commands.export_supplier_price_changes_report")
     @patch("pxi.commands.remove_exported_supplier_pricelists")
@@ -410,7 +513,9 @@ class CommandTests(DatabaseTestCase):
             SupplierItem,
         ])
         mock_import_supplier_pricelist_items.assert_called_with(
-            import_paths["supplier_pricelist"])
+            import_paths["supplier_pricelist"],
+            suppliers=None,
+            keys={(supp_item.code, supp_item.item_code)})
         mock_update_supplier_items.assert_called_with(
             [spl_item], command.db_session)
         mock_remove_exported_supplier_pricelists.assert_called_with(
@@ -462,16 +567,23 @@ class CommandTests(DatabaseTestCase):
         mock_import_supplier_pricelist_items.return_value = spl_items
         mock_update_supplier_items.return_value = bp_changes
 
+        suppliers = [supp_item_1a.code, supp_item_1b.code]
+
         command = Commands.generate_spls(mock_config)
         command.db_session = self.db_session
-        command()
+        command(suppliers=suppliers)
 
         mock_import_data.assert_called_with(command.db_session, import_paths, [
             InventoryItem,
             SupplierItem,
         ])
         mock_import_supplier_pricelist_items.assert_called_with(
-            import_paths["supplier_pricelist"])
+            import_paths["supplier_pricelist"],
+            suppliers=set(suppliers),
+            keys={
+                (supp_item_1a.code, supp_item_1a.item_code),
+                (supp_item_1b.code, supp_item_1b.item_code),
+            })
         mock_update_supplier_items.assert_called_with(
             spl_items, command.db_session)
         mock_remove_exported_supplier_pricelists.assert_called_with(
@@ -542,10 +654,13 @@ class CommandTests(DatabaseTestCase):
             PriceRule,
             PriceRegionItem,
             InventoryWebDataItem,
-        ])
+        ], filters=ImportFilters(
+            ignore_item_conditions=INACTIVE_ITEM_CONDITIONS,
+            ignore_item_types=UNSTOCKED_ITEM_TYPES))
         mock_import_web_menu_item_mappings.assert_called_with(
             import_paths["web_menu_mappings"],
-            command.db_session)
+            command.db_session,
+            context=mock_import_data.return_value)
         mock_update_product_menu.assert_called_with(
             [iwd_item],
             wmi_mappings,
@@ -586,7 +701,10 @@ class CommandTests(DatabaseTestCase):
         mock_import_data.assert_called_with(command.db_session, import_paths, [
             InventoryItem,
             GTINItem,
-        ])
+        ], filters=ImportFilters(
+            ignore_item_conditions=INACTIVE_ITEM_CONDITIONS,
+            ignore_item_types=UNSTOCKED_ITEM_TYPES,
+            ignore_brands=set(mock_config["gtin"]["ignore_brands"])))
         mock_export_gtin_report.assert_called_with(
             export_paths["gtin_report"], [inv_item], [])
 
@@ -626,7 +744,8 @@ class CommandTests(DatabaseTestCase):
         ])
         mock_import_missing_images_report.assert_called_with(
             import_paths["missing_images_report"],
-            command.db_session)
+            command.db_session,
+            context=mock_import_data.return_value)
         mock_fetch_images.assert_called_with(
             export_paths["images_dir"],
             [inv_item])
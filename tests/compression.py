@@ -0,0 +1,51 @@
+import bz2
+import gzip
+import lzma
+import os
+from tempfile import TemporaryDirectory
+
+from pxi.compression import (
+    get_compression,
+    open_file,
+    open_seekable,
+    strip_compression)
+from tests import PXITestCase
+from tests.fakes import random_string
+
+
+class CompressionTests(PXITestCase):
+
+    def test_get_compression(self):
+        """
+        Gets the compression extension of compressed files.
+        """
+        self.assertEqual(get_compression("SPL.PRN.gz"), ".gz")
+        self.assertEqual(get_compression("datagrid.CSV.BZ2"), ".bz2")
+        self.assertEqual(get_compression("datagrid.xlsx.xz"), ".xz")
+        self.assertIsNone(get_compression("datagrid.xlsx"))
+        self.assertEqual(
+            strip_compression("datagrid.csv.gz"), "datagrid.csv")
+        self.assertEqual(strip_compression("SPL.PRN"), "SPL.PRN")
+
+    def test_open_file(self):
+        """
+        Reads plain and compressed files as the same stream of text.
+        """
+        text = "".join(f"{random_string(10)}\n" for _ in range(10))
+        with TemporaryDirectory() as directory:
+            for filename, opener in [
+                    ("file.txt", open),
+                    ("file.txt.gz", gzip.open),
+                    ("file.txt.bz2", bz2.open),
+                    ("file.txt.xz", lzma.open)]:
+                filepath = os.path.join(directory, filename)
+                with opener(filepath, "wt") as file:
+                    file.write(text)
+                with self.subTest(filename=filename):
+                    with open_file(filepath, "rt") as file:
+                        self.assertEqual(file.read(), text)
+                    seekable = open_seekable(filepath)
+                    if filename == "file.txt":
+                        self.assertEqual(seekable, filepath)
+                    else:
+                        self.assertEqual(seekable.read(), text.encode())
@@ -1,8 +1,35 @@
 
+import bz2
+import csv
+from datetime import datetime
+from decimal import Decimal
+import gzip
+import lzma
+import os
+import pickle
 from random import random
+import struct
+from tempfile import TemporaryDirectory
+from types import GeneratorType
 from unittest.mock import MagicMock, call, patch
+from openpyxl import Workbook
 
-from pxi.datagrid import get_fieldnames, load_rows, read_rows, snakecase
+from pxi.datagrid import (
+    CACHE_MAGIC,
+    CACHE_SUFFIX,
+    DATAGRID_OPTIONS,
+    get_fieldnames,
+    iter_rows,
+    iter_worksheet_rows,
+    load_rows,
+    read_rows,
+    snakecase)
+from pxi.enum import ItemType
+from pxi.schema import (
+    DateConverter,
+    DecimalConverter,
+    EnumConverter,
+    StrConverter)
 from tests import PXITestCase
 from tests.fakes import random_string
 
@@ -54,79 +81,114 @@ class DatagridTests(PXITestCase):
         """
         Collects fieldnames from first row of worksheet.
         """
-
         mock_worksheet = MagicMock()
         fieldnames = [
             random_string(10).lower(),
             random_string(10).lower(),
             random_string(10).lower(),
         ]
-        mock_worksheet.cell.side_effect = [
-            mock_cell(fieldname) for fieldname in fieldnames
-        ] + [
-            mock_cell(None)
-        ]
+        mock_worksheet.iter_rows.return_value = iter([
+            tuple(fieldnames) + (None, random_string(10)),
+        ])
 
         result = get_fieldnames(mock_worksheet)
 
-        mock_worksheet.cell.assert_has_calls([
-            call(1, 1),
-            call(1, 2),
-            call(1, 3),
-            call(1, 4),
-        ])
+        mock_worksheet.iter_rows.assert_called_with(
+            min_row=1, max_row=1, values_only=True)
         self.assertEqual(result, fieldnames)
 
-    @patch("pxi.datagrid.get_fieldnames")
-    def test_read_rows(self, mock_get_fieldnames):
+    def test_iter_worksheet_rows(self):
         """
-        Reads data from worksheet and returns a list of dicts.
+        Reads data from worksheet and yields a dict for each row.
         """
         fieldnames = [
             random_string(10).lower(),
             random_string(10).lower(),
         ]
         cell_values = [
-            [
+            (
                 random_string(10),
                 random_string(10),
-            ],
-            [
+            ),
+            (
                 random_string(10),
                 random_string(10),
-            ],
+            ),
         ]
         expected_rows = [
             dict(zip(fieldnames, row_values))
             for row_values in cell_values]
-        mock_get_fieldnames.return_value = fieldnames
         mock_worksheet = MagicMock()
-        mock_worksheet.iter_rows.return_value = [
-            [mock_cell(value) for value in cell_values[0]],
-            [mock_cell(value) for value in cell_values[1]],
-            [mock_cell(None)],
+        mock_worksheet.iter_rows.return_value = iter(
+            [tuple(name.upper() for name in fieldnames)] + cell_values + [
+                (None, None),
+                (random_string(10), random_string(10)),
+            ])
+
+        result = iter_worksheet_rows(mock_worksheet)
+
+        self.assertIsInstance(result, GeneratorType)
+        self.assertEqual(list(result), expected_rows)
+        mock_worksheet.iter_rows.assert_called_once_with(values_only=True)
+
+    @patch("pxi.datagrid.iter_worksheet_rows")
+    def test_read_rows(self, mock_iter_worksheet_rows):
+        """
+        Reads data from worksheet and returns a list of dicts.
+        """
+        mock_worksheet = MagicMock()
+        rows = [
+            {random_string(10): random_string(10)},
+            {random_string(10): random_string(10)},
         ]
+        mock_iter_worksheet_rows.return_value = iter(rows)
 
         result = read_rows(mock_worksheet)
 
-        self.assertEqual(result, expected_rows)
+        mock_iter_worksheet_rows.assert_called_with(mock_worksheet)
+        self.assertEqual(result, rows)
+
+    @patch("pxi.datagrid.iter_worksheet_values")
+    @patch("pxi.datagrid.load_workbook")
+    def test_iter_rows_closes_workbook(
+            self,
+            mock_load_workbook,
+            mock_iter_worksheet_values):
+        """
+        Closes the workbook when the row generator is closed early.
+        """
+        filename = random_string(20)
+        mock_workbook = mock_load_workbook.return_value
+        mock_workbook.get_sheet_names.return_value = [random_string(10)]
+        mock_iter_worksheet_values.return_value = iter([["a"], (1,), (2,)])
 
-    @patch("pxi.datagrid.read_rows")
+        rows = iter_rows(filename)
+        next(rows)
+        mock_workbook.close.assert_not_called()
+        rows.close()
+
+        mock_workbook.close.assert_called()
+
+    @patch("pxi.datagrid.iter_worksheet_values")
     @patch("pxi.datagrid.load_workbook")
     def test_load_rows_without_worksheet_name(
             self,
             mock_load_workbook,
-            mock_read_rows):
+            mock_iter_worksheet_values):
         """
         Loads rows from first worksheet in file when no worksheet name given.
         """
         filename = random_string(20)
         worksheet_name = random_string(10)
+        fieldname = random_string(10).lower()
+        value = random_string(10)
+        rows = [{fieldname: value}]
         mock_worksheet = MagicMock()
         mock_workbook = mock_load_workbook.return_value
         mock_workbook.get_sheet_names.return_value = [
             worksheet_name, random_string(20)]
         mock_workbook.get_sheet_by_name.return_value = mock_worksheet
+        mock_iter_worksheet_values.return_value = iter([[fieldname], (value,)])
 
         result = load_rows(filename)
 
@@ -135,23 +197,27 @@ class DatagridTests(PXITestCase):
         mock_workbook.get_sheet_names.assert_called()
         mock_workbook.get_sheet_by_name.assert_called_with(worksheet_name)
         mock_workbook.close.assert_called()
-        mock_read_rows.assert_called_with(mock_worksheet)
-        self.assertEqual(result, mock_read_rows.return_value)
+        mock_iter_worksheet_values.assert_called_with(mock_worksheet, None)
+        self.assertEqual(result, rows)
 
-    @patch("pxi.datagrid.read_rows")
+    @patch("pxi.datagrid.iter_worksheet_values")
     @patch("pxi.datagrid.load_workbook")
     def test_load_rows_with_worksheet_name(
             self,
             mock_load_workbook,
-            mock_read_rows):
+            mock_iter_worksheet_values):
         """
         Loads rows from first worksheet in file when worksheet name given.
         """
         filename = random_string(20)
         worksheet_name = random_string(20)
+        fieldname = random_string(10).lower()
+        value = random_string(10)
+        rows = [{fieldname: value}]
         mock_worksheet = MagicMock()
         mock_workbook = mock_load_workbook.return_value
         mock_workbook.get_sheet_by_name.return_value = mock_worksheet
+        mock_iter_worksheet_values.return_value = iter([[fieldname], (value,)])
 
         result = load_rows(filename, worksheet_name=worksheet_name)
 
@@ -160,8 +226,274 @@ class DatagridTests(PXITestCase):
         mock_workbook.get_sheet_names.assert_not_called()
         mock_workbook.get_sheet_by_name.assert_called_with(worksheet_name)
         mock_workbook.close.assert_called()
-        mock_read_rows.assert_called_with(mock_worksheet)
-        self.assertEqual(result, mock_read_rows.return_value)
+        mock_iter_worksheet_values.assert_called_with(mock_worksheet, None)
+        self.assertEqual(result, rows)
+
+    def test_load_rows_from_cache(self):
+        """
+        Saves parsed rows to a cache file and reads them back while the
+        datagrid is unchanged.
+        """
+        rows = [
+            ["Item Code", "Description"],
+            [random_string(10), random_string(20)],
+            [random_string(10), None],
+        ]
+        expected_rows = [
+            {"item_code": row[0], "description": row[1]}
+            for row in rows[1:]]
+        with TemporaryDirectory() as dirname, \
+                patch.dict(DATAGRID_OPTIONS, {"cache": True}):
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+
+            result = load_rows(filepath)
+
+            self.assertEqual(result, expected_rows)
+            self.assertTrue(os.path.exists(filepath + CACHE_SUFFIX))
+            with patch("pxi.datagrid.load_workbook") as mock_load_workbook:
+                cached_result = load_rows(filepath)
+            mock_load_workbook.assert_not_called()
+            self.assertEqual(cached_result, expected_rows)
+
+    def test_load_rows_from_cache_with_dates(self):
+        """
+        Reads dates and numbers back from the cache as they were read from
+        the workbook, when the cache was written in several chunks.
+        """
+        rows = [
+            ["Item Code", "Price", "Creation Date"],
+            [random_string(10), 1.25, datetime(2020, 1, 2, 3, 4)],
+            [random_string(10), 3, None],
+            [random_string(10), None, datetime(2021, 3, 4)],
+        ]
+        with TemporaryDirectory() as dirname, \
+                patch.dict(DATAGRID_OPTIONS, {"cache": True}), \
+                patch("pxi.datagrid.CACHE_CHUNK_SIZE", 2):
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+
+            expected_rows = load_rows(filepath)
+            with patch("pxi.datagrid.load_workbook") as mock_load_workbook:
+                cached_result = load_rows(filepath)
+
+        mock_load_workbook.assert_not_called()
+        self.assertEqual(cached_result, expected_rows)
+        self.assertEqual(
+            cached_result[0]["creation_date"], datetime(2020, 1, 2, 3, 4))
+
+    def test_load_rows_ignores_pickled_cache(self):
+        """
+        Reads the workbook instead of a cache file that isn't plain data.
+        """
+        rows = [
+            ["Item Code"],
+            [random_string(10)],
+        ]
+        with TemporaryDirectory() as dirname, \
+                patch.dict(DATAGRID_OPTIONS, {"cache": True}):
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+            header = pickle.dumps({"fingerprint": {}})
+            with open(filepath + CACHE_SUFFIX, "wb") as file:
+                file.write(CACHE_MAGIC)
+                file.write(struct.pack("<Q", len(header)))
+                file.write(header)
+
+            with patch("pickle.loads") as mock_loads:
+                result = load_rows(filepath)
+
+        mock_loads.assert_not_called()
+        self.assertEqual(result, [{"item_code": rows[1][0]}])
+
+    def test_load_rows_with_native_reader(self):
+        """
+        Reads the same rows with the native reader as with openpyxl.
+        """
+        rows = [
+            ["Item Code", "Price", "Creation Date", "Description"],
+            [random_string(10), 1.25, datetime(2020, 1, 2), random_string(20)],
+            [random_string(10), 3, datetime(2021, 3, 4, 5, 6), None],
+        ]
+        with TemporaryDirectory() as dirname:
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+
+            with patch.dict(DATAGRID_OPTIONS, {"reader": "openpyxl"}):
+                expected_rows = load_rows(filepath)
+            with patch.dict(DATAGRID_OPTIONS, {"reader": "native"}), \
+                    patch("pxi.datagrid.load_workbook") as mock_load_workbook:
+                result = load_rows(filepath)
+
+        mock_load_workbook.assert_not_called()
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result, expected_rows)
+
+    def test_load_rows_ignores_stale_cache(self):
+        """
+        Reads the workbook again when the datagrid has changed.
+        """
+        rows = [
+            ["Item Code"],
+            [random_string(10)],
+        ]
+        with TemporaryDirectory() as dirname, \
+                patch.dict(DATAGRID_OPTIONS, {"cache": True}):
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+            load_rows(filepath)
+            rows.append([random_string(10)])
+            write_workbook(filepath, rows)
+
+            result = load_rows(filepath)
+
+        self.assertEqual(result, [
+            {"item_code": row[0]} for row in rows[1:]])
+
+    def test_load_rows_with_columns(self):
+        """
+        Reads only the given columns with each reader and from the cache.
+        """
+        rows = [
+            ["Item Code", "Price", "Description", "Brand"],
+            [random_string(10), 1.25, random_string(20), random_string(5)],
+            [random_string(10), 3, None, random_string(5)],
+        ]
+        columns = ["description", "item_code", "missing"]
+        expected_rows = [
+            {"description": row[2], "item_code": row[0]}
+            for row in rows[1:]]
+        with TemporaryDirectory() as dirname:
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+
+            for options in [
+                    {"reader": "openpyxl", "cache": False},
+                    {"reader": "native", "cache": False},
+                    {"reader": "native", "cache": True},
+                    {"reader": "native", "cache": True}]:
+                with self.subTest(**options), \
+                        patch.dict(DATAGRID_OPTIONS, options):
+                    result = load_rows(filepath, columns=columns)
+                    self.assertEqual(result, expected_rows)
+
+            # The cache holds every column, whichever were first requested.
+            with patch.dict(DATAGRID_OPTIONS, {"cache": True}):
+                result = load_rows(filepath)
+            self.assertEqual(result[0]["brand"], rows[1][3])
+
+    def test_load_rows_with_schema(self):
+        """
+        Converts values with the schema, reading only the schema's columns.
+        """
+        item_code = random_string(10)
+        rows = [
+            ["Item Code", "Price", "Status", "Description"],
+            [1234, 1.1, "S", random_string(20)],
+            [item_code, 3, "K", None],
+        ]
+        schema = {
+            "item_code": StrConverter(),
+            "price": DecimalConverter(),
+            "status": EnumConverter(ItemType),
+        }
+        expected_rows = [
+            {
+                "item_code": "1234",
+                "price": Decimal("1.1"),
+                "status": ItemType.STOCKED_ITEM,
+            },
+            {
+                "item_code": item_code,
+                "price": Decimal("3"),
+                "status": ItemType.KIT_ITEM,
+            },
+        ]
+        with TemporaryDirectory() as dirname:
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+
+            for cache in [False, True, True]:
+                with self.subTest(cache=cache), \
+                        patch.dict(DATAGRID_OPTIONS, {"cache": cache}):
+                    result = load_rows(filepath, schema=schema)
+                    self.assertEqual(result, expected_rows)
+
+    def test_load_rows_from_text(self):
+        """
+        Reads the same rows from CSV and TSV datagrids as from XLSX.
+        """
+        rows = [
+            ["Item Code", "Price", "Creation Date", "Description"],
+            ["ABC 123", 1.1, datetime(2020, 1, 2), "Widget, large"],
+            [random_string(10), 3, datetime(2021, 3, 4), None],
+        ]
+        text_rows = [
+            rows[0],
+            ["ABC 123", "1.1", "02/01/2020", "Widget, large"],
+            [rows[2][0], "3", "2021-03-04", ""],
+        ]
+        schema = {
+            "item_code": StrConverter(),
+            "price": DecimalConverter(),
+            "creation_date": DateConverter(),
+            "description": StrConverter(),
+        }
+        with TemporaryDirectory() as dirname:
+            filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(filepath, rows)
+            expected_rows = load_rows(filepath, schema=schema)
+
+            for filename, delimiter in [
+                    ("datagrid.csv", ","),
+                    ("datagrid.tsv", "\t"),
+                    ("datagrid.txt", "|")]:
+                text_filepath = os.path.join(dirname, filename)
+                with open(text_filepath, "w", newline="") as file:
+                    csv.writer(file, delimiter=delimiter).writerows(
+                        text_rows + [[], [random_string(10)]])
+                with self.subTest(filename=filename):
+                    result = load_rows(text_filepath, schema=schema)
+                    self.assertEqual(result, expected_rows)
+
+    def test_load_rows_from_compressed(self):
+        """
+        Reads the same rows from compressed datagrids as from uncompressed
+        datagrids.
+        """
+        rows = [
+            ["Item Code", "Description"],
+            ["ABC 123", "Widget, large"],
+            [random_string(10), random_string(20)],
+        ]
+        with TemporaryDirectory() as dirname:
+            xlsx_filepath = os.path.join(dirname, "datagrid.xlsx")
+            write_workbook(xlsx_filepath, rows)
+            expected_rows = load_rows(xlsx_filepath)
+            with open(xlsx_filepath, "rb") as file:
+                xlsx_data = file.read()
+            text_data = "".join(f"{a}\t{b}\n" for a, b in rows).encode()
+
+            for filename, opener, data in [
+                    ("datagrid.xlsx.gz", gzip.open, xlsx_data),
+                    ("datagrid.xlsx.xz", lzma.open, xlsx_data),
+                    ("datagrid.csv.gz", gzip.open, text_data),
+                    ("datagrid.tsv.bz2", bz2.open, text_data)]:
+                filepath = os.path.join(dirname, filename)
+                with opener(filepath, "wb") as file:
+                    file.write(data)
+                for reader in ["openpyxl", "native"]:
+                    with self.subTest(filename=filename, reader=reader), \
+                            patch.dict(DATAGRID_OPTIONS, {"reader": reader}):
+                        self.assertEqual(load_rows(filepath), expected_rows)
+
+
+def write_workbook(filepath, rows):
+    workbook = Workbook()
+    worksheet = workbook.active
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(filepath)
 
 
 def mock_cell(fieldname):
@@ -1,12 +1,38 @@
 
+import csv
 from datetime import datetime
+from decimal import Decimal
+import gzip
+import mmap
+import os
 from random import randint, choice as random_choice, seed
 import string
+from tempfile import TemporaryDirectory
 import time
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 
+from sqlalchemy import text
+
+from pxi.dataclasses import ImportFilters
 from pxi.enum import ItemType, ItemCondition, PriceBasis
 from pxi.importers import (
+    IMPORT_OPTIONS,
+    ImportContext,
+    DatagridParser,
+    Upserter,
+    CONTRACT_ITEM_SCHEMA,
+    GTIN_ITEM_SCHEMA,
+    INVENTORY_ITEM_SCHEMA,
+    INVENTORY_WEB_DATA_ITEM_SCHEMA,
+    MISSING_IMAGES_REPORT_SCHEMA,
+    PRICE_REGION_ITEM_SCHEMA,
+    PRICE_RULE_SCHEMA,
+    SPL_COLUMNS,
+    SPL_INDEX_SUFFIX,
+    SUPPLIER_ITEM_SCHEMA,
+    WAREHOUSE_STOCK_ITEM_SCHEMA,
+    WEB_MENU_ITEM_SCHEMA,
+    WEB_MENU_ITEM_MAPPING_SCHEMA,
     import_contract_items,
     import_data,
     import_inventory_items,
@@ -19,7 +45,15 @@ from pxi.importers import (
     import_warehouse_stock_items,
     import_web_menu_items,
     import_web_menu_item_mappings,
-    import_missing_images_report)
+    import_missing_images_report,
+    build_spl_index,
+    find_spl_shards,
+    get_supplier_item_keys,
+    iter_pipelined_rows,
+    iter_spl_rows,
+    load_spl_index,
+    iter_scheduled_imports,
+    log_critical_path)
 from pxi.models import (
     ContractItem,
     InventoryItem,
@@ -30,7 +64,10 @@ from pxi.models import (
     SupplierItem,
     WarehouseStockItem,
     WebMenuItem)
+from pxi.schema import StrConverter
+from pxi.spl_update import SPL_FIELDNAMES
 from tests import DatabaseTestCase
+from tests.datagrid import write_workbook
 from tests.fakes import (
     fake_contract_item,
     fake_gtin_item,
@@ -43,6 +80,7 @@ from tests.fakes import (
     fake_web_menu_item,
     random_datetime,
     random_item_code,
+    random_price,
     random_price_factor,
     random_price_string,
     random_quantity,
@@ -60,10 +98,10 @@ def fake_inventory_items_datagrid_row(values={}):
         "manuf_apn_no": values.get("manuf_apn_no", random_string(20)),
         "group": values.get("group", random_string(4)),
         "creation_date": values.get("creation_date", random_datetime()),
-        "status": values.get("status", ItemType.STOCKED_ITEM.value),
-        "condition": values.get("condition", ItemCondition.NONE.value),
+        "status": values.get("status", ItemType.STOCKED_ITEM),
+        "condition": values.get("condition", ItemCondition.NONE),
         "replacement_cost": values.get(
-            "replacement_cost", random_price_string()),
+            "replacement_cost", random_price()),
         "whse": values.get("whse", random_string(3)),
         "minimum_stock": values.get("minimum_stock", randint(0, 100)),
         "maximum_stock": values.get("maximum_stock", 0),
@@ -77,12 +115,12 @@ def fake_contract_items_datagrid_row(values={}):
     return {
         "item_code": values.get("item_code", random_string(6)),
         "contract_no": values.get("contract_no", random_string(6)),
-        "price_1": values.get("price_1", random_price_string()),
-        "price_2": values.get("price_2", random_price_string()),
-        "price_3": values.get("price_3", random_price_string()),
-        "price_4": values.get("price_4", random_price_string()),
-        "price_5": values.get("price_5", random_price_string()),
-        "price_6": values.get("price_6", random_price_string()),
+        "price_1": values.get("price_1", random_price()),
+        "price_2": values.get("price_2", random_price()),
+        "price_3": values.get("price_3", random_price()),
+        "price_4": values.get("price_4", random_price()),
+        "price_5": values.get("price_5", random_price()),
+        "price_6": values.get("price_6", random_price()),
     }
 
 
@@ -92,17 +130,21 @@ def fake_price_region_items_datagrid_row(values={}):
         "region": values.get("region", random_string(2)),
         "rule": values.get("rule", random_string(4)),
         "tax_rate": values.get("tax_rate", "10.0000%"),
-        "pr_1_corpa_qty": values.get("pr_1_corpa_qty", random_quantity()),
-        "pr_2_corp_b_qty": values.get("pr_2_corp_b_qty", random_quantity()),
-        "pr_3_corp_c_qty": values.get("pr_3_corp_c_qty", random_quantity()),
-        "pr_4_bulk_qty": values.get("pr_4_bulk_qty", random_quantity()),
-        "w_sale_price": values.get("w_sale_price", random_price_string()),
-        "pr_1_corpa": values.get("pr_1_corpa", random_price_string()),
-        "pr_2_corp_b": values.get("pr_2_corp_b", random_price_string()),
-        "pr_3_corp_c": values.get("pr_3_corp_c", random_price_string()),
-        "pr_4_bulk": values.get("pr_4_bulk", random_price_string()),
-        "retail_price": values.get("retail_price", "0.00"),
-        "rrp_inc_tax": values.get("rrp_inc_tax", "0.00"),
+        "pr_1_corpa_qty": values.get(
+            "pr_1_corpa_qty", Decimal(random_quantity())),
+        "pr_2_corp_b_qty": values.get(
+            "pr_2_corp_b_qty", Decimal(random_quantity())),
+        "pr_3_corp_c_qty": values.get(
+            "pr_3_corp_c_qty", Decimal(random_quantity())),
+        "pr_4_bulk_qty": values.get(
+            "pr_4_bulk_qty", Decimal(random_quantity())),
+        "w_sale_price": values.get("w_sale_price", random_price()),
+        "pr_1_corpa": values.get("pr_1_corpa", random_price()),
+        "pr_2_corp_b": values.get("pr_2_corp_b", random_price()),
+        "pr_3_corp_c": values.get("pr_3_corp_c", random_price()),
+        "pr_4_bulk": values.get("pr_4_bulk", random_price()),
+        "retail_price": values.get("retail_price", Decimal("0.00")),
+        "rrp_inc_tax": values.get("rrp_inc_tax", Decimal("0.00")),
     }
 
 
@@ -113,10 +155,10 @@ def fake_supplier_items_datagrid_row(values={}):
         "supplier_item": values.get("supplier_item", random_string(20)),
         "priority": values.get("priority", randint(1, 9)),
         "unit": values.get("unit", random_string(4)),
-        "conv_factor": values.get("conv_factor", 1),
+        "conv_factor": values.get("conv_factor", Decimal(1)),
         "pack_qty": values.get("pack_qty", 1),
         "eoq": values.get("eoq", 1),
-        "current_buy_price": values.get("current_buy_price", random_price_string()),
+        "current_buy_price": values.get("current_buy_price", random_price()),
     }
 
 
@@ -125,7 +167,7 @@ def fake_gtin_items_datagrid_row(values={}):
         "item_code": values.get("item_code", random_item_code()),
         "gtin": values.get("gtin", random_item_code()),
         "uom": values.get("uom", random_string(4)),
-        "conversion": values.get("conversion", 1),
+        "conversion": values.get("conversion", Decimal(1)),
     }
 
 
@@ -143,26 +185,31 @@ def fake_price_rules_datagrid_row(values={}):
         "rule": values.get("rule", random_string(4)),
         "comments": values.get("comments", random_string(20)),
         "price0_based_on": values.get(
-            "price0_based_on", PriceBasis.REPLACEMENT_COST.value),
+            "price0_based_on", PriceBasis.REPLACEMENT_COST),
         "price1_based_on": values.get(
-            "price1_based_on", PriceBasis.REPLACEMENT_COST.value),
+            "price1_based_on", PriceBasis.REPLACEMENT_COST),
         "price2_based_on": values.get(
-            "price2_based_on", PriceBasis.REPLACEMENT_COST.value),
+            "price2_based_on", PriceBasis.REPLACEMENT_COST),
         "price3_based_on": values.get(
-            "price3_based_on", PriceBasis.REPLACEMENT_COST.value),
+            "price3_based_on", PriceBasis.REPLACEMENT_COST),
         "price4_based_on": values.get(
-            "price4_based_on", PriceBasis.REPLACEMENT_COST.value),
+            "price4_based_on", PriceBasis.REPLACEMENT_COST),
         "rec_retail_based_on": values.get(
             "rec_retail_based_on", PriceBasis.RRP_EXCL_TAX),
         "rrp_inc_tax_based_on": values.get(
             "rrp_inc_tax_based_on", PriceBasis.RRP_INCL_TAX),
-        "price0_factor": values.get("price0_factor", random_price_factor()),
-        "price1_factor": values.get("price1_factor", random_price_factor()),
-        "price2_factor": values.get("price2_factor", random_price_factor()),
-        "price3_factor": values.get("price3_factor", random_price_factor()),
-        "price4_factor": values.get("price4_factor", random_price_factor()),
-        "rec_retail_factor": values.get("rec_retail_factor", 0),
-        "rrp_inc_tax_factor": values.get("rrp_inc_tax_factor", 0),
+        "price0_factor": values.get(
+            "price0_factor", Decimal(random_price_factor())),
+        "price1_factor": values.get(
+            "price1_factor", Decimal(random_price_factor())),
+        "price2_factor": values.get(
+            "price2_factor", Decimal(random_price_factor())),
+        "price3_factor": values.get(
+            "price3_factor", Decimal(random_price_factor())),
+        "price4_factor": values.get(
+            "price4_factor", Decimal(random_price_factor())),
+        "rec_retail_factor": values.get("rec_retail_factor", Decimal(0)),
+        "rrp_inc_tax_factor": values.get("rrp_inc_tax_factor", Decimal(0)),
     }
 
 
@@ -182,16 +229,26 @@ def fake_web_menu_items_mappings_row(values={}):
 
 
 def fake_supplier_pricelist_row(values={}):
-    return {
+    row = {
         "item_code": values.get("item_code", random_item_code()),
         "supplier_code": values.get("supplier_code", random_string(3)),
         "supp_item_code": values.get("supp_item_code", random_item_code()),
         "supp_uom": values.get("supp_uom", random_string(4)),
         "supp_price_1": values.get("supp_price_1", random_price_string()),
-        "supp_conv_factor": values.get("supp_conv_factor", 1),
-        "supp_eoq": values.get("supp_eoq", 1),
+        "supp_conv_factor": values.get("supp_conv_factor", "1"),
+        "supp_eoq": values.get("supp_eoq", "1"),
         "supp_sell_uom": values.get("supp_sell_uom", random_string(4)),
     }
+    return tuple(row[column] for column in SPL_COLUMNS)
+
+
+def write_spl(filepath, rows):
+    with open(filepath, "w", encoding="iso8859-14", newline="") as file:
+        writer = csv.writer(file)
+        for row in rows:
+            values = dict(zip(SPL_COLUMNS, row))
+            writer.writerow([
+                values.get(fieldname, "") for fieldname in SPL_FIELDNAMES])
 
 
 def fake_missing_images_report_row(values={}):
@@ -200,47 +257,66 @@ def fake_missing_images_report_row(values={}):
     }
 
 
+def exit_pipe_rows(path, schema, options, queue):
+    os._exit(1)
+
+
+class UnpicklableError(Exception):
+
+    def __init__(self):
+        super().__init__("unpicklable")
+        self.callback = lambda: None
+
+
 def mock_model_imports():
     return [
         (
             InventoryItem,
             MagicMock(),
-            "inventory_items_datagrid"
+            "inventory_items_datagrid",
+            {}
         ),
         (
             WarehouseStockItem,
             MagicMock(),
-            "inventory_items_datagrid"
+            "inventory_items_datagrid",
+            {}
         ),
         (
             PriceRule,
             MagicMock(),
-            "price_rules_datagrid"
+            "price_rules_datagrid",
+            {}
         ),
         (
             PriceRegionItem,
             MagicMock(),
-            "pricelist_datagrid"
+            "pricelist_datagrid",
+            {}
         ),
         (
             ContractItem,
             MagicMock(),
-            "contract_items_datagrid"
+            "contract_items_datagrid",
+            {}
         ),
         (
             SupplierItem,
             MagicMock(),
-            "supplier_items_datagrid"
+            "supplier_items_datagrid",
+            {}
         ),
         (
             InventoryWebDataItem,
             MagicMock(),
-            "inventory_web_data_items_datagrid"
+            "inventory_web_data_items_datagrid",
+            {}
         ),
         (
             WebMenuItem,
             MagicMock(),
-            "web_menu"
+            "web_menu",
+            {}
         ),
     ]
 
@@ -260,21 +336,41 @@ def mock_import_paths():
 
 class ImporterTests(DatabaseTestCase):
 
-    def test_import_data_for_all_models(self):
+    @patch("pxi.importers.read_columns")
+    def test_import_data_for_all_models(self, mock_read_columns):
         """
-        Imports data for all models.
+        Imports data for all models, parsing a datagrid read by several
+        importers only once.
         """
         import_paths = mock_import_paths()
+        shared_path = import_paths["inventory_items_datagrid"]
+        item_codes = [random_item_code(), random_item_code()]
+        mock_read_columns.return_value = (["item_code"], [item_codes])
+        imported_rows = []
 
-        model_imports = mock_model_imports()
-        with patch("pxi.importers.MODEL_IMPORTS", model_imports):
-            import_data(self.db_session, import_paths)
+        def import_rows(path, db_session, rows, context):
+            imported_rows.append(list(rows))
 
-        # Importer checks file has changed before each import.
-        for _, import_function, import_path_key in model_imports:
+        model_imports = mock_model_imports()
+        for _, import_function, import_path_key, _ in model_imports:
+            if import_path_key == "inventory_items_datagrid":
+                import_function.side_effect = import_rows
+        with patch("pxi.importers.MODEL_IMPORTS", model_imports), \
+                patch.dict(IMPORT_OPTIONS, {"workers": 1}):
+            context = import_data(self.db_session, import_paths)
+
+        mock_read_columns.assert_called_once_with(shared_path, schema={})
+        self.assertEqual(imported_rows, [
+            [{"item_code": code} for code in item_codes],
+        ] * 2)
+        for _, import_function, import_path_key, _ in model_imports:
             import_path = import_paths[import_path_key]
-            import_function.assert_called_once_with(
-                import_path, self.db_session)
+            if import_path == shared_path:
+                import_function.assert_called_once_with(
+                    import_path, self.db_session, ANY, context=context)
+            else:
+                import_function.assert_called_once_with(
+                    import_path, self.db_session, context=context)
 
     def test_import_data_for_single_model(self):
         """
@@ -283,42 +379,241 @@ class ImporterTests(DatabaseTestCase):
         import_paths = mock_import_paths()
 
         model_imports = mock_model_imports()
-        with patch("pxi.importers.MODEL_IMPORTS", model_imports):
+        with patch("pxi.importers.MODEL_IMPORTS", model_imports), \
+                patch.dict(IMPORT_OPTIONS, {"workers": 1}):
             import_data(self.db_session, import_paths, [
                 InventoryItem
             ])
 
-        model, import_function, import_path_key = model_imports[0]
+        model, import_function, import_path_key, _ = model_imports[0]
         self.assertEqual(model, InventoryItem)
         import_path = import_paths[import_path_key]
-        import_function.assert_called_once_with(import_path, self.db_session)
+        import_function.assert_called_once_with(
+            import_path, self.db_session, context=ANY)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_inventory_items(self, mock_load_rows):
+    def test_import_data_in_parallel(self):
+        """
+        Parses datagrids in worker processes and imports them in order.
+        """
+        price_rule_codes = [random_string(4), random_string(4)]
+        web_menu_names = [random_string(10), random_string(10)]
+        model_imports = [
+            (PriceRule, MagicMock(), "price_rules_datagrid", {
+                "rule": StrConverter(),
+            }),
+            (WebMenuItem, MagicMock(), "web_menu", {
+                "parent_name": StrConverter(),
+            }),
+        ]
+        manager = MagicMock()
+        manager.attach_mock(model_imports[0][1], "import_price_rules")
+        manager.attach_mock(model_imports[1][1], "import_web_menu_items")
+        imported_rows = {}
+
+        def import_rows(path, db_session, rows, context):
+            imported_rows[path] = list(rows)
+
+        for _, import_function, _, _ in model_imports:
+            import_function.side_effect = import_rows
+
+        with TemporaryDirectory() as dirname:
+            import_paths = {
+                "price_rules_datagrid": os.path.join(dirname, "rules.xlsx"),
+                "web_menu": os.path.join(dirname, "web_menu.xlsx"),
+            }
+            write_workbook(import_paths["price_rules_datagrid"], [
+                ["Rule", "Comments"],
+                *[[code, random_string(20)] for code in price_rule_codes],
+            ])
+            write_workbook(import_paths["web_menu"], [
+                ["Parent Name"],
+                *[[name] for name in web_menu_names],
+            ])
+            with patch("pxi.importers.MODEL_IMPORTS", model_imports), \
+                    patch.dict(IMPORT_OPTIONS, {"workers": 2}):
+                import_data(self.db_session, import_paths)
+
+        self.assertEqual(
+            sorted(method_call[0] for method_call in manager.method_calls),
+            ["import_price_rules", "import_web_menu_items"])
+        self.assertEqual(
+            imported_rows[import_paths["price_rules_datagrid"]],
+            [{"rule": code} for code in price_rule_codes])
+        self.assertEqual(
+            imported_rows[import_paths["web_menu"]],
+            [{"parent_name": name} for name in web_menu_names])
+
+    def test_import_data_streams_large_datagrids(self):
+        """
+        Leaves large datagrids for the import functions to stream, even when
+        several importers read them.
+        """
+        model_imports = mock_model_imports()
+
+        with TemporaryDirectory() as dirname:
+            import_paths = {
+                key: os.path.join(dirname, os.path.basename(path))
+                for key, path in mock_import_paths().items()}
+            for path in import_paths.values():
+                write_workbook(path, [["Code"]])
+            with patch("pxi.importers.MODEL_IMPORTS", model_imports), \
+                    patch("pxi.importers.STREAM_MIN_BYTES", 0), \
+                    patch("pxi.importers.ProcessPoolExecutor") as mock_pool, \
+                    patch("pxi.importers.read_columns") as mock_read_columns, \
+                    patch.dict(IMPORT_OPTIONS, {"workers": 2}):
+                context = import_data(self.db_session, import_paths)
+
+        mock_pool.assert_not_called()
+        mock_read_columns.assert_not_called()
+        for _, import_function, import_path_key, _ in model_imports:
+            import_function.assert_called_once_with(
+                import_paths[import_path_key], self.db_session,
+                context=context)
+
+    @patch("pxi.importers.os.cpu_count", return_value=4)
+    @patch("pxi.importers.read_columns")
+    @patch("pxi.importers.iter_pipelined_rows")
+    def test_import_data_pipelined(
+            self, mock_iter_pipelined_rows, mock_read_columns, _):
+        """
+        Pipelines the datagrids read by a single importer, however many
+        workers parse the others.
+        """
+        import_paths = mock_import_paths()
+        shared_path = import_paths["inventory_items_datagrid"]
+        mock_read_columns.return_value = (["item_code"], [[]])
+        model_imports = mock_model_imports()
+
+        with patch("pxi.importers.MODEL_IMPORTS", model_imports), \
+                patch.dict(
+                    IMPORT_OPTIONS, {"workers": 4, "pipeline": True}):
+            import_data(self.db_session, import_paths)
+
+        mock_read_columns.assert_called_once_with(shared_path, schema={})
+        self.assertEqual(
+            sorted(
+                method_call.args[0]
+                for method_call in mock_iter_pipelined_rows.call_args_list),
+            sorted(
+                import_paths[path_key]
+                for _, _, path_key, _ in model_imports
+                if import_paths[path_key] != shared_path))
+        for _, import_function, import_path_key, _ in model_imports:
+            import_function.assert_called_once_with(
+                import_paths[import_path_key], self.db_session, ANY,
+                context=ANY)
+
+    def test_iter_pipelined_rows(self):
+        """
+        Reads rows in a worker process, raising its errors here.
+        """
+        schema = {"rule": StrConverter(), "comments": StrConverter()}
+        rows = [[random_string(4), random_string(20)] for _ in range(1200)]
+
+        with TemporaryDirectory() as dirname:
+            filepath = os.path.join(dirname, "rules.xlsx")
+            write_workbook(filepath, [["Rule", "Comments"], *rows])
+
+            self.assertEqual(
+                list(iter_pipelined_rows(filepath, schema, 1000)),
+                [{"rule": rule, "comments": comments}
+                 for rule, comments in rows])
+            pipelined_rows = iter_pipelined_rows(filepath, schema, 500)
+            self.assertEqual(next(pipelined_rows)["rule"], rows[0][0])
+            pipelined_rows.close()
+            with self.assertRaises(FileNotFoundError):
+                list(iter_pipelined_rows(
+                    os.path.join(dirname, "missing.xlsx"), schema, 1000))
+
+            # Errors that can't be sent back, and workers that die, are
+            # raised rather than waited on forever.
+            with patch("pxi.importers.PIPELINE_POLL_SECONDS", 0.1):
+                with patch(
+                        "pxi.importers.iter_rows",
+                        side_effect=UnpicklableError()), \
+                        self.assertRaisesRegex(RuntimeError, "unpicklable"):
+                    list(iter_pipelined_rows(filepath, schema, 1000))
+                with patch("pxi.importers.pipe_rows", exit_pipe_rows), \
+                        self.assertRaisesRegex(RuntimeError, "code 1"):
+                    list(iter_pipelined_rows(filepath, schema, 1000))
+
+    def test_iter_scheduled_imports(self):
+        """
+        Runs each import after the imports it depends on.
+        """
+        import_paths = mock_import_paths()
+        model_imports = [
+            (PriceRegionItem, MagicMock(), "pricelist_datagrid", {}),
+            (PriceRule, MagicMock(), "price_rules_datagrid", {}),
+            (InventoryItem, MagicMock(), "inventory_items_datagrid", {}),
+        ]
+
+        with patch.dict(IMPORT_OPTIONS, {"workers": 1}), \
+                DatagridParser([]) as parser:
+            models = [
+                model for model, _, _, _ in iter_scheduled_imports(
+                    model_imports, import_paths, parser)]
+            self.assertEqual(
+                models, [PriceRule, InventoryItem, PriceRegionItem])
+
+            # Dependencies that aren't being imported are ignored.
+            models = [
+                model for model, _, _, _ in iter_scheduled_imports(
+                    model_imports[:1], import_paths, parser)]
+            self.assertEqual(models, [PriceRegionItem])
+
+            with patch.dict(
+                    "pxi.importers.MODEL_DEPENDENCIES",
+                    {PriceRule: [InventoryItem], InventoryItem: [PriceRule]}):
+                with self.assertRaises(ValueError):
+                    list(iter_scheduled_imports(
+                        model_imports, import_paths, parser))
+
+    def test_log_critical_path(self):
+        """
+        Logs the imports back to the last one that waited for its datagrid.
+        """
+        timings = [
+            ("InventoryItem", 2.0, 2.0, 5.0),
+            ("PriceRule", 1.0, 5.0, 6.0),
+            ("PriceRegionItem", None, 6.0, 9.0),
+        ]
+
+        with self.assertLogs(level="INFO") as logs:
+            log_critical_path(timings, 0.0)
+
+        self.assertIn(
+            "PriceRegionItem 3.00s <- PriceRule 1.00s <- "
+            "InventoryItem 3.00s <- parse 2.00s, 9.00s total.",
+            logs.output[0])
+
+    @patch("pxi.importers.iter_rows")
+    def test_import_inventory_items(self, mock_iter_rows):
         """
         Imports InventoryItems from Pronto datagrid.
         """
         filepath = random_string(20)
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_inventory_items_datagrid_row(),
         ]
 
         import_inventory_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=INVENTORY_ITEM_SCHEMA)
         # pylint:disable=no-member
         inventory_items = self.db_session.query(InventoryItem).all()
         self.assertEqual(len(inventory_items), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_contract_items(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_contract_items(self, mock_iter_rows):
         """
         Import ContractItems from Pronto datagrid.
         """
         filepath = random_string(20)
         inv_item = fake_inventory_item()
         self.seed([inv_item])
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_contract_items_datagrid_row({
                 "item_code": inv_item.code,
             }),
@@ -328,20 +623,21 @@ class ImporterTests(DatabaseTestCase):
 
         import_contract_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=CONTRACT_ITEM_SCHEMA)
         # pylint:disable=no-member
         contract_items = self.db_session.query(ContractItem).all()
         self.assertEqual(len(contract_items), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_warehouse_stock_items(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_warehouse_stock_items(self, mock_iter_rows):
         """
         Import WarehouseStockItems from Pronto datagrid.
         """
         filepath = random_string(20)
         inv_item = fake_inventory_item()
         self.seed([inv_item])
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_inventory_items_datagrid_row({
                 "item_code": inv_item.code,
             }),
@@ -351,30 +647,31 @@ class ImporterTests(DatabaseTestCase):
 
         import_warehouse_stock_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=WAREHOUSE_STOCK_ITEM_SCHEMA)
         # pylint:disable=no-member
         whse_stock_items = self.db_session.query(WarehouseStockItem).all()
         self.assertEqual(len(whse_stock_items), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_price_rules(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_price_rules(self, mock_iter_rows):
         """
         Import PriceRules from Pronto datagrid.
         """
         filepath = random_string(20)
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_price_rules_datagrid_row(),
         ]
 
         import_price_rules(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(filepath, schema=PRICE_RULE_SCHEMA)
         # pylint:disable=no-member
         price_rules = self.db_session.query(PriceRule).all()
         self.assertEqual(len(price_rules), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_price_region_items(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_price_region_items(self, mock_iter_rows):
         """
         Import PriceRegionItems from Pronto datagrid.
         """
@@ -382,7 +679,7 @@ class ImporterTests(DatabaseTestCase):
         inv_item = fake_inventory_item()
         price_rule = fake_price_rule()
         self.seed([inv_item, price_rule])
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_price_region_items_datagrid_row({
                 "item_code": inv_item.code,
                 "rule": price_rule.code,
@@ -393,20 +690,132 @@ class ImporterTests(DatabaseTestCase):
 
         import_price_region_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=PRICE_REGION_ITEM_SCHEMA)
         # pylint:disable=no-member
         price_region_items = self.db_session.query(PriceRegionItem).all()
         self.assertEqual(len(price_region_items), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_supplier_items(self, mock_load_rows):
+    def test_import_filters(self):
+        """
+        Skips rows the import filters drop, and the rows of dropped items.
+        """
+        filepath = random_string(20)
+        context = ImportContext(self.db_session, ImportFilters(
+            ignore_item_conditions={ItemCondition.DISCONTINUED},
+            ignore_item_types={ItemType.LABOUR},
+            ignore_brands={"IGN"},
+            warehouses={"MAIN"}))
+        inv_item_rows = [
+            fake_inventory_items_datagrid_row({"whse": "MAIN"}),
+            fake_inventory_items_datagrid_row({
+                "condition": ItemCondition.DISCONTINUED,
+                "whse": "MAIN",
+            }),
+            fake_inventory_items_datagrid_row({"status": ItemType.LABOUR}),
+            fake_inventory_items_datagrid_row({"brand_manuf": "IGN"}),
+        ]
+        kept_code = inv_item_rows[0]["item_code"]
+        price_rule_rows = [fake_price_rules_datagrid_row()]
+        price_region_item_rows = [
+            fake_price_region_items_datagrid_row({
+                "item_code": row["item_code"],
+                "rule": price_rule_rows[0]["rule"],
+            })
+            for row in inv_item_rows]
+        whse_stock_rows = [
+            inv_item_rows[0],
+            inv_item_rows[1],
+            fake_inventory_items_datagrid_row({
+                "item_code": kept_code,
+                "whse": "OTHER",
+            }),
+        ]
+
+        with self.assertLogs(level="INFO"):
+            import_inventory_items(
+                filepath, self.db_session, inv_item_rows, context=context)
+            import_price_rules(
+                filepath, self.db_session, price_rule_rows, context=context)
+            import_price_region_items(
+                filepath, self.db_session, price_region_item_rows,
+                context=context)
+            import_warehouse_stock_items(
+                filepath, self.db_session, whse_stock_rows, context=context)
+
+        # pylint:disable=no-member
+        inv_items = self.db_session.query(InventoryItem).all()
+        price_rules = self.db_session.query(PriceRule).all()
+        pr_items = self.db_session.query(PriceRegionItem).all()
+        ws_items = self.db_session.query(WarehouseStockItem).all()
+        self.assertEqual([item.code for item in inv_items], [kept_code])
+        self.assertEqual(
+            [rule.code for rule in price_rules],
+            [price_rule_rows[0]["rule"]])
+        self.assertEqual(
+            [item.inventory_item.code for item in pr_items], [kept_code])
+        self.assertEqual([item.code for item in ws_items], ["MAIN"])
+
+    def test_import_filters_in_delta_mode(self):
+        """
+        Keeps the records of rows dropped by filters when delta imports
+        with and without filters take turns.
+        """
+        filepath = random_string(20)
+        filters = ImportFilters(
+            ignore_item_conditions={ItemCondition.DISCONTINUED})
+        inv_item_rows = [
+            fake_inventory_items_datagrid_row(),
+            fake_inventory_items_datagrid_row({
+                "condition": ItemCondition.DISCONTINUED,
+            }),
+        ]
+        supplier_item_rows = [
+            fake_supplier_items_datagrid_row({"item_code": row["item_code"]})
+            for row in inv_item_rows]
+
+        def import_items(filters):
+            context = ImportContext(self.db_session, filters)
+            with self.assertLogs(level="INFO") as logs:
+                import_inventory_items(
+                    filepath, self.db_session, inv_item_rows,
+                    context=context)
+                import_supplier_items(
+                    filepath, self.db_session, supplier_item_rows,
+                    context=context)
+            return logs.output
+
+        with patch.dict(IMPORT_OPTIONS, {"delta": True}):
+            import_items(None)
+            inv_item_ids = {
+                inv_item.code: inv_item.id
+                for inv_item in self.db_session.query(InventoryItem)}
+            filtered_logs = import_items(filters)
+            unfiltered_logs = import_items(None)
+
+        # pylint:disable=no-member
+        supplier_items = self.db_session.query(SupplierItem).all()
+        self.assertEqual(
+            {inv_item.code: inv_item.id
+             for inv_item in self.db_session.query(InventoryItem)},
+            inv_item_ids)
+        self.assertEqual(
+            sorted(item.inventory_item_id for item in supplier_items),
+            sorted(inv_item_ids.values()))
+        for output in [*filtered_logs, *unfiltered_logs]:
+            if "Import InventoryItems" in output:
+                self.assertIn("0 inserted", output)
+                self.assertIn("0 removed", output)
+
+    @patch("pxi.importers.iter_rows")
+    def test_import_supplier_items(self, mock_iter_rows):
         """
         Import SupplierItems from Pronto datagrid.
         """
         filepath = random_string(20)
         inv_item = fake_inventory_item()
         self.seed([inv_item])
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_supplier_items_datagrid_row({
                 "item_code": inv_item.code,
             }),
@@ -416,20 +825,21 @@ class ImporterTests(DatabaseTestCase):
 
         import_supplier_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=SUPPLIER_ITEM_SCHEMA)
         # pylint:disable=no-member
         supplier_items = self.db_session.query(SupplierItem).all()
         self.assertEqual(len(supplier_items), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_gtin_items(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_gtin_items(self, mock_iter_rows):
         """
         Import GTINItems from Pronto datagrid.
         """
         filepath = random_string(20)
         inv_item = fake_inventory_item()
         self.seed([inv_item])
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_gtin_items_datagrid_row({
                 "item_code": inv_item.code,
             }),
@@ -439,13 +849,17 @@ class ImporterTests(DatabaseTestCase):
 
         import_gtin_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(filepath, schema=GTIN_ITEM_SCHEMA)
         # pylint:disable=no-member
         gtin_items = self.db_session.query(GTINItem).all()
         self.assertEqual(len(gtin_items), 1)
 
-    @patch("pxi.importers.load_spl_rows")
-    def test_import_supplier_pricelist_items(self, mock_load_spl_rows):
+    @patch("pxi.importers.os.path.getsize", return_value=0)
+    @patch("pxi.importers.iter_spl_rows")
+    def test_import_supplier_pricelist_items(
+            self,
+            mock_iter_spl_rows,
+            mock_getsize):
         """
         Import Supplier Pricelist Items from CSV.
         """
@@ -466,33 +880,591 @@ class ImporterTests(DatabaseTestCase):
                 "item_code": fake_item_code,
                 "supplier_code": fake_supp_code,
             }),
+            # This invalid row should not be imported.
+            fake_supplier_pricelist_row({
+                "supp_conv_factor": "",
+            }),
         ]
-        mock_load_spl_rows.return_value = rows
+        mock_iter_spl_rows.return_value = rows
 
         spl_items = import_supplier_pricelist_items(filepath)
 
-        mock_load_spl_rows.assert_called_with(filepath)
+        mock_iter_spl_rows.assert_called_with(filepath, keys=None)
         self.assertEqual(len(spl_items), 3)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_web_menu_items(self, mock_load_rows):
+    def test_iter_spl_rows(self):
+        """
+        Reads the SPL_COLUMNS fields from each row of a supplier pricelist,
+        skipping blank lines.
+        """
+        row = {fieldname: random_string(4) for fieldname in SPL_FIELDNAMES}
+        quoted_row = {**row, "desc_line_1": "A, B", "supp_uom": "Ü\""}
+        short_row = list(row.values())[:10]
+
+        with TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "SPL.PRN")
+            with open(filepath, "w", encoding="iso8859-14", newline="") \
+                    as file:
+                writer = csv.writer(file)
+                writer.writerow(SPL_FIELDNAMES)
+                writer.writerow(row.values())
+                file.write("\r\n")
+                writer.writerow(quoted_row.values())
+                writer.writerow(short_row)
+                file.write("\r\n")
+
+            with open(filepath, "rb") as file, \
+                    gzip.open(f"{filepath}.gz", "wb") as gzip_file:
+                gzip_file.write(file.read())
+
+            spl_rows = list(iter_spl_rows(filepath))
+            key = (row["supplier_code"], row["supp_item_code"])
+            filtered_rows = list(iter_spl_rows(filepath, keys={key}))
+            gzip_rows = list(iter_spl_rows(f"{filepath}.gz"))
+
+        self.assertEqual(len(spl_rows), 4)
+        self.assertEqual(spl_rows[0][0], "supplier_code")
+        self.assertEqual(
+            spl_rows[1], tuple(row[column] for column in SPL_COLUMNS))
+        self.assertEqual(
+            spl_rows[2], tuple(quoted_row[column] for column in SPL_COLUMNS))
+        self.assertEqual(spl_rows[3][SPL_COLUMNS.index("item_code")], "")
+        self.assertEqual(filtered_rows[1:], spl_rows[1:])
+        self.assertEqual(
+            filtered_rows[0][:3], ("supplier_code", None, "item_code"))
+        self.assertEqual(gzip_rows, spl_rows)
+
+    def test_import_supplier_pricelist_items_in_shards(self):
+        """
+        Parses shards of the file in worker processes, keeping the first of
+        any duplicate items across shards.
+        """
+        rows = [
+            fake_supplier_pricelist_row({"item_code": f"ITEM{index % 30}"})
+            for index in range(40)]
+        rows += [
+            fake_supplier_pricelist_row({
+                "item_code": rows[0][SPL_COLUMNS.index("item_code")],
+                "supplier_code": rows[0][SPL_COLUMNS.index("supplier_code")],
+            })
+            for _ in range(2)]
+
+        with TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "SPL.PRN")
+            write_spl(filepath, rows)
+
+            shards = find_spl_shards(filepath, 3)
+            serial_items = import_supplier_pricelist_items(filepath)
+            with patch.dict(IMPORT_OPTIONS, {"workers": 3}), \
+                    patch("pxi.importers.SPL_SHARD_MIN_BYTES", 1), \
+                    self.assertLogs(level="INFO") as logs:
+                sharded_items = import_supplier_pricelist_items(filepath)
+
+            with open(filepath, "rb") as file:
+                data = file.read()
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(shards[0][0], 0)
+        self.assertEqual(shards[-1][1], len(data))
+        for (_, end), (start, _) in zip(shards, shards[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(data[start - 1:start], b"\n")
+        self.assertEqual(list(sharded_items), list(serial_items))
+        self.assertIn("2 skipped", logs.output[0])
+
+    def test_import_supplier_pricelist_items_by_supplier(self):
+        """
+        Reads only the given suppliers' rows, using an index saved next to
+        the file that is rebuilt when the file changes.
+        """
+        rows = [
+            fake_supplier_pricelist_row({"supplier_code": supp_code})
+            for supp_code in ["AAA", "AAA", "BBB", "CCC", "AAA"]]
+
+        with TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "SPL.PRN")
+            write_spl(filepath, rows)
+
+            with patch(
+                    "pxi.importers.build_spl_index",
+                    wraps=build_spl_index) as mock_build_spl_index:
+                spl_items = import_supplier_pricelist_items(
+                    filepath, {"AAA", "CCC"})
+                import_supplier_pricelist_items(filepath, {"BBB"})
+                index_count = mock_build_spl_index.call_count
+
+                write_spl(filepath, rows + [fake_supplier_pricelist_row({
+                    "supplier_code": "BBB"})])
+                os.utime(filepath, ns=(0, 0))
+                changed_items = import_supplier_pricelist_items(
+                    filepath, {"BBB"})
+
+            # The file is mapped once for all of the suppliers' ranges.
+            with patch("pxi.importers.mmap.mmap", wraps=mmap.mmap) \
+                    as mock_mmap:
+                import_supplier_pricelist_items(filepath, {"AAA", "CCC"})
+            self.assertEqual(mock_mmap.call_count, 1)
+
+            index = load_spl_index(filepath)
+            self.assertTrue(os.path.exists(f"{filepath}{SPL_INDEX_SUFFIX}"))
+
+        self.assertEqual(index_count, 1)
+        self.assertEqual(len(index["AAA"]), 2)
+        self.assertEqual(
+            [item.supp_code for item in spl_items],
+            ["AAA", "AAA", "CCC", "AAA"])
+        self.assertEqual(len(changed_items), 2)
+
+    def test_import_supplier_pricelist_items_by_key(self):
+        """
+        Imports only the rows of known SupplierItems.
+        """
+        inv_item = fake_inventory_item()
+        supp_item = fake_supplier_item(inv_item)
+        self.seed([inv_item, supp_item])
+        rows = [
+            fake_supplier_pricelist_row({
+                "supplier_code": supp_item.code,
+                "supp_item_code": supp_item.item_code,
+            }),
+            fake_supplier_pricelist_row({
+                "supplier_code": supp_item.code,
+            }),
+            fake_supplier_pricelist_row(),
+        ]
+
+        with TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "SPL.PRN")
+            write_spl(filepath, rows)
+
+            keys = get_supplier_item_keys(self.db_session)
+            spl_items = list(import_supplier_pricelist_items(
+                filepath, keys=keys))
+
+        self.assertEqual(keys, {(supp_item.code, supp_item.item_code)})
+        self.assertEqual(len(spl_items), 1)
+        self.assertEqual(spl_items[0].supp_item_code, supp_item.item_code)
+
+    def test_import_supplier_pricelist_items_by_key_keeps_first_row(self):
+        """
+        Reads each item from its first row in the file, whether or not the
+        first row is among the keys.
+        """
+        rows = [
+            fake_supplier_pricelist_row({
+                "supplier_code": "ABC",
+                "item_code": "ITEM1",
+                "supp_item_code": supp_item_code,
+                "supp_price_1": price,
+            })
+            for supp_item_code, price in [("OLD", "5.00"), ("NEW", "7.00")]]
+        rows[1:1] = [fake_supplier_pricelist_row() for _ in range(10)]
+        keys = {("ABC", "NEW")}
+
+        with TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "SPL.PRN")
+            write_spl(filepath, rows)
+
+            spl_items = list(import_supplier_pricelist_items(filepath))
+            filtered_items = list(import_supplier_pricelist_items(
+                filepath, keys=keys))
+            with patch.dict(IMPORT_OPTIONS, {"workers": 3}), \
+                    patch("pxi.importers.SPL_SHARD_MIN_BYTES", 1):
+                sharded_items = list(import_supplier_pricelist_items(
+                    filepath, keys=keys))
+
+        self.assertEqual(
+            [item.supp_item_code for item in spl_items
+             if item.item_code == "ITEM1"],
+            ["OLD"])
+        self.assertEqual(filtered_items, [])
+        self.assertEqual(sharded_items, [])
+
+    def test_upserter(self):
+        """
+        Inserts and updates records in batches, counting each. A repeated
+        row with the same key and values counts as unchanged.
+        """
+        inv_item = fake_inventory_item()
+        contract_item = fake_contract_item(inv_item)
+        self.seed([inv_item, contract_item])
+        contract_codes = [contract_item.code] + [
+            random_string(6) for _ in range(4)]
+        price = random_price()
+
+        upserter = Upserter(
+            self.db_session,
+            ContractItem,
+            ["code", "inventory_item_id"],
+            batch_size=2)
+        with patch.object(
+                upserter, "flush", wraps=upserter.flush) as mock_flush:
+            for code in contract_codes + contract_codes[-1:]:
+                upserter.upsert((code, inv_item.id), {
+                    "code": code,
+                    "inventory_item_id": inv_item.id,
+                    **{f"price_{level}": price for level in range(1, 7)},
+                })
+            upserter.flush()
+        self.db_session.commit()
+
+        self.assertEqual(mock_flush.call_count, 3)
+        self.assertEqual(upserter.inserted_count, 4)
+        self.assertEqual(upserter.updated_count, 1)
+        self.assertEqual(upserter.unchanged_count, 1)
+        contract_items = self.db_session.query(ContractItem).all()
+        self.assertEqual(
+            sorted(con_item.code for con_item in contract_items),
+            sorted(contract_codes))
+        for con_item in contract_items:
+            self.assertEqual(con_item.price(1), price)
+
+    def test_upserter_unchanged(self):
+        """
+        Skips writing rows that match their existing records, and counts
+        them as unchanged.
+        """
+        inv_item = fake_inventory_item()
+        contract_item = fake_contract_item(inv_item)
+        gtin_item = fake_gtin_item(inv_item, {"conv_factor": Decimal("2")})
+        self.seed([inv_item, contract_item, gtin_item])
+        contract_key = (contract_item.code, inv_item.id)
+        gtin_key = (gtin_item.code, inv_item.id)
+        contract_row = {
+            "code": contract_item.code,
+            "inventory_item_id": inv_item.id,
+            **{
+                f"price_{level}": contract_item.price(level)
+                for level in range(1, 7)},
+        }
+        gtin_row = {
+            "code": gtin_item.code,
+            "inventory_item_id": inv_item.id,
+            "uom": gtin_item.uom,
+            "conv_factor": Decimal("2"),
+        }
+
+        contract_upserter = Upserter(self.db_session, ContractItem)
+        contract_upserter.upsert(contract_key, contract_row)
+        contract_upserter.finish()
+        gtin_upserter = Upserter(self.db_session, GTINItem)
+        gtin_upserter.upsert(gtin_key, gtin_row)
+        gtin_upserter.flush()
+        dirty = list(self.db_session.dirty)
+        self.db_session.commit()
+
+        changed_upserter = Upserter(self.db_session, GTINItem)
+        changed_upserter.upsert(gtin_key, {**gtin_row, "uom": "BOX"})
+        changed_upserter.finish()
+        self.db_session.commit()
+
+        for upserter in [contract_upserter, gtin_upserter]:
+            self.assertEqual(upserter.inserted_count, 0)
+            self.assertEqual(upserter.updated_count, 0)
+            self.assertEqual(upserter.unchanged_count, 1)
+        self.assertEqual(dirty, [])
+        self.assertEqual(changed_upserter.updated_count, 1)
+        self.assertEqual(self.db_session.query(GTINItem).one().uom, "BOX")
+
+    def test_upserter_compares_decimals(self):
+        """
+        Counts rows whose decimals only differ in trailing zeros as
+        unchanged whichever way they are written, and only sets the changed
+        columns.
+        """
+        inv_item = fake_inventory_item()
+        self.seed([inv_item])
+        contract_codes = [random_string(6) for _ in range(2)]
+        prices = {f"price_{level}": Decimal("1.0") for level in range(1, 7)}
+        gtin_row = {
+            "code": random_string(2),
+            "inventory_item_id": inv_item.id,
+            "uom": "EACH",
+            "conv_factor": Decimal("2.00"),
+        }
+
+        def upsert_rows(price_2: Decimal):
+            contract_upserter = Upserter(
+                self.db_session, ContractItem, batch_size=1)
+            for code in contract_codes:
+                contract_upserter.upsert((code, inv_item.id), {
+                    "code": code,
+                    "inventory_item_id": inv_item.id,
+                    **prices,
+                    "price_1": Decimal("1.00"),
+                    "price_2": price_2,
+                })
+            contract_upserter.finish()
+            gtin_upserter = Upserter(self.db_session, GTINItem)
+            gtin_upserter.upsert((gtin_row["code"], inv_item.id), gtin_row)
+            gtin_upserter.finish()
+            self.db_session.commit()
+            return contract_upserter, gtin_upserter
+
+        cold_upserter, _ = upsert_rows(Decimal("1.0"))
+        self.db_session.query(ContractItem).update({"price_1": "1.0"})
+        self.db_session.query(GTINItem).update({"conv_factor": "2.0"})
+        self.db_session.commit()
+        warm_upserter, gtin_upserter = upsert_rows(Decimal("1.0"))
+        changed_upserter, _ = upsert_rows(Decimal("2.0"))
+
+        self.assertTrue(cold_upserter.cold)
+        self.assertEqual(warm_upserter.unchanged_count, 2)
+        self.assertEqual(gtin_upserter.unchanged_count, 1)
+        self.assertEqual(changed_upserter.updated_count, 2)
+        stored = self.db_session.execute(text(
+            "SELECT price_1, price_2 FROM contract_items")).all()
+        self.assertEqual(stored, [("1.0", "2.0"), ("1.0", "2.0")])
+
+    def test_upserter_cold(self):
+        """
+        Loads empty tables through the raw connection, including rows
+        repeated across batches.
+        """
+        inv_item = fake_inventory_item()
+        self.seed([inv_item])
+        price = random_price()
+        contract_codes = [random_string(6) for _ in range(3)]
+        gtin_codes = [random_string(2) for _ in range(3)]
+
+        new_price = price + 1
+
+        contract_upserter = Upserter(
+            self.db_session, ContractItem, batch_size=2)
+        for index, code in enumerate(contract_codes + contract_codes[:1]):
+            contract_upserter.upsert((code, inv_item.id), {
+                "code": code,
+                "inventory_item_id": inv_item.id,
+                "price_1": new_price if index == 3 else price,
+                **{f"price_{level}": price for level in range(2, 7)},
+            })
+        contract_upserter.finish()
+        gtin_upserter = Upserter(self.db_session, GTINItem, batch_size=2)
+        for code in gtin_codes + gtin_codes[:1]:
+            gtin_upserter.upsert((code, inv_item.id), {
+                "code": code,
+                "inventory_item_id": inv_item.id,
+                "uom": "EACH",
+                "conv_factor": Decimal("2.5"),
+            })
+        gtin_upserter.finish()
+        self.db_session.commit()
+        warm_upserter = Upserter(self.db_session, ContractItem)
+
+        self.assertTrue(contract_upserter.cold)
+        self.assertTrue(gtin_upserter.cold)
+        self.assertFalse(warm_upserter.cold)
+        self.assertEqual(contract_upserter.inserted_count, 3)
+        self.assertEqual(contract_upserter.updated_count, 1)
+        self.assertEqual(gtin_upserter.inserted_count, 3)
+        self.assertEqual(gtin_upserter.updated_count, 0)
+        self.assertEqual(gtin_upserter.unchanged_count, 1)
+        contract_items = self.db_session.query(ContractItem).all()
+        gtin_items = self.db_session.query(GTINItem).all()
+        self.assertEqual(
+            sorted(con_item.code for con_item in contract_items),
+            sorted(contract_codes))
+        self.assertEqual(
+            sorted(gtin_item.code for gtin_item in gtin_items),
+            sorted(gtin_codes))
+        self.assertEqual(
+            sorted(con_item.price(1) for con_item in contract_items),
+            [price, price, new_price])
+        self.assertEqual(gtin_items[0].conv_factor, Decimal("2.5"))
+        self.assertEqual(gtin_items[0].inventory_item, inv_item)
+
+    def test_upserter_delta(self):
+        """
+        Writes only the inserted and changed rows on a delta import, and
+        removes records whose rows are no longer imported.
+        """
+        inv_item = fake_inventory_item()
+        self.seed([inv_item])
+        codes = [random_string(6) for _ in range(3)]
+        price = random_price()
+
+        def import_prices(prices):
+            upserter = Upserter(self.db_session, ContractItem, delta=True)
+            for code, price in prices.items():
+                upserter.upsert((code, inv_item.id), {
+                    "code": code,
+                    "inventory_item_id": inv_item.id,
+                    **{f"price_{level}": price for level in range(1, 7)},
+                })
+            upserter.finish()
+            self.db_session.commit()
+            return upserter
+
+        first = import_prices({code: price for code in codes})
+        new_price = price + 1
+        second = import_prices({
+            codes[0]: price,
+            codes[1]: new_price,
+            "NEW": price,
+        })
+
+        self.assertEqual(first.inserted_count, 3)
+        self.assertEqual(second.inserted_count, 1)
+        self.assertEqual(second.updated_count, 1)
+        self.assertEqual(second.unchanged_count, 1)
+        self.assertEqual(second.removed_count, 1)
+        contract_items = {
+            con_item.code: con_item
+            for con_item in self.db_session.query(ContractItem)}
+        self.assertEqual(
+            sorted(contract_items), sorted([codes[0], codes[1], "NEW"]))
+        self.assertEqual(contract_items[codes[1]].price(1), new_price)
+
+    def test_upserter_delta_removes_dependents(self):
+        """
+        Removes the records referring to removed records, so that they
+        don't attach to a new record given the same id.
+        """
+        inv_items = [fake_inventory_item(), fake_inventory_item()]
+        inv_item_rows = {
+            inv_item.code: {
+                column.key: getattr(inv_item, column.key)
+                for column in InventoryItem.__table__.columns
+                if column.key != "id"}
+            for inv_item in inv_items}
+        web_menu_item = fake_web_menu_item()
+        price = random_price()
+
+        def import_models(model, rows):
+            upserter = Upserter(self.db_session, model, delta=True)
+            for key, attributes in rows.items():
+                upserter.upsert(key, attributes)
+            upserter.finish()
+            self.db_session.commit()
+            return upserter
+
+        def import_inv_items(codes):
+            return import_models(InventoryItem, {
+                (code,): inv_item_rows[code] for code in codes})
+
+        def import_contract_items():
+            return import_models(ContractItem, {
+                ("CON", inv_item.id): {
+                    "code": "CON",
+                    "inventory_item_id": inv_item.id,
+                    **{f"price_{level}": price for level in range(1, 7)},
+                }
+                for inv_item in self.db_session.query(InventoryItem)})
+
+        import_inv_items(inv_item_rows)
+        import_models(WebMenuItem, {
+            (web_menu_item.parent_name, web_menu_item.child_name): {
+                "parent_name": web_menu_item.parent_name,
+                "child_name": web_menu_item.child_name,
+            }})
+        import_contract_items()
+        inv_item = self.db_session.query(InventoryItem).filter(
+            InventoryItem.code == inv_items[0].code).one()
+        self.seed([fake_inv_web_data_item(
+            inv_item, self.db_session.query(WebMenuItem).one())])
+
+        removed = import_inv_items([inv_items[0].code])
+        import_models(WebMenuItem, {})
+        contract_items = self.db_session.query(ContractItem).all()
+        web_data_item = self.db_session.query(InventoryWebDataItem).one()
+        import_inv_items(inv_item_rows)
+        reimported = import_contract_items()
+
+        self.assertEqual(removed.removed_count, 1)
+        self.assertEqual(
+            [con_item.inventory_item_id for con_item in contract_items],
+            [inv_item.id])
+        self.assertIsNone(web_data_item.web_menu_item_id)
+        self.assertEqual(reimported.inserted_count, 1)
+        self.assertEqual(reimported.unchanged_count, 1)
+
+    def test_upserter_delta_after_outside_change(self):
+        """
+        Writes unchanged rows again after their records were changed
+        outside of an import.
+        """
+        inv_item = fake_inventory_item()
+        self.seed([inv_item])
+        price = random_price()
+        attributes = {
+            "code": "CON",
+            "inventory_item_id": inv_item.id,
+            **{f"price_{level}": price for level in range(1, 7)},
+        }
+
+        def import_price():
+            upserter = Upserter(self.db_session, ContractItem, delta=True)
+            upserter.upsert(("CON", inv_item.id), attributes)
+            upserter.finish()
+            self.db_session.commit()
+            return upserter
+
+        with patch.dict(IMPORT_OPTIONS, {"delta": True}):
+            import_price()
+            contract_item = self.db_session.query(ContractItem).one()
+            contract_item.set_price(1, price + 1)
+            self.db_session.commit()
+            upserter = import_price()
+
+        self.assertEqual(upserter.updated_count, 1)
+        self.assertEqual(upserter.unchanged_count, 0)
+        self.assertEqual(contract_item.price(1), price)
+
+    def test_import_context(self):
+        """
+        Loads lookups once and adds the records inserted by upserters.
+        """
+        inv_item = fake_inventory_item()
+        web_menu_item = fake_web_menu_item()
+        self.seed([inv_item, web_menu_item])
+        context = ImportContext(self.db_session)
+
+        inv_item_ids = context.get_ids(InventoryItem)
+        inv_items = context.get_records(InventoryItem)
+        upserter = Upserter(self.db_session, InventoryItem, context=context)
+        new_item = fake_inventory_items_datagrid_row()
+        upserter.upsert((new_item["item_code"],), {
+            "code": new_item["item_code"],
+            "description_line_1": new_item["item_description"],
+            "uom": new_item["unit"],
+            "replacement_cost": new_item["replacement_cost"],
+            "item_type": new_item["status"],
+            "condition": new_item["condition"],
+        })
+        upserter.finish()
+
+        self.assertIs(context.get_ids(InventoryItem), inv_item_ids)
+        self.assertEqual(inv_item_ids[inv_item.code], inv_item.id)
+        self.assertIn(new_item["item_code"], inv_item_ids)
+        self.assertEqual(
+            inv_items[new_item["item_code"]].id,
+            inv_item_ids[new_item["item_code"]])
+        web_menu_item_name = (
+            f"{web_menu_item.parent_name}/{web_menu_item.child_name}")
+        self.assertEqual(
+            context.get_ids(WebMenuItem),
+            {web_menu_item_name: web_menu_item.id})
+
+    @patch("pxi.importers.iter_rows")
+    def test_import_web_menu_items(self, mock_iter_rows):
         """
         Import WebMenuItems from metadata spreadsheet.
         """
         filepath = random_string(20)
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_web_menu_items_row(),
         ]
 
         import_web_menu_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=WEB_MENU_ITEM_SCHEMA)
         # pylint:disable=no-member
         web_menu_items = self.db_session.query(WebMenuItem).all()
         self.assertEqual(len(web_menu_items), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_inventory_web_data_items(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_inventory_web_data_items(self, mock_iter_rows):
         """
         Import InventoryWebDataItems from Pronto datagrids.
         """
@@ -503,7 +1475,7 @@ class ImporterTests(DatabaseTestCase):
         ]
         wm_item = fake_web_menu_item()
         self.seed(inv_items + [wm_item])
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_inv_web_data_items_datagrid_row({
                 "stock_code": inv_items[0].code,
                 "menu_name": wm_item.name,
@@ -524,19 +1496,20 @@ class ImporterTests(DatabaseTestCase):
 
         import_inventory_web_data_items(filepath, self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=INVENTORY_WEB_DATA_ITEM_SCHEMA)
         # pylint:disable=no-member
         inv_web_data_items = self.db_session.query(
             InventoryWebDataItem).all()
         self.assertEqual(len(inv_web_data_items), 2)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_web_menu_item_mappings(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_web_menu_item_mappings(self, mock_iter_rows):
         """
         Import WebMenuItem mappings from metadata spreadsheet.
         """
         filepath = random_string(20)
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_web_menu_items_mappings_row(),
         ]
 
@@ -544,13 +1517,40 @@ class ImporterTests(DatabaseTestCase):
             filepath,
             self.db_session)
 
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=WEB_MENU_ITEM_MAPPING_SCHEMA)
         # pylint:disable=no-member
         web_menu_items = self.db_session.query(WebMenuItem).all()
         self.assertEqual(len(web_menu_item_mappings), 1)
 
-    @patch("pxi.importers.load_rows")
-    def test_import_missing_images_report(self, mock_load_rows):
+    @patch("pxi.importers.iter_rows")
+    def test_import_web_menu_item_mappings_resolves_names(
+            self, mock_iter_rows):
+        """
+        Looks up the mapped WebMenuItems together and logs unknown names.
+        """
+        web_menu_item = fake_web_menu_item()
+        self.seed([web_menu_item])
+        menu_name = f"{web_menu_item.parent_name}/{web_menu_item.child_name}"
+        mock_iter_rows.return_value = [
+            {"rule_code": "AA", "menu_name": menu_name},
+            {"rule_code": "BB", "menu_name": "man"},
+            {"rule_code": "CC", "menu_name": "Unknown/Menu"},
+        ]
+
+        with self.assertLogs(level="WARNING") as logs:
+            web_menu_item_mappings = import_web_menu_item_mappings(
+                random_string(20), self.db_session)
+
+        self.assertEqual(web_menu_item_mappings, {
+            "AA": web_menu_item,
+            "BB": "man",
+            "CC": None,
+        })
+        self.assertIn("1 unknown keys: Unknown/Menu.", logs.output[0])
+
+    @patch("pxi.importers.iter_rows")
+    def test_import_missing_images_report(self, mock_iter_rows):
         """
         Import list of items with missing product image.
         """
@@ -558,7 +1558,7 @@ class ImporterTests(DatabaseTestCase):
         image_filename = random_string(20)
         inv_item = fake_inventory_item()
         self.seed([inv_item])
-        mock_load_rows.return_value = [
+        mock_iter_rows.return_value = [
             fake_missing_images_report_row({
                 "item_code": inv_item.code,
             }),
@@ -569,7 +1569,30 @@ class ImporterTests(DatabaseTestCase):
             filepath, self.db_session)
 
         # Expect to import one image data record.
-        mock_load_rows.assert_called_with(filepath)
+        mock_iter_rows.assert_called_with(
+            filepath, schema=MISSING_IMAGES_REPORT_SCHEMA)
         # pylint:disable=no-member
         self.assertEqual(len(images_data), 1)
         self.assertEqual(images_data[0], inv_item)
+
+    @patch("pxi.importers.iter_rows")
+    def test_import_missing_images_report_with_context(self, mock_iter_rows):
+        """
+        Looks up items from a loaded import context and logs unknown codes.
+        """
+        inv_items = [fake_inventory_item() for _ in range(2)]
+        self.seed(inv_items)
+        context = ImportContext(self.db_session)
+        context.get_records(InventoryItem)
+        item_codes = [inv_items[1].code, "UNKNOWN", inv_items[0].code]
+        mock_iter_rows.return_value = [
+            fake_missing_images_report_row({"item_code": item_code})
+            for item_code in item_codes
+        ]
+
+        with self.assertLogs(level="WARNING") as logs:
+            images_data = import_missing_images_report(
+                random_string(20), self.db_session, context=context)
+
+        self.assertEqual(images_data, [inv_items[1], inv_items[0]])
+        self.assertIn("1 unknown keys: UNKNOWN.", logs.output[0])
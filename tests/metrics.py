@@ -0,0 +1,102 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from pxi.datagrid import iter_rows
+from pxi.metrics import (
+    INGEST_METRICS,
+    IngestMetrics,
+    collect_ingest_metrics,
+    get_ingest_metrics,
+    measure_import,
+    merge_ingest_metrics,
+    write_ingest_metrics)
+from tests import PXITestCase
+from tests.datagrid import write_workbook
+
+
+class MetricsTests(PXITestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.dict(INGEST_METRICS, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_iter_rows_records_parse(self):
+        """
+        Records the bytes and rows read from a datagrid and the time spent
+        parsing it.
+        """
+        with TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "datagrid.xlsx")
+            write_workbook(filepath, [["Code"], ["A"], ["B"]])
+
+            rows = list(iter_rows(filepath))
+            metrics = get_ingest_metrics(filepath)
+
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(metrics.rows, 2)
+            self.assertEqual(metrics.bytes_read, os.path.getsize(filepath))
+            self.assertGreater(metrics.parse_seconds, 0)
+
+    def test_measure_import(self):
+        """
+        Records the time spent importing apart from the time spent parsing.
+        """
+        filepath = "datagrid.xlsx"
+
+        @measure_import
+        def import_rows(filepath):
+            get_ingest_metrics(filepath).parse_seconds += 1000.0
+            get_ingest_metrics(filepath).rows += 5
+
+        with self.assertLogs(level="INFO") as logs:
+            import_rows(filepath)
+
+        metrics = get_ingest_metrics(filepath)
+        self.assertLess(metrics.apply_seconds, 1000.0)
+        self.assertIn("import_rows", logs.output[0])
+        self.assertIn("5 rows", logs.output[0])
+
+    def test_merge_collected_metrics(self):
+        """
+        Adds metrics collected in a worker process to the metrics here.
+        """
+        get_ingest_metrics("a.xlsx").rows = 3
+        collected = collect_ingest_metrics("a.xlsx")
+        self.assertNotIn("a.xlsx", INGEST_METRICS)
+
+        get_ingest_metrics("a.xlsx").rows = 2
+        merge_ingest_metrics(collected)
+        merge_ingest_metrics(None)
+
+        self.assertEqual(get_ingest_metrics("a.xlsx").rows, 5)
+
+    def test_write_ingest_metrics(self):
+        """
+        Appends one line of JSON for each command.
+        """
+        INGEST_METRICS["a.xlsx"] = IngestMetrics(
+            "a.xlsx", bytes_read=100, rows=10,
+            parse_seconds=1.0, apply_seconds=1.5)
+
+        with TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "metrics.json")
+            write_ingest_metrics(filepath, "price_calc")
+            write_ingest_metrics(filepath, "price_calc")
+            with open(filepath) as file:
+                lines = file.readlines()
+
+        self.assertEqual(len(lines), 2)
+        record = json.loads(lines[0])
+        self.assertEqual(record["command"], "price_calc")
+        self.assertEqual(record["files"], [{
+            "path": "a.xlsx",
+            "bytes_read": 100,
+            "rows": 10,
+            "parse_seconds": 1.0,
+            "apply_seconds": 1.5,
+            "rows_per_second": 4.0,
+        }])
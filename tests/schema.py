@@ -0,0 +1,105 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from pxi.enum import ItemCondition, PriceBasis
+from pxi.schema import (
+    DateConverter,
+    DecimalConverter,
+    EnumConverter,
+    IntConverter,
+    StrConverter,
+    convert_columns,
+    convert_rows,
+    get_converters,
+    keep_value)
+from tests import PXITestCase
+from tests.fakes import random_string
+
+
+class SchemaTests(PXITestCase):
+
+    def test_str_converter(self):
+        """
+        Converts numbers to strings and interns repeated short strings.
+        """
+        convert = StrConverter()
+        code = random_string(4)
+
+        self.assertIsNone(convert(None))
+        self.assertEqual(convert(1234), "1234")
+        self.assertEqual(convert(1.5), "1.5")
+        self.assertIs(convert(code), convert("".join([code])))
+
+    def test_int_converter(self):
+        """
+        Converts numbers and numeric strings to integers.
+        """
+        convert = IntConverter()
+
+        self.assertIsNone(convert(None))
+        self.assertIsNone(convert(""))
+        self.assertEqual(convert(5), 5)
+        self.assertEqual(convert(5.0), 5)
+        self.assertEqual(convert("7"), 7)
+        self.assertEqual(convert("7.0"), 7)
+
+    def test_decimal_converter(self):
+        """
+        Converts numbers to Decimals with the digits shown in the datagrid.
+        """
+        convert = DecimalConverter()
+
+        self.assertIsNone(convert(None))
+        self.assertIsNone(convert(""))
+        self.assertEqual(str(convert(1.1)), "1.1")
+        self.assertEqual(str(convert("12.50")), "12.50")
+        self.assertEqual(str(convert(1)), "1")
+        self.assertEqual(str(convert(1.0)), "1.0")
+        self.assertEqual(convert(Decimal("2.5")), Decimal("2.5"))
+
+    def test_date_converter(self):
+        """
+        Converts dates and ISO 8601 strings to datetimes.
+        """
+        convert = DateConverter()
+        value = datetime(2020, 1, 2, 3, 4)
+
+        self.assertIsNone(convert(None))
+        self.assertIs(convert(value), value)
+        self.assertEqual(convert(date(2020, 1, 2)), datetime(2020, 1, 2))
+        self.assertEqual(convert("2020-01-02T03:04:00"), value)
+        self.assertEqual(convert("02/01/2020 03:04"), value)
+        self.assertEqual(convert("02-Jan-2020"), datetime(2020, 1, 2))
+        with self.assertRaises(ValueError):
+            convert(1.5)
+
+    def test_enum_converter(self):
+        """
+        Looks up Enum members by value.
+        """
+        self.assertEqual(
+            EnumConverter(PriceBasis)("R1"), PriceBasis.RRP_INCL_TAX)
+        self.assertEqual(
+            EnumConverter(ItemCondition)(None), ItemCondition.NONE)
+        with self.assertRaises(ValueError):
+            EnumConverter(PriceBasis)("?")
+
+    def test_convert_rows_and_columns(self):
+        """
+        Converts rows and columns with the converter for each fieldname.
+        """
+        converters = get_converters(
+            ["code", "price", "other"],
+            {"code": StrConverter(), "price": DecimalConverter()})
+        rows = [(1, 2.5, "a"), ("B", None, None)]
+
+        self.assertIs(converters[2], keep_value)
+        self.assertEqual(list(convert_rows(rows, converters)), [
+            ("1", Decimal("2.5"), "a"),
+            ("B", None, None),
+        ])
+        self.assertEqual(convert_columns(list(zip(*rows)), converters), [
+            ["1", "B"],
+            [Decimal("2.5"), None],
+            ("a", None),
+        ])
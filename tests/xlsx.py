@@ -0,0 +1,86 @@
+from datetime import date, datetime, time
+import os
+from tempfile import TemporaryDirectory
+from openpyxl import Workbook, load_workbook
+
+from pxi.xlsx import column_index, iter_xlsx_rows
+from tests import PXITestCase
+from tests.fakes import random_string
+
+
+class XlsxReaderTests(PXITestCase):
+
+    def test_column_index(self):
+        """
+        Converts column letters to zero-based column indexes.
+        """
+        fixtures = [
+            ("A", 0),
+            ("Z", 25),
+            ("AA", 26),
+            ("AZ", 51),
+            ("BA", 52),
+        ]
+
+        for letters, index in fixtures:
+            self.assertEqual(column_index(letters), index)
+
+    def test_iter_xlsx_rows(self):
+        """
+        Reads the same values as openpyxl in read-only mode.
+        """
+        rows = [
+            ["Item Code", "Price", "Quantity", "Created", "Active", "Time"],
+            [random_string(10), 12.5, 3, datetime(2020, 1, 2), True,
+             time(9, 30)],
+            [random_string(10), None, -4, date(1999, 12, 31), False, None],
+            [None, 0.1, 1e20, None, None, None],
+        ]
+
+        with TemporaryDirectory() as dirname:
+            filepath = os.path.join(dirname, "workbook.xlsx")
+            workbook = Workbook()
+            worksheet = workbook.active
+            for row in rows:
+                worksheet.append(row)
+            # Leave a gap of one empty row, then add a sparse row.
+            worksheet.cell(6, 3, random_string(5))
+            workbook.save(filepath)
+
+            workbook = load_workbook(filepath, read_only=True)
+            expected_rows = [
+                trim(values) for values in
+                workbook.active.iter_rows(values_only=True)]
+            workbook.close()
+            result = [trim(values) for values in iter_xlsx_rows(filepath)]
+
+        self.assertEqual(len(result), 6)
+        self.assertEqual(result, expected_rows)
+
+    def test_iter_xlsx_rows_by_worksheet_name(self):
+        """
+        Reads rows from the named worksheet.
+        """
+        value = random_string(10)
+
+        with TemporaryDirectory() as dirname:
+            filepath = os.path.join(dirname, "workbook.xlsx")
+            workbook = Workbook()
+            workbook.active.append([random_string(10)])
+            worksheet = workbook.create_sheet("Other")
+            worksheet.append([value])
+            workbook.save(filepath)
+
+            result = list(iter_xlsx_rows(filepath, "Other"))
+
+        self.assertEqual(result, [(value,)])
+
+
+def trim(values):
+    """
+    Removes trailing empty values from a row.
+    """
+    values = list(values)
+    while values and values[-1] is None:
+        values.pop()
+    return tuple(values)